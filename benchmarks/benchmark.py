@@ -0,0 +1,322 @@
+"""Benchmark the download, decode and BMI hot paths of soilgrids.
+
+The benchmarks run against a local :class:`soilgrids.testing.server.WcsServer`,
+so they need no network access and are reproducible from one run to the next.
+Four groups are timed:
+
+* ``download``: ``SoilGrids.get_coverage_data`` end-to-end for several raster
+  sizes, along with its phases (capabilities, transfer, file write and
+  ``rioxarray.open_rasterio``).
+* ``bmi``: the ``BmiSoilGrids`` getters on large grids, with values held in
+  memory and read lazily from the file.
+* ``cache``: the queries of the spatial index of the coverage cache, with
+  a thousand cached coverages.
+* ``memory``: the peak memory allocated by the same operations.
+
+Results are written as JSON, which can be compared with the results of another
+version::
+
+    python benchmarks/benchmark.py --output new.json --compare old.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+import rioxarray
+import yaml
+from soilgrids import BmiSoilGrids
+from soilgrids import SoilGrids
+from soilgrids._version import __version__
+from soilgrids.cache import SpatialIndex
+from soilgrids.client import clients
+from soilgrids.soilgrids import _iter_response
+from soilgrids.testing.server import WcsServer
+
+WEST = -1784000
+NORTH = 1863000
+RES = 250
+
+
+def request_for(size: int, output: str) -> dict[str, object]:
+    """Return the parameters of a request for a ``size`` x ``size`` raster."""
+    return {
+        "service_id": "phh2o",
+        "coverage_id": "phh2o_0-5cm_mean",
+        "crs": "urn:ogc:def:crs:EPSG::152160",
+        "west": WEST,
+        "south": NORTH - size * RES,
+        "east": WEST + size * RES,
+        "north": NORTH,
+        "resx": RES,
+        "resy": RES,
+        "output": output,
+    }
+
+
+def timeit(func, repeat: int) -> list[float]:
+    """Call ``func`` ``repeat`` times and return the duration of each call."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def peak_memory(func) -> int:
+    """Return the peak memory, in bytes, allocated by one call to ``func``."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def result(group: str, name: str, size: int, durations: list[float], **extra):
+    return dict(
+        group=group,
+        name=name,
+        size=size,
+        repeat=len(durations),
+        min=min(durations),
+        median=statistics.median(durations),
+        mean=statistics.fmean(durations),
+        **extra,
+    )
+
+
+def memory_result(name: str, size: int, peak: int):
+    return {"group": "memory", "name": name, "size": size, "peak_memory": peak}
+
+
+def download_operations(size: int, workdir: str) -> dict[str, object]:
+    """Return the phases of a download of a ``size`` x ``size`` raster."""
+    request = request_for(size, os.path.join(workdir, f"coverage-{size}.tif"))
+    soilgrids = SoilGrids(cache_dir=os.path.join(workdir, "cache"))
+    check_args = [
+        request[key]
+        for key in ("service_id", "coverage_id", "crs", "west", "south", "east")
+    ] + [request["north"], RES, RES, None, None, None]
+    state = {}
+
+    def capabilities():
+        # cold start: parse the capabilities and describe the coverage
+        clients.clear()
+        soilgrids._capabilities.clear()
+        state["wcs"], state["context"] = soilgrids._check_request(*check_args)
+
+    def transfer():
+        context = state["context"]
+        response = state["wcs"].getCoverage(
+            identifier=context["coverage_id"],
+            crs=context["crs"],
+            bbox=context["bbox"],
+            resx=context["resx"],
+            resy=context["resy"],
+            response_crs=context["response_crs"],
+            format=context["format"],
+        )
+        state["content"] = b"".join(_iter_response(response))
+        response.close()
+
+    def write():
+        with open(request["output"], "wb") as fp:
+            fp.write(state["content"])
+
+    def open_rasterio():
+        rioxarray.open_rasterio(request["output"]).load().close()
+
+    def total():
+        soilgrids.get_coverage_data(**request).load()
+
+    capabilities()
+    transfer()
+    return {
+        "capabilities": capabilities,
+        "transfer": transfer,
+        "write": write,
+        "open_rasterio": open_rasterio,
+        "get_coverage_data": total,
+        "nbytes": len(state["content"]),
+    }
+
+
+def bmi_operations(size: int, workdir: str, lazy: bool) -> dict[str, object]:
+    """Return the getters of a BMI component on a ``size`` x ``size`` grid."""
+    conf = dict(
+        request_for(size, os.path.join(workdir, f"bmi-{size}.tif")),
+        cache_dir=os.path.join(workdir, "cache"),
+        lazy=lazy,
+    )
+    config_file = os.path.join(workdir, "config.yaml")
+    with open(config_file, "w") as fp:
+        yaml.safe_dump({"bmi-soilgrids": conf}, fp)
+
+    bmi = BmiSoilGrids()
+    bmi.initialize(config_file)
+
+    name = bmi.get_output_var_names()[0]
+    grid = bmi.get_var_grid(name)
+    dest = numpy.empty(bmi.get_grid_size(grid), dtype=bmi.get_var_type(name))
+    inds = numpy.random.default_rng(0).choice(
+        dest.size, min(10000, dest.size), replace=False
+    )
+    inds_dest = numpy.empty(inds.size, dtype=dest.dtype)
+    shape = numpy.empty(bmi.get_grid_rank(grid), dtype=int)
+    bmi.get_grid_shape(grid, shape)
+    x = numpy.empty(shape[-1])
+    y = numpy.empty(shape[-2])
+
+    operations = {
+        "get_value": lambda: bmi.get_value(name, dest),
+        "get_value_at_indices": lambda: bmi.get_value_at_indices(name, inds_dest, inds),
+        "get_grid_x": lambda: bmi.get_grid_x(grid, x),
+        "get_grid_y": lambda: bmi.get_grid_y(grid, y),
+    }
+    if not lazy:
+        # a lazily read variable is cached by its first get_value_ptr call
+        operations["get_value_ptr"] = lambda: bmi.get_value_ptr(name)
+    return operations
+
+
+def cache_operations(count: int, workdir: str) -> dict[str, object]:
+    """Return the queries of a spatial index holding ``count`` coverages."""
+    index = SpatialIndex(os.path.join(workdir, "spatial-index.json"))
+    columns = math.ceil(math.sqrt(count))
+    # 100 x 100 pixel coverages, side by side
+    index.rebuild(
+        {
+            str(i): cache_request((i % columns) * 100, (i // columns) * 100, 100)
+            for i in range(count)
+        }
+    )
+    # a window inside one of the coverages in the middle of the grid
+    middle = columns // 2 * 100
+    request = cache_request(middle + 10, middle + 10, 50)
+
+    return {
+        "contains": lambda: index.contains(request),
+        "coverage_fraction": lambda: index.coverage_fraction(request),
+    }
+
+
+def cache_request(col: int, row: int, size: int) -> dict[str, object]:
+    """Return the cache request of a ``size`` x ``size`` window of a grid."""
+    west = WEST + col * RES
+    north = NORTH - row * RES
+    return {
+        "service_url": "http://localhost/mapserv?map=/map/phh2o.map",
+        "service_id": "phh2o",
+        "coverage_id": "phh2o_0-5cm_mean",
+        "crs": "urn:ogc:def:crs:EPSG::152160",
+        "bbox": (west, north - size * RES, west + size * RES, north),
+        "resx": RES,
+        "resy": RES,
+        "width": None,
+        "height": None,
+        "response_crs": "urn:ogc:def:crs:EPSG::152160",
+        "format": "GEOTIFF_INT16",
+    }
+
+
+def run(sizes: list[int], repeat: int, workdir: str) -> list[dict[str, object]]:
+    results = []
+    with WcsServer() as server:
+        SoilGrids.MAP_SERVICES = server.map_services()
+
+        for size in sizes:
+            operations = download_operations(size, workdir)
+            nbytes = operations.pop("nbytes")
+            for name, func in operations.items():
+                results.append(
+                    result("download", name, size, timeit(func, repeat), nbytes=nbytes)
+                )
+                results.append(
+                    memory_result(f"download.{name}", size, peak_memory(func))
+                )
+
+            for lazy in (False, True):
+                operations = bmi_operations(size, workdir, lazy)
+                prefix = "lazy." if lazy else ""
+                for name, func in operations.items():
+                    results.append(
+                        result("bmi", prefix + name, size, timeit(func, repeat))
+                    )
+                    results.append(
+                        memory_result(f"bmi.{prefix}{name}", size, peak_memory(func))
+                    )
+
+        clients.clear()
+
+    for name, func in cache_operations(1000, workdir).items():
+        results.append(result("cache", name, 1000, timeit(func, repeat)))
+    return results
+
+
+def compare(results: list[dict], baseline: list[dict]) -> None:
+    """Print the ratio of the median times of results to a baseline."""
+    previous = {(item["group"], item["name"], item["size"]): item for item in baseline}
+    print(f"{'benchmark':48} {'size':>6} {'baseline':>10} {'current':>10} {'ratio':>6}")
+    for item in results:
+        old = previous.get((item["group"], item["name"], item["size"]))
+        if old is None:
+            continue
+        key = "peak_memory" if item["group"] == "memory" else "median"
+        ratio = item[key] / old[key] if old[key] else float("nan")
+        print(
+            f"{item['group'] + '.' + item['name']:48} {item['size']:>6}"
+            f" {old[key]:>10.4g} {item[key]:>10.4g} {ratio:>6.2f}"
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="256,1024,2048",
+        help="comma-separated raster sizes, in pixels per side",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="timings per benchmark")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results to compare with")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run(
+            [int(size) for size in args.sizes.split(",")], args.repeat, workdir
+        )
+
+    report = {
+        "soilgrids": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(results, json.load(fp)["results"])
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+import importlib
+from typing import TYPE_CHECKING
+
 from soilgrids._version import __version__
-from soilgrids.bmi import BmiSoilGrids
 from soilgrids.exceptions import SoilGridsError
 from soilgrids.exceptions import SoilGridsWcsError
-from soilgrids.soilgrids import SoilGrids
+
+if TYPE_CHECKING:
+    from soilgrids.bmi import BmiSoilGrids
+    from soilgrids.soilgrids import SoilGrids
 
 __all__ = [
     "__version__",
@@ -13,3 +18,22 @@ __all__ = [
     "SoilGridsError",
     "SoilGridsWcsError",
 ]
+
+# the geospatial stack (rasterio, owslib, bmipy, ...) is only imported once
+# one of these is first used, so that importing soilgrids stays cheap
+_LAZY_ATTRS = {
+    "BmiSoilGrids": "soilgrids.bmi",
+    "SoilGrids": "soilgrids.soilgrids",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRS:
+        value = getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
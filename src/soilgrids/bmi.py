@@ -1,8 +1,10 @@
 from __future__ import annotations
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy
+import rasterio
 import yaml
 from bmipy import Bmi
 from soilgrids.soilgrids import SoilGrids
@@ -15,6 +17,14 @@ BmiGridUniformRectilinear = namedtuple(
     "BmiGridUniformRectilinear", ["shape", "yx_spacing", "yx_of_lower_left"]
 )
 
+# grids of soil profiles, with depth as the z axis
+BmiGridRectilinear = namedtuple("BmiGridRectilinear", ["shape"])
+
+# where the raw values of a variable are read from and how they are scaled
+BmiSource = namedtuple(
+    "BmiSource", ["tif_file", "band", "scale_factor", "add_offset", "nodata"]
+)
+
 
 class BmiSoilGrids(Bmi):
     def __init__(self) -> None:
@@ -22,6 +32,9 @@ class BmiSoilGrids(Bmi):
         self._output_var_names = ()
         self._var = {}
         self._grid = {}
+        self._values = {}
+        self._sources = {}
+        self._coords = {}
 
     def finalize(self) -> None:
         """Perform tear-down tasks for the model.
@@ -31,9 +44,11 @@ class BmiSoilGrids(Bmi):
         """
         self._var = {}
         self._grid = {}
+        self._values = {}
+        self._sources = {}
         self._input_var_names = ()
         self._output_var_names = ()
-        self._dataset = None
+        self._coords = {}
 
     def get_component_name(self) -> str:
         """Name of the component.
@@ -190,6 +205,8 @@ class BmiSoilGrids(Bmi):
             The input numpy array that holds the coordinates of the grid's
             lower-left corner.
         """
+        if not isinstance(self._grid[grid], BmiGridUniformRectilinear):
+            raise NotImplementedError("get_grid_origin")
         origin[:] = self._grid[grid].yx_of_lower_left
         return origin
 
@@ -250,6 +267,8 @@ class BmiSoilGrids(Bmi):
         ndarray of float
             The input numpy array that holds the grid's spacing.
         """
+        if not isinstance(self._grid[grid], BmiGridUniformRectilinear):
+            raise NotImplementedError("get_grid_spacing")
         spacing[:] = self._grid[grid].yx_spacing
 
         return spacing
@@ -265,6 +284,8 @@ class BmiSoilGrids(Bmi):
         str
             Type of grid as a string.
         """
+        if isinstance(self._grid[grid], BmiGridRectilinear):
+            return "rectilinear"
         return "uniform_rectilinear"
 
     def get_grid_x(self, grid: int, x: numpy.ndarray) -> numpy.ndarray:
@@ -280,7 +301,7 @@ class BmiSoilGrids(Bmi):
         ndarray of float
             The input numpy array that holds the grid's column x-coordinates.
         """
-        x[:] = self._dataset.x.values
+        x[:] = self._coords[grid]["x"]
         return x
 
     def get_grid_y(self, grid: int, y: numpy.ndarray) -> numpy.ndarray:
@@ -296,7 +317,7 @@ class BmiSoilGrids(Bmi):
         ndarray of float
             The input numpy array that holds the grid's row y-coordinates.
         """
-        y[:] = self._dataset.y.values
+        y[:] = self._coords[grid]["y"]
         return y
 
     def get_grid_z(self, grid: int, z: numpy.ndarray) -> numpy.ndarray:
@@ -312,7 +333,11 @@ class BmiSoilGrids(Bmi):
         ndarray of float
             The input numpy array that holds the grid's layer z-coordinates.
         """
-        raise NotImplementedError("get_grid_z")
+        # layers of soil profiles are at the mid-depth (cm) of their interval
+        if "z" not in self._coords[grid]:
+            raise NotImplementedError("get_grid_z")
+        z[:] = self._coords[grid]["z"]
+        return z
 
     def get_input_var_names(self) -> tuple[str]:
         """List of a model's input variables.
@@ -412,7 +437,10 @@ class BmiSoilGrids(Bmi):
             The same numpy array that was passed as an input buffer.
         """
         # return all the value at current time step, for scalar it is just one value
-        dest[:] = self.get_value_ptr(name).reshape(-1).copy()
+        if name in self._values:
+            dest[:] = self._values[name].reshape(-1)
+        else:
+            dest[:] = self._read_values(name).reshape(-1)
         return dest
 
     def get_value_at_indices(
@@ -434,7 +462,15 @@ class BmiSoilGrids(Bmi):
         """
         # return the value at current time step with given index in 1D or
         # 2D grid. when it is scalar no need for ind
-        dest[:] = self.get_value_ptr(name).reshape(-1)[inds]
+        if name in self._values:
+            dest[:] = self._values[name].reshape(-1)[inds]
+        else:
+            # lazily backed: read the blocks holding the indices and only scale
+            # the gathered values
+            source = self._sources[name]
+            shape = self._grid[self._var[name].grid].shape
+            raw = _read_at_indices(source.tif_file, source.band, shape, inds)
+            dest[:] = _scale(raw, source, self._var[name].dtype)
         return dest
 
     def get_value_ptr(self, name: str) -> numpy.ndarray:
@@ -453,10 +489,9 @@ class BmiSoilGrids(Bmi):
         """
         # return a reference of all the value at current time step. mainly
         # for input data. not useful for scalar value
-        add_offset = self._dataset.add_offset
-        scale_factor = self._dataset.scale_factor
-
-        return self._dataset[0].values * scale_factor + add_offset
+        if name not in self._values:
+            self._values[name] = self._read_values(name)
+        return self._values[name]
 
     def get_var_grid(self, name: str) -> int:
         """Get grid identifier for the given variable.
@@ -599,36 +634,116 @@ class BmiSoilGrids(Bmi):
                 "output": "test.tif",
             }
 
-        soilgrids = SoilGrids()
-        self._dataset = soilgrids.get_coverage_data(**conf)
-
-        self._output_var_names = (soilgrids.metadata["variable_name"],)
-
-        array = self._dataset[0].values
-        self._grid = {
-            0: BmiGridUniformRectilinear(
-                shape=[int(dim) for dim in array.shape],
-                yx_spacing=(
-                    soilgrids.metadata["grid_res"][1],
-                    soilgrids.metadata["grid_res"][0],
-                ),  # original grid_res is (x,y)
-                yx_of_lower_left=(
-                    self._dataset.coords["y"].values[-1],
-                    self._dataset.coords["x"].values[0],
-                ),
-            ),
+        dtype = numpy.dtype(conf.pop("dtype", "float64"))
+        if not numpy.issubdtype(dtype, numpy.floating):
+            # missing values are set to NaN and scale factors are applied
+            raise ValueError(
+                "Please provide a floating point dtype, such as float32 or"
+                f" float64, instead of {dtype}."
+            )
+        max_downloads = conf.pop("max_downloads", 4)
+        cache_options = {
+            "cache_dir": conf.pop("cache_dir", None),
+            "capabilities_ttl": conf.pop("capabilities_ttl", 86400),
+            "coverage_cache_size": conf.pop("coverage_cache_size", 2**30),
         }
 
-        self._var[self._output_var_names[0]] = BmiVar(
-            dtype=str(array.dtype),
-            itemsize=array.itemsize,
-            nbytes=array.nbytes,  # nbytes for current time step value
-            units=soilgrids.metadata[
-                "variable_units"
-            ],  # TODO: translate var name into CSDMS standard name
-            location="node",  # scalar value has no location on a grid (node, face, edge)
-            grid=0,  # grid id number
-        )
+        # each item of "coverages" holds the parameters of one variable, on top
+        # of the parameters they share. items with "depths" are soil profiles.
+        coverages = conf.pop("coverages", None)
+        if coverages:
+            # coverages are downloaded at the same time and each needs a file
+            # of its own, so an output shared by all of them is ignored
+            conf.pop("output", None)
+        else:
+            coverages = [{}]
+        coverage_requests = [dict(conf, **coverage) for coverage in coverages]
+        _set_outputs(coverage_requests)
+        given_names = [request.pop("name", None) for request in coverage_requests]
+
+        with ThreadPoolExecutor(max_workers=max_downloads) as executor:
+            results = list(
+                executor.map(
+                    lambda request: _fetch(request, cache_options), coverage_requests
+                )
+            )
+
+        names = [
+            name or soilgrids.metadata["variable_name"]
+            for name, (soilgrids, _) in zip(given_names, results)
+        ]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(
+                "Please provide a unique name for each coverage of the same"
+                f" variable: {', '.join(duplicates)}."
+            )
+
+        self._output_var_names = tuple(names)
+        self._sources = {}
+        self._values = {}
+        self._var = {}
+        self._grid = {}
+        self._coords = {}
+        grid_ids = {}
+
+        for name, request, (soilgrids, dataset) in zip(
+            names, coverage_requests, results
+        ):
+            # soil profiles are (depth, y, x) arrays, one band per depth
+            is_profile = "depth" in dataset.dims
+            layers = dataset if is_profile else dataset[0]
+
+            self._sources[name] = BmiSource(
+                tif_file=soilgrids.tif_file,
+                band=None if is_profile else 1,
+                scale_factor=dataset.scale_factor,
+                add_offset=dataset.add_offset,
+                nodata=dataset.rio.nodata,
+            )
+
+            # values are scaled to physical units once, so that get_value_ptr
+            # can hand out the same buffer on every call. lazily backed values
+            # are only read when they are asked for.
+            if not (request.get("lazy", False) or request.get("chunks") is not None):
+                self._values[name] = _scale(layers.values, self._sources[name], dtype)
+
+            # variables on the same grid share its id and coordinates
+            coords = {"y": dataset.coords["y"].values, "x": dataset.coords["x"].values}
+            if is_profile:
+                coords["z"] = (
+                    dataset.coords["depth_top"].values
+                    + dataset.coords["depth_bottom"].values
+                ) / 2
+                grid = BmiGridRectilinear(shape=[int(dim) for dim in layers.shape])
+            else:
+                grid = BmiGridUniformRectilinear(
+                    shape=[int(dim) for dim in layers.shape],
+                    yx_spacing=(
+                        soilgrids.metadata["grid_res"][1],
+                        soilgrids.metadata["grid_res"][0],
+                    ),  # original grid_res is (x,y)
+                    yx_of_lower_left=(coords["y"][-1], coords["x"][0]),
+                )
+            grid_key = (
+                tuple(grid.shape),
+                soilgrids.metadata["crs"],
+            ) + tuple(tuple(values) for values in coords.values())
+            if grid_key not in grid_ids:
+                grid_ids[grid_key] = len(grid_ids)
+                self._grid[grid_ids[grid_key]] = grid
+                self._coords[grid_ids[grid_key]] = coords
+
+            self._var[name] = BmiVar(
+                dtype=str(dtype),
+                itemsize=dtype.itemsize,
+                nbytes=dtype.itemsize * int(numpy.prod(grid.shape)),  # time step
+                units=soilgrids.metadata[
+                    "variable_units"
+                ],  # TODO: translate var name into CSDMS standard name
+                location="node",  # scalar value has no location on a grid
+                grid=grid_ids[grid_key],  # grid id number
+            )
 
     def set_value(self, name: str, values: numpy.ndarray) -> None:
         """Specify a new value for a model variable.
@@ -679,3 +794,105 @@ class BmiSoilGrids(Bmi):
             A model time later than the current model time.
         """
         raise NotImplementedError("update_until")
+
+    def _read_values(self, name: str) -> numpy.ndarray:
+        source = self._sources[name]
+        with rasterio.open(source.tif_file) as src:
+            raw = src.read(source.band)
+        return _scale(raw, source, self._var[name].dtype)
+
+
+def _scale(raw: numpy.ndarray, source: BmiSource, dtype: str) -> numpy.ndarray:
+    """Convert raw values to physical units, with nodata values set to NaN."""
+    values = raw.astype(dtype)
+    values *= source.scale_factor
+    values += source.add_offset
+    if source.nodata is not None:
+        values[raw == source.nodata] = numpy.nan
+    return values
+
+
+def _read_at_indices(
+    tif_file: str, band: int | None, shape: list[int], inds: numpy.ndarray
+) -> numpy.ndarray:
+    """Read the raw values of a band at flat indices, one block at a time.
+
+    With ``band=None``, the file holds one band per layer of a rank-3 grid.
+    Only the blocks of the file that hold at least one of the indices are read.
+    """
+    inds = numpy.asarray(inds, dtype=int)
+    if band is None:
+        layers, rows, cols = numpy.unravel_index(inds, shape)
+        bands = layers + 1
+    else:
+        rows, cols = numpy.unravel_index(inds, shape)
+        bands = numpy.full(len(inds), band)
+
+    with rasterio.open(tif_file) as src:
+        if len(inds) == 0:
+            return numpy.empty(0, dtype=src.dtypes[0])
+        block_height, block_width = src.block_shapes[0]
+        block_rows = rows // block_height
+        block_cols = cols // block_width
+        blocks = (bands * (-(-shape[-2] // block_height)) + block_rows) * (
+            -(-shape[-1] // block_width)
+        ) + block_cols
+
+        raw = numpy.empty(len(inds), dtype=src.dtypes[0])
+        order = numpy.argsort(blocks, kind="stable")
+        starts = numpy.flatnonzero(numpy.diff(blocks[order], prepend=-1))
+        for selection in numpy.split(order, starts[1:]):
+            first = selection[0]
+            window = src.block_window(
+                int(bands[first]), block_rows[first], block_cols[first]
+            )
+            block = src.read(int(bands[first]), window=window)
+            raw[selection] = block[
+                rows[selection] - window.row_off, cols[selection] - window.col_off
+            ]
+
+    return raw
+
+
+def _fetch(request: dict, cache_options: dict):
+    """Download the coverage, or soil profile, of one variable."""
+    # map services are reached through the client registry shared by all
+    # SoilGrids instances of the process
+    soilgrids = SoilGrids(**cache_options)
+    if "depths" in request:
+        request = {
+            key: value
+            for key, value in request.items()
+            if key not in ("lazy", "chunks", "tiled")
+        }
+        if request["depths"] == "all":
+            request["depths"] = None
+        return soilgrids, soilgrids.get_coverage_depths(**request)
+    return soilgrids, soilgrids.get_coverage_data(**request)
+
+
+def _set_outputs(requests: list[dict]) -> None:
+    """Give every coverage request an output file of its own."""
+    outputs = [request["output"] for request in requests if request.get("output")]
+    duplicates = sorted({output for output in outputs if outputs.count(output) > 1})
+    if duplicates:
+        raise ValueError(
+            "Please provide a unique output file for each coverage:"
+            f" {', '.join(duplicates)}."
+        )
+
+    # default file names are numbered when several coverages would share one
+    taken = set(outputs)
+    for request in requests:
+        if "depths" in request:
+            request.pop("coverage_id", None)
+            stem = f"{request['service_id']}_{request.get('statistic', 'mean')}"
+        else:
+            stem = request["coverage_id"]
+        if not request.get("output"):
+            output, count = f"{stem}.tif", 1
+            while output in taken:
+                count += 1
+                output = f"{stem}_{count}.tif"
+            request["output"] = output
+            taken.add(output)
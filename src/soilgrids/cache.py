@@ -0,0 +1,893 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import rasterio
+import requests
+from owslib.coverage.wcsBase import WCSCapabilitiesReader
+from owslib.crs import Crs
+from owslib.etree import etree
+from owslib.wcs import WebCoverageService
+from rasterio.windows import Window
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+CoverageInfo = namedtuple("CoverageInfo", ["supportedCRS", "boundingboxes"])
+
+# guards read-modify-write cycles of coverage cache index files between the
+# threads of a process, along with a lock file between processes
+_index_lock = threading.Lock()
+
+# parameters that a cached coverage and a request must share to be on one grid
+GRID_PARAMETERS = ("service_url", "service_id", "coverage_id", "crs", "format")
+
+# number of downloads recorded in a coverage cache index without a copy
+MAX_REFERENCES = 1000
+
+
+def default_cache_dir() -> str:
+    """Return the directory used for the on-disk caches.
+
+    The ``SOILGRIDS_CACHE_DIR`` environment variable takes precedence, then
+    ``$XDG_CACHE_HOME/soilgrids`` and finally ``~/.cache/soilgrids``.
+    """
+    if os.environ.get("SOILGRIDS_CACHE_DIR"):
+        return os.environ["SOILGRIDS_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "soilgrids")
+
+
+class CapabilitiesCache:
+    """On-disk cache of the WCS capabilities of the SoilGrids map services.
+
+    Each map service gets one JSON file holding the GetCapabilities document,
+    its coverage list and, as they are requested, the supported CRS and bounding
+    boxes of individual coverages (which otherwise require a DescribeCoverage
+    request each). Entries are revalidated against the server once they are
+    older than ``ttl`` seconds; coverage descriptions are kept if the
+    capabilities document did not change.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory to store the cache in. Defaults to :func:`default_cache_dir`.
+    ttl : float, optional
+        Time, in seconds, after which an entry is revalidated.
+    """
+
+    def __init__(self, cache_dir: str | None = None, ttl: float = 86400.0) -> None:
+        self._cache_dir = os.path.join(cache_dir or default_cache_dir(), "capabilities")
+        self._ttl = ttl
+        self._entries = {}
+
+    @property
+    def cache_dir(self) -> str:
+        return self._cache_dir
+
+    @property
+    def ttl(self) -> float:
+        return self._ttl
+
+    def get_service(
+        self, service_id: str, link: str, session: requests.Session | None = None
+    ) -> tuple[WebCoverageService, list[str]]:
+        """Return the WCS client and coverage list of a map service.
+
+        If given, ``session`` is used to download the capabilities document.
+        An expired entry is still used when the server cannot be reached.
+        """
+        entry = self._load(service_id, link)
+
+        if entry is None or self._is_expired(entry):
+            try:
+                if session is None:
+                    wcs = WebCoverageService(link, version="1.0.0")
+                else:
+                    wcs = WebCoverageService(
+                        link, version="1.0.0", xml=_read_capabilities(link, session)
+                    )
+            except (requests.ConnectionError, requests.Timeout):
+                if entry is None:
+                    raise
+                wcs = WebCoverageService(link, version="1.0.0", xml=entry["xml"])
+                return wcs, list(entry["coverage_list"])
+            xml = _capabilities_to_string(wcs)
+            digest = hashlib.sha256(xml.encode("utf-8")).hexdigest()
+            coverages = (
+                entry["coverages"]
+                if entry is not None and entry["digest"] == digest
+                else {}
+            )
+            entry = {
+                "link": link,
+                "fetched_at": time.time(),
+                "digest": digest,
+                "xml": xml,
+                "coverage_list": list(wcs.contents),
+                "coverages": coverages,
+            }
+            self._dump(service_id, entry)
+        else:
+            wcs = WebCoverageService(link, version="1.0.0", xml=entry["xml"])
+
+        return wcs, list(entry["coverage_list"])
+
+    def get_coverage(
+        self, service_id: str, wcs: WebCoverageService, coverage_id: str
+    ) -> CoverageInfo:
+        """Return the supported CRS and bounding boxes of a coverage."""
+        # the entry was validated against the service link by ``get_service``
+        entry = self._load(service_id)
+        if entry is not None and coverage_id in entry["coverages"]:
+            info = entry["coverages"][coverage_id]
+            return CoverageInfo(
+                supportedCRS=[Crs(code) for code in info["supported_crs"]],
+                boundingboxes=[
+                    {"nativeSrs": bbox["nativeSrs"], "bbox": tuple(bbox["bbox"])}
+                    for bbox in info["bounding_boxes"]
+                ],
+            )
+
+        coverage_obj = wcs.contents[coverage_id]
+        info = CoverageInfo(
+            supportedCRS=list(coverage_obj.supportedCRS),
+            boundingboxes=list(coverage_obj.boundingboxes),
+        )
+        if entry is not None:
+            entry["coverages"][coverage_id] = {
+                "supported_crs": [crs.getcodeurn() for crs in info.supportedCRS],
+                "bounding_boxes": [
+                    {"nativeSrs": bbox["nativeSrs"], "bbox": list(bbox["bbox"])}
+                    for bbox in info.boundingboxes
+                ],
+            }
+            self._dump(service_id, entry)
+
+        return info
+
+    def clear(self) -> None:
+        """Remove all cached entries."""
+        if os.path.isdir(self._cache_dir):
+            for name in os.listdir(self._cache_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self._cache_dir, name))
+
+    def _path(self, service_id: str) -> str:
+        return os.path.join(self._cache_dir, f"{service_id}.json")
+
+    def _is_expired(self, entry: dict) -> bool:
+        return time.time() - entry["fetched_at"] > self._ttl
+
+    def _load(self, service_id: str, link: str | None = None) -> dict | None:
+        # entries are kept in memory for as long as their file is unchanged
+        try:
+            mtime = os.stat(self._path(service_id)).st_mtime_ns
+            if self._entries.get(service_id, (None,))[0] == mtime:
+                entry = self._entries[service_id][1]
+            else:
+                with open(self._path(service_id)) as fp:
+                    entry = json.load(fp)
+                self._entries[service_id] = (mtime, entry)
+        except (OSError, ValueError):
+            return None
+        return entry if link is None or entry.get("link") == link else None
+
+    def _dump(self, service_id: str, entry: dict) -> None:
+        # an unwritable cache directory only costs us the cache, not the request
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            _atomic_write_json(self._path(service_id), entry)
+            self._entries[service_id] = (
+                os.stat(self._path(service_id)).st_mtime_ns,
+                entry,
+            )
+        except OSError:
+            pass
+
+
+class CoverageCache:
+    """Size-bounded, content-addressed cache of downloaded coverages.
+
+    Coverages are stored as GeoTIFF files named after a hash of the request
+    that produced them (see :func:`request_key`), so a cached file is only
+    ever served for exactly the same service, coverage, bounding box,
+    resolution/size and CRS. A small JSON index records the size, digest and
+    last access time of every file; when the cache grows beyond ``max_size``
+    bytes, the least recently used files are removed.
+
+    Downloads that are not copied into the cache, because they were not
+    requested from it or are larger than ``max_size``, are still recorded by
+    the path and digest of the downloaded file. Such references take no space
+    in the cache, but let :meth:`fetch` reuse the file for as long as it is
+    unchanged; only the ``MAX_REFERENCES`` most recently used are kept.
+
+    The cache can be shared by several processes: files are published with
+    an atomic rename, updates of the index are serialized with a lock file
+    and :meth:`lock` lets processes wait for each other's download of a
+    coverage instead of downloading it again.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory to store the cache in. Defaults to :func:`default_cache_dir`.
+    max_size : int, optional
+        Maximum total size of the cached files, in bytes.
+    """
+
+    def __init__(self, cache_dir: str | None = None, max_size: int = 2**30) -> None:
+        self._cache_dir = os.path.join(cache_dir or default_cache_dir(), "coverages")
+        self._max_size = max_size
+        self._spatial = SpatialIndex(
+            os.path.join(self._cache_dir, "spatial-index.json")
+        )
+
+    @property
+    def cache_dir(self) -> str:
+        return self._cache_dir
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def __contains__(self, key: str) -> bool:
+        with self._locked_index():
+            return key in self._read_index()
+
+    def fetch(self, key: str, output: str) -> bool:
+        """Make ``output`` a copy of a cached coverage.
+
+        Returns ``True`` if ``key`` is cached, in which case ``output`` is
+        only written to if it does not already hold the cached file. A
+        recorded download is only used while ``output``, or the file it was
+        downloaded to, still holds it.
+        """
+        with self._locked_index():
+            index = self._read_index()
+            entry = index.get(key)
+            if entry is None:
+                return False
+            if "path" not in entry and not os.path.isfile(self._path(key)):
+                del index[key]
+                self._write_index(index)
+                self._spatial_index().remove(key)
+                return False
+            if "path" not in entry:
+                entry["last_access"] = time.time()
+                self._write_index(index)
+
+        if "path" in entry:
+            found = self._fetch_reference(entry, output)
+            with self._locked_index():
+                index = self._read_index()
+                if index.get(key) == entry:
+                    if found:
+                        index[key]["last_access"] = time.time()
+                    else:
+                        del index[key]
+                    self._write_index(index)
+            return found
+
+        if not (os.path.isfile(output) and file_digest(output) == entry["digest"]):
+            _atomic_copy(self._path(key), output)
+
+        return True
+
+    def crop(self, request: dict[str, object], output: str) -> bool:
+        """Write the part of a cached coverage that ``request`` asks for to ``output``.
+
+        Only requests by resolution, in the coordinate system of their bounding
+        box, can be served this way: the cached coverage must have been
+        requested the same way, at the same resolution, and its grid must
+        hold the bounding box of the request on pixel boundaries. Returns
+        ``True`` if such a coverage was found.
+        """
+        request = _canonical(request)
+        if not _is_grid_request(request):
+            return False
+
+        # the smallest coverage that holds the request is the fastest to read
+        with self._locked_index():
+            keys = self._spatial_index().contains(request)
+        for key in keys:
+            try:
+                if not _crop_file(self._path(key), request, output):
+                    continue
+            except (OSError, rasterio.errors.RasterioError):
+                continue
+            with self._locked_index():
+                index = self._read_index()
+                if key in index:
+                    index[key]["last_access"] = time.time()
+                    self._write_index(index)
+            return True
+
+        return False
+
+    def coverage_fraction(self, request: dict[str, object]) -> float:
+        """Return the fraction of the bounding box of a request that is cached.
+
+        Only cached coverages with the grid and resolution of the request, and
+        whose pixel edges its bounding box falls on, are taken into account:
+        the parts of the request they cover are those :meth:`crop` can serve.
+        """
+        with self._locked_index():
+            return self._spatial_index().coverage_fraction(request)
+
+    @contextlib.contextmanager
+    def lock(self, key: str):
+        """Hold the lock of a cache key, across threads and processes.
+
+        Used as a context manager around checking the cache for a coverage
+        and downloading it, so that only one process downloads it while the
+        others wait and then copy it from the cache. A disabled cache
+        (``max_size=0``) has nothing to share, and its keys are not locked.
+        """
+        if self._max_size <= 0:
+            yield
+            return
+        with _file_lock(self._lock_path(key)):
+            yield
+
+    def put(self, key: str, path: str, request: dict[str, object]) -> None:
+        """Add the coverage stored at ``path`` to the cache.
+
+        A file larger than ``max_size``, or that cannot be copied, is only
+        recorded (see :meth:`record`).
+        """
+        size = os.path.getsize(path)
+        if size > self._max_size:
+            self.record(key, path, request)
+            return
+
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            _atomic_copy(path, self._path(key))
+        except OSError:
+            self.record(key, path, request)
+            return
+
+        with self._locked_index():
+            index = self._read_index()
+            index[key] = {
+                "size": size,
+                "digest": file_digest(path),
+                "last_access": time.time(),
+                "request": _canonical(request),
+            }
+            spatial = self._spatial_index()
+            spatial.add(key, request)
+            for evicted in self._evict(index):
+                spatial.remove(evicted)
+            self._write_index(index)
+
+    def record(self, key: str, path: str, request: dict[str, object]) -> None:
+        """Record the coverage stored at ``path`` without copying it.
+
+        :meth:`fetch` then reuses the file for as long as it is unchanged. A
+        copy of the coverage already in the cache is kept instead.
+        """
+        try:
+            digest = file_digest(path)
+            os.makedirs(self._cache_dir, exist_ok=True)
+        except OSError:
+            return
+
+        with self._locked_index():
+            index = self._read_index()
+            if key in index and "path" not in index[key]:
+                return
+            index[key] = {
+                "size": 0,
+                "digest": digest,
+                "last_access": time.time(),
+                "request": _canonical(request),
+                "path": os.path.abspath(path),
+            }
+            self._evict(index)
+            self._write_index(index)
+
+    def clear(self) -> None:
+        """Remove all cached coverages."""
+        with self._locked_index():
+            for key, entry in self._read_index().items():
+                if "path" not in entry and os.path.isfile(self._path(key)):
+                    os.remove(self._path(key))
+            self._write_index({})
+            self._spatial.rebuild({})
+
+    def _evict(self, index: dict) -> list[str]:
+        # references are not in the spatial index, only evicted copies are
+        # returned
+        evicted = []
+        by_access = sorted(index, key=lambda k: index[k]["last_access"])
+        copies = [key for key in by_access if "path" not in index[key]]
+        references = [key for key in by_access if "path" in index[key]]
+
+        total = sum(index[key]["size"] for key in copies)
+        for key in copies:
+            if total <= self._max_size:
+                break
+            total -= index.pop(key)["size"]
+            evicted.append(key)
+            if os.path.isfile(self._path(key)):
+                os.remove(self._path(key))
+
+        for key in references[: max(len(references) - MAX_REFERENCES, 0)]:
+            del index[key]
+        return evicted
+
+    def _fetch_reference(self, entry: dict, output: str) -> bool:
+        digest = entry["digest"]
+        if os.path.isfile(output) and file_digest(output) == digest:
+            return True
+        path = entry["path"]
+        if not (os.path.isfile(path) and file_digest(path) == digest):
+            return False
+        try:
+            _atomic_copy(path, output)
+        except OSError:
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def _locked_index(self):
+        with _index_lock, _file_lock(self._lock_path("index")):
+            yield
+
+    def _spatial_index(self) -> SpatialIndex:
+        # the index is rebuilt from the cache index if it is missing, such as
+        # in caches written by older versions
+        if not self._spatial.load():
+            self._spatial.rebuild(
+                {
+                    key: entry["request"]
+                    for key, entry in self._read_index().items()
+                    if "path" not in entry
+                }
+            )
+        return self._spatial
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, f"{key}.tif")
+
+    def _lock_path(self, name: str) -> str:
+        return os.path.join(self._cache_dir, "locks", f"{name}.lock")
+
+    def _read_index(self) -> dict:
+        try:
+            with open(os.path.join(self._cache_dir, "index.json")) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index: dict) -> None:
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            _atomic_write_json(os.path.join(self._cache_dir, "index.json"), index)
+        except OSError:
+            pass
+
+
+class SpatialIndex:
+    """Persistent grid bucket index of the bounding boxes of cached coverages.
+
+    Coverages are grouped by the parameters that define their grid (see
+    :data:`GRID_PARAMETERS`) and resolution, and, within a group, registered
+    in every square bucket of ``bucket_pixels`` pixels that their bounding
+    box overlaps. Coverages that span more than ``max_buckets`` buckets are
+    kept apart and checked by every query, which stays cheap since the size
+    of the coverage cache bounds how many of them there can be. A query only
+    looks at the coverages of the buckets its own bounding box overlaps. The
+    bounding boxes are stored in a JSON file and the buckets are rebuilt in
+    memory whenever the file changes.
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSON file of the index.
+    bucket_pixels : int, optional
+        Width and height of a bucket, in pixels.
+    max_buckets : int, optional
+        Number of buckets above which a coverage is checked by every query.
+    """
+
+    def __init__(
+        self, path: str, bucket_pixels: int = 512, max_buckets: int = 64
+    ) -> None:
+        self._path = path
+        self._bucket_pixels = bucket_pixels
+        self._max_buckets = max_buckets
+        self._mtime = None
+        self._groups = {}
+        self._buckets = {}
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def __len__(self) -> int:
+        return sum(len(group["entries"]) for group in self._groups.values())
+
+    def __contains__(self, key: str) -> bool:
+        return any(key in group["entries"] for group in self._groups.values())
+
+    def load(self) -> bool:
+        """Read the index file if it changed, returning ``False`` if it is missing."""
+        try:
+            mtime = os.stat(self._path).st_mtime_ns
+            if mtime == self._mtime:
+                return True
+            with open(self._path) as fp:
+                self._set_groups(json.load(fp)["groups"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self._mtime = None
+            return False
+        self._mtime = mtime
+        return True
+
+    def rebuild(self, requests: dict[str, dict]) -> None:
+        """Replace the content of the index with cached requests, by key."""
+        self._set_groups({})
+        for key, request in requests.items():
+            self._add(key, request)
+        self._dump()
+
+    def add(self, key: str, request: dict[str, object]) -> None:
+        """Register the bounding box of a cached coverage."""
+        self.remove(key, dump=False)
+        self._add(key, _canonical(request))
+        self._dump()
+
+    def remove(self, key: str, dump: bool = True) -> None:
+        """Forget a cached coverage."""
+        for group, content in self._groups.items():
+            if key in content["entries"]:
+                bbox = content["entries"].pop(key)
+                for bucket in self._bucket_range(group, bbox) or [None]:
+                    self._buckets[group][bucket].discard(key)
+                if dump:
+                    self._dump()
+                return
+
+    def contains(self, request: dict[str, object]) -> list[str]:
+        """Return the coverages on the grid of a request that hold its bounding box.
+
+        Only coverages whose pixel grid the bounding box of the request falls
+        on are returned, sorted from the smallest to the largest.
+        """
+        group, (west, south, east, north) = self._query(request)
+        entries = self._groups.get(group, {}).get("entries", {})
+        keys = [
+            key
+            for key in self._aligned(group, (west, south, east, north))
+            if entries[key][0] <= west
+            and entries[key][1] <= south
+            and east <= entries[key][2]
+            and north <= entries[key][3]
+        ]
+        return sorted(keys, key=lambda key: _area(entries[key]))
+
+    def intersects(self, request: dict[str, object]) -> list[str]:
+        """Return the coverages on the grid of a request that overlap it."""
+        group, bbox = self._query(request)
+        entries = self._groups.get(group, {}).get("entries", {})
+        return sorted(
+            key
+            for key in self._candidates(group, bbox)
+            if _intersection(entries[key], bbox) is not None
+        )
+
+    def coverage_fraction(self, request: dict[str, object]) -> float:
+        """Return the fraction of the bounding box of a request that is cached.
+
+        Only coverages whose pixel grid the bounding box of the request falls
+        on are counted, as only those can be cropped.
+        """
+        group, bbox = self._query(request)
+        if _area(bbox) <= 0:
+            return 0.0
+        entries = self._groups.get(group, {}).get("entries", {})
+        boxes = [
+            _intersection(entries[key], bbox) for key in self._aligned(group, bbox)
+        ]
+        return _union_area([box for box in boxes if box is not None]) / _area(bbox)
+
+    def _query(self, request):
+        request = _canonical(request)
+        if not _is_grid_request(request):
+            return None, (0.0, 0.0, 0.0, 0.0)
+        return _grid_group(request), tuple(request["bbox"])
+
+    def _aligned(self, group, bbox):
+        # the candidates whose pixel edges the west and north edges of bbox
+        # fall on, which cache._crop_file checks in the same way
+        candidates = self._candidates(group, bbox)
+        if not candidates:
+            return candidates
+        resx, resy = self._groups[group]["resolution"]
+        entries = self._groups[group]["entries"]
+        return {
+            key
+            for key in candidates
+            if _on_pixel_edge((bbox[0] - entries[key][0]) / resx)
+            and _on_pixel_edge((entries[key][3] - bbox[3]) / resy)
+        }
+
+    def _candidates(self, group, bbox):
+        if group not in self._buckets:
+            return set()
+        buckets = self._buckets[group]
+        bucket_range = self._bucket_range(group, bbox)
+        if bucket_range is None:
+            return set(self._groups[group]["entries"])
+        keys = set(buckets.get(None, ()))
+        for bucket in bucket_range:
+            keys.update(buckets.get(bucket, ()))
+        return keys
+
+    def _bucket_range(self, group, bbox):
+        # None if the bounding box spans too many buckets to list them
+        resx, resy = self._groups[group]["resolution"]
+        size_x = self._bucket_pixels * resx
+        size_y = self._bucket_pixels * resy
+        west, south, east, north = bbox
+        cols = range(math.floor(west / size_x), math.floor(east / size_x) + 1)
+        rows = range(math.floor(south / size_y), math.floor(north / size_y) + 1)
+        if len(cols) * len(rows) > self._max_buckets:
+            return None
+        return [(col, row) for col in cols for row in rows]
+
+    def _register(self, group, key, bbox):
+        buckets = self._buckets.setdefault(group, {})
+        for bucket in self._bucket_range(group, bbox) or [None]:
+            buckets.setdefault(bucket, set()).add(key)
+
+    def _add(self, key, request):
+        if not _is_grid_request(request):
+            return
+        group = _grid_group(request)
+        content = self._groups.setdefault(
+            group, {"resolution": [request["resx"], request["resy"]], "entries": {}}
+        )
+        content["entries"][key] = list(request["bbox"])
+        self._register(group, key, content["entries"][key])
+
+    def _set_groups(self, groups):
+        self._groups = groups
+        self._buckets = {}
+        for group, content in groups.items():
+            self._buckets[group] = {}
+            for key, bbox in content["entries"].items():
+                self._register(group, key, bbox)
+
+    def _dump(self):
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            _atomic_write_json(self._path, {"groups": self._groups})
+            self._mtime = os.stat(self._path).st_mtime_ns
+        except OSError:
+            pass
+
+
+def request_key(request: dict[str, object]) -> str:
+    """Return the cache key of a coverage request.
+
+    The key is a hash of the canonical JSON representation of the request, in
+    which all numbers are floats, so that, for instance, ``west=-1784000`` and
+    ``west=-1784000.0`` give the same key.
+    """
+    payload = json.dumps(_canonical(request), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """Return the SHA-256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _canonical(value: object) -> object:
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def _is_grid_request(request: dict) -> bool:
+    return bool(
+        request.get("resx")
+        and request.get("resy")
+        and request.get("response_crs") in (None, request.get("crs"))
+    )
+
+
+def _grid_group(request: dict) -> str:
+    """Return the key of the group of coverages on the grid of a request."""
+    return request_key(
+        {
+            name: request.get(name)
+            for name in GRID_PARAMETERS + ("resx", "resy", "response_crs")
+        }
+    )
+
+
+def _on_pixel_edge(offset: float) -> bool:
+    return math.isclose(offset, round(offset), abs_tol=1e-6)
+
+
+def _area(bbox) -> float:
+    west, south, east, north = bbox
+    return max(east - west, 0.0) * max(north - south, 0.0)
+
+
+def _intersection(bbox, other):
+    west, south = max(bbox[0], other[0]), max(bbox[1], other[1])
+    east, north = min(bbox[2], other[2]), min(bbox[3], other[3])
+    return (west, south, east, north) if west < east and south < north else None
+
+
+def _union_area(boxes) -> float:
+    """Return the area covered by a set of bounding boxes."""
+    xs = sorted({x for box in boxes for x in (box[0], box[2])})
+    area = 0.0
+    for west, east in zip(xs, xs[1:]):
+        # merge the intervals of the boxes that span this vertical strip
+        intervals = sorted(
+            (box[1], box[3]) for box in boxes if box[0] <= west and east <= box[2]
+        )
+        covered, top = 0.0, -math.inf
+        for south, north in intervals:
+            if north > top:
+                covered += north - max(south, top)
+                top = north
+        area += covered * (east - west)
+    return area
+
+
+def _crop_file(path: str, request: dict, output: str) -> bool:
+    """Write the window of a GeoTIFF file that a request asks for to output."""
+    west, south, east, north = request["bbox"]
+    # same raster size as MapServer gives to a request by resolution
+    width = int((east - west) / request["resx"] + 0.5)
+    height = int((north - south) / request["resy"] + 0.5)
+
+    with rasterio.open(path) as src:
+        col = (west - src.transform.c) / src.transform.a
+        row = (north - src.transform.f) / src.transform.e
+        if not (
+            math.isclose(abs(src.transform.a), request["resx"])
+            and math.isclose(abs(src.transform.e), request["resy"])
+            and _on_pixel_edge(col)
+            and _on_pixel_edge(row)
+        ):
+            return False
+        window = Window(round(col), round(row), width, height)
+        if (
+            window.col_off < 0
+            or window.row_off < 0
+            or window.col_off + width > src.width
+            or window.row_off + height > src.height
+        ):
+            return False
+
+        profile = src.profile
+        profile.update(
+            width=width,
+            height=height,
+            transform=src.window_transform(window),
+            tiled=False,
+        )
+        profile.pop("blockxsize", None)
+        profile.pop("blockysize", None)
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(output)), prefix=".", suffix=".tif.part"
+        )
+        os.close(fd)
+        try:
+            with rasterio.open(tmp, "w", **profile) as dst:
+                dst.write(src.read(window=window))
+                dst.scales = src.scales
+                dst.offsets = src.offsets
+                dst.descriptions = src.descriptions
+            os.replace(tmp, output)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    return True
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """Hold an exclusive lock on a file, blocking until it is free.
+
+    The lock is released when its file is closed, so it cannot outlive a
+    process that crashes while holding it. If the lock file cannot be
+    created, as in a read-only cache directory, the block runs unlocked:
+    the cache is then not written to anyway.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fp = open(path, "a+b")
+    except OSError:
+        yield
+        return
+
+    with fp:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        else:
+            fp.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+            else:
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _read_capabilities(link: str, session: requests.Session) -> bytes:
+    url = WCSCapabilitiesReader("1.0.0").capabilities_url(link)
+    response = session.get(url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
+def _capabilities_to_string(wcs: WebCoverageService) -> str:
+    return etree.tostring(wcs._capabilities, encoding="unicode")
+
+
+def _atomic_write_json(path: str, obj: object) -> None:
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=".", suffix=".json.part"
+    )
+    try:
+        with os.fdopen(fd, "w") as fp:
+            json.dump(obj, fp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _atomic_copy(src: str, dst: str) -> None:
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(dst)), prefix=".", suffix=".tif.part"
+    )
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        os.remove(tmp)
+        raise
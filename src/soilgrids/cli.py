@@ -1,15 +1,62 @@
 from __future__ import annotations
 
+import csv
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import click
+import yaml
 from soilgrids._version import __version__
 from soilgrids.exceptions import SoilGridsError
-from soilgrids.soilgrids import SoilGrids
 
+# types of the get_coverage_data parameters that a CSV manifest gives as text
+MANIFEST_TYPES = {
+    "west": float,
+    "south": float,
+    "east": float,
+    "north": float,
+    "resx": float,
+    "resy": float,
+    "width": float,
+    "height": float,
+    "max_workers": int,
+    "local_file": bool,
+    "tiled": bool,
+    "resilient": bool,
+    "cog": bool,
+}
 
-@click.command()
+
+class _DefaultGroup(click.Group):
+    """A command group that runs its "download" command unless told otherwise.
+
+    This keeps ``soilgrids --service_id=... output.tif`` working next to
+    ``soilgrids batch manifest.yaml``.
+    """
+
+    def parse_args(self, ctx, args):
+        if (
+            args
+            and args[0] not in self.commands
+            and args[0]
+            not in (
+                "--help",
+                "--version",
+            )
+        ):
+            args = ["download"] + list(args)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=_DefaultGroup)
 @click.version_option(version=__version__)
+def main():
+    """Fetch global gridded soil information from the SoilGrids system."""
+
+
+@main.command()
 @click.option(
     "--service_id",
     required=True,
@@ -88,10 +135,57 @@ from soilgrids.soilgrids import SoilGrids
     required=False,
     type=bool,
     default=False,
-    help="Indicate whether to load existing local file. Default as False.",
+    help=(
+        "Indicate whether to reuse the output file or the coverage cache when "
+        "the same request was downloaded before. Default as False."
+    ),
+)
+@click.option(
+    "--tiled",
+    required=False,
+    type=bool,
+    default=False,
+    help=(
+        "Indicate whether to download a large bounding box as tiles that are"
+        " fetched concurrently and mosaicked into the output file. Default as False."
+    ),
+)
+@click.option(
+    "--max_workers",
+    required=False,
+    type=int,
+    default=4,
+    help="Maximum number of tiles downloaded at the same time. Default as 4.",
+)
+@click.option(
+    "--resilient",
+    required=False,
+    type=bool,
+    default=False,
+    help=(
+        "Indicate whether to retry failed requests and to split requests that are"
+        " too large for the server. Default as False."
+    ),
+)
+@click.option(
+    "--cog",
+    required=False,
+    type=bool,
+    default=False,
+    help=(
+        "Indicate whether to write the output as a cloud-optimized GeoTiff with"
+        " internal tiles, compression and overviews. Default as False."
+    ),
+)
+@click.option(
+    "--compress",
+    required=False,
+    type=click.Choice(["DEFLATE", "ZSTD", "LZW"], case_sensitive=False),
+    default="DEFLATE",
+    help="Compression method of a cloud-optimized GeoTiff. Default as DEFLATE.",
 )
 @click.argument("output", type=click.Path(exists=False))
-def main(
+def download(
     service_id,
     coverage_id,
     crs,
@@ -102,8 +196,16 @@ def main(
     height,
     response_crs,
     local_file,
+    tiled,
+    max_workers,
+    resilient,
+    cog,
+    compress,
     output,
 ):
+    """Download a coverage to the OUTPUT GeoTiff file (the default command)."""
+    from soilgrids.soilgrids import SoilGrids
+
     west, south, east, north = list(map(float, bbox.split(",")))
     try:
         SoilGrids().get_coverage_data(
@@ -121,8 +223,135 @@ def main(
             height=height,
             response_crs=response_crs,
             local_file=local_file,
+            tiled=tiled,
+            max_workers=max_workers,
+            resilient=resilient,
+            cog=cog,
+            compress=compress,
         )
     except SoilGridsError as exc:
         raise click.ClickException(str(exc)) from exc
     if os.path.isfile(output):
         print("Done")
+
+
+@main.command()
+@click.option(
+    "--workers",
+    required=False,
+    type=int,
+    default=4,
+    help="Number of requests processed at the same time. Default as 4.",
+)
+@click.option(
+    "--summary",
+    required=False,
+    default=None,
+    type=click.Path(exists=False),
+    help="CSV file to write the per-request summary to.",
+)
+@click.argument("manifest", type=click.Path(exists=True))
+def batch(workers, summary, manifest):
+    """Download the coverages listed in a YAML or CSV MANIFEST.
+
+    Each request of the manifest holds the parameters of get_coverage_data
+    (with either a bbox or west, south, east and north). A YAML manifest is a
+    list of requests, or a mapping with "requests" and shared "defaults".
+    """
+    try:
+        manifest_requests = _load_manifest(manifest)
+    except (OSError, ValueError, yaml.YAMLError) as exc:
+        raise click.ClickException(f"Unable to read {manifest}: {exc}") from exc
+
+    from soilgrids.soilgrids import SoilGrids
+
+    # one SoilGrids instance per worker; they all share the capabilities
+    # cache and the HTTP sessions of the process-wide client registry
+    local = threading.local()
+
+    def run(request):
+        if not hasattr(local, "soilgrids"):
+            local.soilgrids = SoilGrids()
+        start = time.perf_counter()
+        try:
+            local.soilgrids.get_coverage_data(**dict(request, lazy=True))
+        except Exception as exc:
+            status = "failed"
+            error = (str(exc).splitlines() or [type(exc).__name__])[0]
+        else:
+            status, error = "ok", ""
+        return {
+            "output": request.get("output", ""),
+            "status": status,
+            "bytes": (
+                os.path.getsize(request["output"])
+                if status == "ok" and os.path.isfile(request["output"])
+                else 0
+            ),
+            "duration": round(time.perf_counter() - start, 3),
+            "error": error,
+        }
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run, manifest_requests))
+
+    for index, result in enumerate(results):
+        print(
+            f"{index:>4} {result['status']:<6} {result['bytes']:>12} B"
+            f" {result['duration']:>9.3f} s  {result['output']}"
+            + (f"  ({result['error']})" if result["error"] else "")
+        )
+    if summary:
+        with open(summary, "w", newline="") as fp:
+            writer = csv.DictWriter(
+                fp, fieldnames=["output", "status", "bytes", "duration", "error"]
+            )
+            writer.writeheader()
+            writer.writerows(results)
+
+    failed = sum(result["status"] != "ok" for result in results)
+    if failed:
+        raise click.ClickException(f"{failed} of {len(results)} requests failed.")
+    print("Done")
+
+
+def _load_manifest(path: str) -> list[dict[str, object]]:
+    """Read the requests of a YAML or CSV batch manifest."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="") as fp:
+            manifest_requests = [
+                {
+                    key: _parse_value(key, value)
+                    for key, value in row.items()
+                    if value not in (None, "")
+                }
+                for row in csv.DictReader(fp)
+            ]
+    else:
+        with open(path) as fp:
+            data = yaml.safe_load(fp) or []
+        if isinstance(data, dict):
+            defaults = data.get("defaults") or {}
+            data = [dict(defaults, **request) for request in data.get("requests", [])]
+        manifest_requests = list(data)
+
+    for request in manifest_requests:
+        if not isinstance(request, dict):
+            raise ValueError(f"invalid request {request!r}")
+        bbox = request.pop("bbox", None)
+        if bbox is not None:
+            if isinstance(bbox, str):
+                bbox = bbox.split(",")
+            request["west"], request["south"], request["east"], request["north"] = (
+                float(value) for value in bbox
+            )
+
+    return manifest_requests
+
+
+def _parse_value(key: str, value: str) -> object:
+    if MANIFEST_TYPES.get(key) is bool:
+        if value.strip().lower() not in ("true", "false", "1", "0", "yes", "no"):
+            raise ValueError(f"invalid value for {key}: {value!r}")
+        return value.strip().lower() in ("true", "1", "yes")
+    return MANIFEST_TYPES.get(key, str)(value)
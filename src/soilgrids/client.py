@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from owslib.util import makeString
+from owslib.util import ServiceException
+from requests.adapters import HTTPAdapter
+
+
+class WcsClient:
+    """A WCS 1.0.0 client for one SoilGrids map service.
+
+    The client parses the capabilities of the service once and sends all of its
+    GetCoverage requests through one :class:`requests.Session`, so that
+    connections to the server are kept alive and reused between requests.
+    It exposes the parts of :class:`owslib.wcs.WebCoverageService` that
+    :class:`soilgrids.SoilGrids` relies on (``url``, ``contents`` and
+    ``getCoverage``).
+
+    Parameters
+    ----------
+    service_id : str
+        Map service identifier.
+    link : str
+        URL of the map service.
+    capabilities : CapabilitiesCache
+        Cache to read the capabilities of the service from.
+    pool_size : int, optional
+        Maximum number of connections kept open to the server.
+    """
+
+    def __init__(self, service_id, link, capabilities, pool_size=10):
+        self._service_id = service_id
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._wcs, self._coverage_list = capabilities.get_service(
+            service_id, link, session=self._session
+        )
+        self._created_at = time.monotonic()
+
+    @property
+    def service_id(self):
+        return self._service_id
+
+    @property
+    def url(self):
+        return self._wcs.url
+
+    @property
+    def contents(self):
+        return self._wcs.contents
+
+    @property
+    def coverage_list(self):
+        return list(self._coverage_list)
+
+    @property
+    def session(self):
+        return self._session
+
+    @property
+    def age(self):
+        """Time, in seconds, since the capabilities of the client were loaded."""
+        return time.monotonic() - self._created_at
+
+    def getCoverage(
+        self,
+        identifier=None,
+        bbox=None,
+        format=None,
+        crs=None,
+        width=None,
+        height=None,
+        resx=None,
+        resy=None,
+        response_crs=None,
+        timeout=30,
+    ):
+        """Request a coverage and return the response as a file-like object."""
+        try:
+            base_url = next(
+                method.get("url")
+                for method in self._wcs.getOperationByName("GetCoverage").methods
+                if method.get("type").lower() == "get"
+            )
+        except (KeyError, StopIteration):
+            base_url = self._wcs.url
+
+        params = {
+            "version": "1.0.0",
+            "request": "GetCoverage",
+            "service": "WCS",
+            "Coverage": identifier,
+            "BBox": ",".join(makeString(value) for value in bbox) if bbox else None,
+            "crs": crs,
+            "format": format,
+            "width": width,
+            "height": height,
+            "resx": resx,
+            "resy": resy,
+            "response_crs": response_crs,
+        }
+
+        response = self._session.get(
+            base_url,
+            params={key: value for key, value in params.items() if value},
+            timeout=timeout,
+            stream=True,
+        )
+
+        # same status handling as owslib.util.openURL
+        if response.status_code in (400, 401, 403):
+            text = response.text
+            response.close()
+            raise ServiceException(text)
+        if response.status_code >= 404:
+            response.close()
+            response.raise_for_status()
+
+        return _CoverageResponse(response)
+
+    def close(self):
+        self._session.close()
+
+
+class ClientRegistry:
+    """A thread-safe, size-bounded pool of :class:`WcsClient` instances.
+
+    Clients are keyed by service id and link and are shared by everyone using
+    the registry. When the registry is full, the least recently used client is
+    closed and dropped. A client is rebuilt once its capabilities are older
+    than the time-to-live of the capabilities cache that asks for it.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of clients to hold.
+    pool_size : int, optional
+        Maximum number of connections each client keeps open.
+    """
+
+    def __init__(self, maxsize=16, pool_size=10):
+        self._maxsize = maxsize
+        self._pool_size = pool_size
+        self._clients = OrderedDict()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clients)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._clients
+
+    def get(self, service_id, link, capabilities):
+        """Return the client of a map service, creating it if needed."""
+        key = (service_id, link)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # one lock per service so that concurrent callers wait for a single
+        # capabilities download rather than each starting their own
+        with key_lock:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is not None and client.age <= capabilities.ttl:
+                    self._clients.move_to_end(key)
+                    return client
+
+            new_client = WcsClient(
+                service_id, link, capabilities, pool_size=self._pool_size
+            )
+
+            with self._lock:
+                stale = self._clients.pop(key, None)
+                self._clients[key] = new_client
+                evicted = []
+                while len(self._clients) > self._maxsize:
+                    evicted.append(self._clients.popitem(last=False)[1])
+
+        for old_client in [stale] + evicted:
+            if old_client is not None:
+                old_client.close()
+
+        return new_client
+
+    def clear(self):
+        """Close and drop all clients."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+
+class _CoverageResponse:
+    """File-like wrapper around a streamed GetCoverage response."""
+
+    def __init__(self, response):
+        self._response = response
+
+    def info(self):
+        return self._response.headers
+
+    def read(self):
+        return self._response.content
+
+    def iter_content(self, chunk_size):
+        return self._response.iter_content(chunk_size)
+
+    def close(self):
+        self._response.close()
+
+    def geturl(self):
+        return self._response.url
+
+
+clients = ClientRegistry()
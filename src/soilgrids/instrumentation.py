@@ -0,0 +1,149 @@
+"""Timing hooks for the phases of SoilGrids coverage requests.
+
+A hook is any callable that takes a :class:`Span`. Once registered, it is
+called at the end of every phase of :meth:`soilgrids.SoilGrids.get_coverage_data`:
+
+``capabilities``
+    Loading the capabilities of the map service and the description of the
+    coverage, from the cache or from the server.
+``cache``
+    Copying a coverage from the coverage cache (``local_file=True``).
+``render``
+    Waiting for the server to answer a GetCoverage request, up to the
+    response headers, which is mostly the time the server takes to render it.
+``transfer``
+    Reading the body of the response and writing it to the output file.
+``mosaic``
+    Merging the tiles of a tiled or split request.
+``cog``
+    Rewriting the output file as a cloud-optimized GeoTIFF (``cog=True``).
+``open``
+    Opening the output file with :func:`rioxarray.open_rasterio`.
+
+Tiled requests report one ``render`` and one ``transfer`` span per tile, from
+the threads that download them, so hooks must be thread-safe. When no hook is
+registered, the phases are not timed at all.
+
+>>> from soilgrids import instrumentation
+>>> spans = []
+>>> with instrumentation.hook(spans.append):
+...     with instrumentation.span("open", {"coverage_id": "phh2o_0-5cm_mean"}):
+...         pass
+>>> [(span.name, span.request["coverage_id"]) for span in spans]
+[('open', 'phh2o_0-5cm_mean')]
+"""
+from __future__ import annotations
+
+import contextlib
+import threading
+import time
+from collections import namedtuple
+
+Span = namedtuple("Span", ["name", "start", "duration", "nbytes", "request", "error"])
+Span.__doc__ = """A timed phase of a coverage request.
+
+Attributes
+----------
+name
+    Name of the phase.
+start
+    Time, in seconds since the epoch, at which the phase started.
+duration
+    Duration of the phase, in seconds.
+nbytes
+    Number of bytes transferred or written during the phase.
+request
+    The request context of the coverage request (service/coverage ids, CRS,
+    bbox, resolution/size, etc.).
+error
+    The exception that ended the phase, or ``None`` if it succeeded.
+"""
+
+_hooks = ()
+_lock = threading.Lock()
+
+
+def add_hook(hook) -> None:
+    """Register a callable to be called with every :class:`Span`."""
+    global _hooks
+    with _lock:
+        _hooks = _hooks + (hook,)
+
+
+def remove_hook(hook) -> None:
+    """Unregister a callable registered with :func:`add_hook`."""
+    global _hooks
+    with _lock:
+        hooks = list(_hooks)
+        hooks.remove(hook)
+        _hooks = tuple(hooks)
+
+
+@contextlib.contextmanager
+def hook(hook):
+    """Register a hook for the duration of a ``with`` block."""
+    add_hook(hook)
+    try:
+        yield hook
+    finally:
+        remove_hook(hook)
+
+
+def span(name: str, request: dict[str, object] | None = None):
+    """Time a phase of a request as a context manager.
+
+    The returned object has a ``request`` attribute, which can be updated once
+    the request context is known, and an ``add_bytes`` method to count the
+    bytes transferred. Without registered hooks, a shared no-op object is
+    returned.
+    """
+    if not _hooks:
+        return _NULL_SPAN
+    return _TimedSpan(name, request)
+
+
+class _TimedSpan:
+    def __init__(self, name, request):
+        self.name = name
+        self.request = request
+        self.nbytes = 0
+
+    def add_bytes(self, nbytes):
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        self._start = time.time()
+        self._counter = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        record = Span(
+            name=self.name,
+            start=self._start,
+            duration=time.perf_counter() - self._counter,
+            nbytes=self.nbytes,
+            request=dict(self.request or {}),
+            error=exc,
+        )
+        for hook in _hooks:
+            hook(record)
+        return False
+
+
+class _NullSpan:
+    request = None
+
+    def add_bytes(self, nbytes):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
@@ -0,0 +1,189 @@
+"""Export SoilGrids coverages to NetCDF4 files."""
+from __future__ import annotations
+
+import numpy
+from soilgrids.exceptions import SoilGridsError
+
+# spatial chunks are NETCDF_CHUNK_SIZE x NETCDF_CHUNK_SIZE pixels and hold every
+# depth interval, so that both a map window and a soil profile read few chunks
+NETCDF_CHUNK_SIZE = 256
+
+# attributes of the data arrays that are written as netCDF variable settings
+_ENCODING_ATTRS = ("_FillValue", "scale_factor", "add_offset")
+
+
+def write_netcdf(
+    path: str,
+    coverages: dict,
+    metadata: dict[str, dict] | None = None,
+    chunk_size: int = NETCDF_CHUNK_SIZE,
+    complevel: int = 4,
+) -> None:
+    """Write coverages to a compressed, chunked NetCDF4 file.
+
+    Coverages are the data arrays returned by
+    :meth:`soilgrids.SoilGrids.get_coverage_data` (``band``, ``y``, ``x``) or
+    :meth:`soilgrids.SoilGrids.get_coverage_depths` (``depth``, ``y``, ``x``)
+    and must all be on the same grid. Values are stored as they were
+    downloaded, packed integers with their ``scale_factor``, ``add_offset``
+    and ``_FillValue`` attributes, and the file follows the CF conventions
+    for its coordinates, depth bounds and grid mapping.
+
+    Parameters
+    ----------
+    path : str
+        Path of the NetCDF file to write.
+    coverages : dict of xarray.DataArray
+        Coverages to write, by variable name.
+    metadata : dict of dict, optional
+        The :attr:`soilgrids.SoilGrids.metadata` of each coverage, by
+        variable name, written as attributes of the variables.
+    chunk_size : int, optional
+        Width and height, in pixels, of the chunks of the variables.
+    complevel : int, optional
+        zlib compression level, from 1 to 9.
+    """
+    import netCDF4
+    import rioxarray  # noqa: F401 (registers the rio accessor)
+
+    if not coverages:
+        raise ValueError("Please provide at least one coverage to write.")
+    metadata = metadata or {}
+
+    first = next(iter(coverages.values()))
+    for name, coverage in coverages.items():
+        if coverage.rio.shape != first.rio.shape or not numpy.allclose(
+            coverage.rio.transform(), first.rio.transform()
+        ):
+            raise SoilGridsError(f"{name!r} is not on the same grid as the others.")
+    profiles = [coverage for coverage in coverages.values() if "depth" in coverage.dims]
+    for coverage in profiles[1:]:
+        if list(coverage["depth"].values) != list(profiles[0]["depth"].values):
+            raise SoilGridsError("All soil profiles must have the same depths.")
+
+    # rioxarray turns the CRS into CF grid mapping attributes
+    grid_mapping = dict(first.rio.write_crs(first.rio.crs).spatial_ref.attrs)
+    is_geographic = first.rio.crs.is_geographic
+
+    with netCDF4.Dataset(path, "w", format="NETCDF4") as nc:
+        nc.Conventions = "CF-1.8"
+        nc.source = "SoilGrids, https://www.isric.org/explore/soilgrids"
+
+        nc.createDimension("y", first.rio.height)
+        nc.createDimension("x", first.rio.width)
+        if is_geographic:
+            axes = {
+                "x": ("degrees_east", "longitude"),
+                "y": ("degrees_north", "latitude"),
+            }
+        else:
+            axes = {
+                "x": ("m", "projection_x_coordinate"),
+                "y": ("m", "projection_y_coordinate"),
+            }
+        for dim, (units, standard_name) in axes.items():
+            coord = nc.createVariable(dim, "f8", (dim,))
+            coord.setncatts(
+                {"units": units, "standard_name": standard_name, "axis": dim.upper()}
+            )
+            coord[:] = first[dim].values
+
+        if profiles:
+            depth = profiles[0]
+            nc.createDimension("depth", depth.sizes["depth"])
+            nc.createDimension("nv", 2)
+            coord = nc.createVariable("depth", "f8", ("depth",))
+            coord.setncatts(
+                {
+                    "units": "cm",
+                    "standard_name": "depth",
+                    "positive": "down",
+                    "axis": "Z",
+                    "bounds": "depth_bnds",
+                    "long_name": "depth of the middle of the interval",
+                }
+            )
+            coord[:] = (depth["depth_top"].values + depth["depth_bottom"].values) / 2
+            bounds = nc.createVariable("depth_bnds", "f8", ("depth", "nv"))
+            bounds[:] = numpy.stack(
+                [depth["depth_top"].values, depth["depth_bottom"].values], axis=1
+            )
+
+        crs = nc.createVariable("spatial_ref", "i4")
+        crs.setncatts(grid_mapping)
+
+        for name, coverage in coverages.items():
+            _write_variable(
+                nc,
+                name,
+                coverage,
+                metadata.get(name, {}),
+                chunk_size=chunk_size,
+                complevel=complevel,
+            )
+
+
+def _write_variable(nc, name, coverage, metadata, chunk_size, complevel):
+    is_profile = "depth" in coverage.dims
+    dims = ("depth", "y", "x") if is_profile else ("y", "x")
+    height, width = coverage.rio.shape
+    chunks = (min(chunk_size, height), min(chunk_size, width))
+    if is_profile:
+        chunks = (coverage.sizes["depth"],) + chunks
+
+    fill_value = coverage.attrs.get("_FillValue", coverage.rio.nodata)
+    variable = nc.createVariable(
+        name,
+        coverage.dtype,
+        dims,
+        zlib=True,
+        complevel=complevel,
+        shuffle=True,
+        chunksizes=chunks,
+        fill_value=None if fill_value is None else coverage.dtype.type(fill_value),
+    )
+    # values are written packed, as they are stored in the GeoTIFF files
+    variable.set_auto_maskandscale(False)
+
+    attrs = {
+        key: value
+        for key, value in coverage.attrs.items()
+        if key not in _ENCODING_ATTRS and key != "AREA_OR_POINT"
+    }
+    attrs.update(
+        scale_factor=float(coverage.attrs.get("scale_factor", 1.0)),
+        add_offset=float(coverage.attrs.get("add_offset", 0.0)),
+        grid_mapping="spatial_ref",
+    )
+    if "variable_name" in metadata:
+        attrs["long_name"] = metadata["variable_name"]
+    if "variable_units" in metadata:
+        attrs["units"] = metadata["variable_units"]
+    attrs.update(
+        {key: _to_attribute(value) for key, value in metadata.items()},
+    )
+    variable.setncatts(attrs)
+
+    # write one row of chunks at a time, so that lazily read coverages are
+    # never loaded in memory all at once
+    array = coverage if is_profile else coverage.isel(band=0)
+    for row in range(0, height, chunks[-2]):
+        rows = slice(row, min(row + chunks[-2], height))
+        if is_profile:
+            variable[:, rows, :] = array[:, rows, :].values
+        else:
+            variable[rows, :] = array[rows, :].values
+
+
+def _to_attribute(value):
+    """Return a value that netCDF4 can store as an attribute."""
+    if isinstance(value, (list, tuple)):
+        if all(
+            isinstance(item, (int, float)) and not isinstance(item, bool)
+            for item in value
+        ):
+            return numpy.asarray(value, dtype=float)
+        return " ".join(str(item) for item in numpy.ravel(value))
+    if value is None or isinstance(value, bool):
+        return str(value)
+    return value
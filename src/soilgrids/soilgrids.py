@@ -1,13 +1,82 @@
 from __future__ import annotations
 
+import functools
+import math
 import os
+import random
+import tempfile
+import time
 import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 
-import rioxarray
+import numpy
+import rasterio.shutil
+import requests
 from owslib.util import ServiceException
-from owslib.wcs import WebCoverageService
+from rasterio.merge import merge
+from rasterio.windows import Window
+from soilgrids import instrumentation
+from soilgrids.cache import CapabilitiesCache
+from soilgrids.cache import CoverageCache
+from soilgrids.cache import request_key
+from soilgrids.client import clients
+from soilgrids.exceptions import SoilGridsError
 from soilgrids.exceptions import SoilGridsWcsError
 
+# tiles of a tiled request are at most MAX_TILE_SIZE x MAX_TILE_SIZE pixels, well
+# below the 4096 pixel limit that MapServer applies by default
+MAX_TILE_SIZE = 2048
+
+# responses are written to disk in chunks of CHUNK_SIZE bytes
+CHUNK_SIZE = 2**20
+
+# resilient downloads retry transient errors RETRIES times, waiting up to
+# RETRY_BACKOFF * 2**attempt seconds, and split requests the server finds too
+# large into quadrants at most MAX_SPLIT_DEPTH times over
+RETRIES = 3
+RETRY_BACKOFF = 1.0
+MAX_SPLIT_DEPTH = 6
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# cloud-optimized GeoTIFF outputs have internal tiles of COG_BLOCK_SIZE pixels,
+# overviews down to about one tile and one of these compression methods
+COG_BLOCK_SIZE = 512
+COG_COMPRESSIONS = ("DEFLATE", "ZSTD", "LZW")
+
+# Zarr stores are written in chunks of ZARR_CHUNK_SIZE x ZARR_CHUNK_SIZE pixels
+ZARR_CHUNK_SIZE = 512
+
+# words in WCS error messages that tell a request was too large for the server
+SIZE_ERROR_KEYWORDS = (
+    "memory",
+    "out of memory",
+    "too large",
+    "too big",
+    "size",
+    "exceed",
+    "exceeded",
+    "limit",
+    "maximum",
+)
+
+RequestPlan = namedtuple(
+    "RequestPlan",
+    [
+        "width",
+        "height",
+        "pixels",
+        "nbytes",
+        "tile_grid",
+        "tiles",
+        "max_workers",
+        "requests",
+        "cached",
+        "cached_fraction",
+    ],
+)
+
 
 class SoilGrids:
     MAP_SERVICES = {
@@ -75,9 +144,15 @@ class SoilGrids:
     # service info at http://maps.isric.org/
     # https://www.isric.org/explore/soilgrids/faq-soilgrids
 
-    def __init__(self):
+    DEPTH_INTERVALS = ("0-5cm", "5-15cm", "15-30cm", "30-60cm", "60-100cm", "100-200cm")
+
+    def __init__(
+        self, cache_dir=None, capabilities_ttl=86400, coverage_cache_size=2**30
+    ):
         self._tif_file = None
         self._metadata = None
+        self._capabilities = CapabilitiesCache(cache_dir, ttl=capabilities_ttl)
+        self._coverages = CoverageCache(cache_dir, max_size=coverage_cache_size)
 
     @property
     def tif_file(self):
@@ -111,7 +186,9 @@ class SoilGrids:
 
     def get_coverage_info(self, service_id, coverage_id):
         wcs, coverage_list = self._get_service_and_coverage_list(service_id)
-        coverage_obj = self._get_coverage_obj(wcs, coverage_list, coverage_id)
+        coverage_obj = self._get_coverage_obj(
+            service_id, wcs, coverage_list, coverage_id
+        )
 
         print(
             "Supported CRS: \n{}\n".format(
@@ -147,9 +224,630 @@ class SoilGrids:
         height=None,
         response_crs=None,
         local_file=False,
+        tiled=False,
+        max_workers=4,
+        resilient=False,
+        chunks=None,
+        lazy=False,
+        cog=False,
+        compress="DEFLATE",
+    ):
+        if cog and compress.upper() not in COG_COMPRESSIONS:
+            raise ValueError(
+                "Please provide a compression method from the following options:"
+                f" {', '.join(COG_COMPRESSIONS)}."
+            )
+
+        with instrumentation.span(
+            "capabilities", {"service_id": service_id, "coverage_id": coverage_id}
+        ) as span:
+            wcs, request_context = self._check_request(
+                service_id,
+                coverage_id,
+                crs,
+                west,
+                south,
+                east,
+                north,
+                resx,
+                resy,
+                width,
+                height,
+                response_crs,
+            )
+            span.request = request_context
+
+        # check output
+        if output[-4::] != ".tif":
+            raise ValueError(
+                "Please provide a valid output file name with .tif extension."
+            )
+
+        self._fetch_coverage(
+            wcs,
+            request_context,
+            output,
+            local_file=local_file,
+            tiled=tiled,
+            max_workers=max_workers,
+            resilient=resilient,
+        )
+
+        if cog:
+            with instrumentation.span("cog", request_context) as span:
+                _write_cog(output, compress)
+                span.add_bytes(os.path.getsize(output))
+
+        # rioxarray and xarray take most of the import time of the package, so
+        # they are only imported once they are needed
+        import rioxarray
+
+        # open data; a lazy dataset reads from the file whenever it is accessed,
+        # and dask chunks are read without a lock so that they load in parallel
+        with instrumentation.span("open", request_context):
+            dataset = rioxarray.open_rasterio(
+                output,
+                chunks=chunks,
+                cache=False if lazy else None,
+                lock=False if chunks is not None else None,
+            )
+            dataset.close()
+
+        # get resolution
+        if request_context["resx"] and request_context["resy"]:
+            grid_res = [request_context["resx"], request_context["resy"]]
+        else:
+            geotrans = [
+                float(value)
+                for value in dataset["spatial_ref"].attrs["GeoTransform"].split(" ")
+            ]
+            grid_res = [abs(geotrans[1]), abs(geotrans[5])]
+
+        # store metadata
+        self._tif_file = (
+            output
+            if os.path.dirname(output) != ""
+            else os.path.join(os.getcwd(), output)
+        )
+        self._metadata = {
+            "variable_name": SoilGrids.MAP_SERVICES[service_id]["name"],
+            "variable_units": SoilGrids.MAP_SERVICES[service_id]["units"],
+            "service_url": SoilGrids.MAP_SERVICES[service_id]["link"],
+            "service_id": service_id,
+            "coverage_id": coverage_id,
+            "crs": request_context["response_crs"],
+            "bounding_box": request_context["bbox"],
+            "grid_res": grid_res,
+        }
+
+        return dataset
+
+    def plan_coverage_request(
+        self,
+        service_id,
+        coverage_id,
+        crs,
+        west,
+        south,
+        east,
+        north,
+        output=None,
+        resx=250,
+        resy=250,
+        width=None,
+        height=None,
+        response_crs=None,
+        local_file=False,
+        tiled=False,
+        max_workers=4,
+    ):
+        """Estimate the size and tile layout of a coverage request.
+
+        Takes the request arguments of :meth:`get_coverage_data` and checks
+        them the same way, but downloads nothing. Once the capabilities of the
+        map service are cached, no request is sent to the server at all.
+
+        Returns a :class:`RequestPlan` with the estimated ``width``, ``height``
+        and number of ``pixels`` of the coverage, the expected size of the
+        GeoTIFF in bytes (``nbytes``), the ``tile_grid`` (columns, rows) and
+        ``tiles`` of at most ``MAX_TILE_SIZE`` pixels it is best downloaded
+        as, the number of workers worth using for them, the number of
+        ``requests`` this call would send (a single one unless ``tiled`` is
+        true, whatever the size of the request), whether the request would be
+        served from the coverage cache and the fraction of its bounding box
+        that could be cropped from cached coverages, those with the same grid
+        and resolution whose pixel edges it falls on (``cached_fraction``, 1
+        if the request itself is cached). Nothing is served from the cache
+        unless ``local_file`` is true.
+        """
+        _, request_context = self._check_request(
+            service_id,
+            coverage_id,
+            crs,
+            west,
+            south,
+            east,
+            north,
+            resx,
+            resy,
+            width,
+            height,
+            response_crs,
+        )
+
+        if output is not None and output[-4::] != ".tif":
+            raise ValueError(
+                "Please provide a valid output file name with .tif extension."
+            )
+
+        est_width, est_height = _estimate_request_size(request_context)
+        if est_width < 1 or est_height < 1:
+            raise ValueError(
+                "Please provide a bounding box of at least one pixel in width and"
+                " height."
+            )
+        pixels = est_width * est_height
+        tile_grid = (
+            math.ceil(est_width / MAX_TILE_SIZE),
+            math.ceil(est_height / MAX_TILE_SIZE),
+        )
+        tiles = _split_grid(request_context, *tile_grid)
+
+        if local_file:
+            cached = self._cache_key(request_context) in self._coverages
+            cached_fraction = (
+                1.0
+                if cached
+                else self._coverages.coverage_fraction(
+                    self._cache_request(request_context)
+                )
+            )
+        else:
+            cached, cached_fraction = False, 0.0
+
+        return RequestPlan(
+            width=est_width,
+            height=est_height,
+            pixels=pixels,
+            nbytes=_estimate_geotiff_size(est_width, est_height),
+            tile_grid=tile_grid,
+            tiles=[tile["bbox"] for tile in tiles],
+            max_workers=min(len(tiles), max_workers),
+            requests=len(tiles) if tiled else 1,
+            cached=cached,
+            cached_fraction=cached_fraction,
+        )
+
+    def get_coverage_depths(
+        self,
+        service_id,
+        crs,
+        west,
+        south,
+        east,
+        north,
+        output,
+        depths=None,
+        statistic="mean",
+        resx=250,
+        resy=250,
+        width=None,
+        height=None,
+        response_crs=None,
+        local_file=False,
+        max_workers=6,
+        resilient=False,
+    ):
+        depths = list(depths or SoilGrids.DEPTH_INTERVALS)
+        coverage_ids = [f"{service_id}_{depth}_{statistic}" for depth in depths]
+        depth_bounds = [_depth_bounds(depth) for depth in depths]
+
+        layer_requests = [
+            self._check_request(
+                service_id,
+                coverage_id,
+                crs,
+                west,
+                south,
+                east,
+                north,
+                resx,
+                resy,
+                width,
+                height,
+                response_crs,
+            )
+            for coverage_id in coverage_ids
+        ]
+
+        # check output
+        if output[-4::] != ".tif":
+            raise ValueError(
+                "Please provide a valid output file name with .tif extension."
+            )
+
+        # download every depth at the same time, through the same client
+        with tempfile.TemporaryDirectory(
+            dir=os.path.dirname(os.path.abspath(output)), prefix=".depths-"
+        ) as layer_dir:
+            layer_files = [
+                os.path.join(layer_dir, f"{coverage_id}.tif")
+                for coverage_id in coverage_ids
+            ]
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for future in [
+                    executor.submit(
+                        self._fetch_coverage,
+                        wcs,
+                        request_context,
+                        layer_file,
+                        local_file=local_file,
+                        resilient=resilient,
+                    )
+                    for (wcs, request_context), layer_file in zip(
+                        layer_requests, layer_files
+                    )
+                ]:
+                    future.result()
+
+            array, profile, scale_factor, add_offset = _stack_layers(layer_files)
+
+            # written next to the layers first, so that output is only ever
+            # seen complete
+            profile.update(driver="GTiff", count=len(depths))
+            stack_file = os.path.join(layer_dir, "depths.tif")
+            with rasterio.open(stack_file, "w", **profile) as dst:
+                dst.write(array)
+                for band, coverage_id in enumerate(coverage_ids, start=1):
+                    dst.set_band_description(band, coverage_id)
+            os.replace(stack_file, output)
+
+        import rioxarray  # noqa: F401 (registers the rio accessor)
+        import xarray
+
+        transform = profile["transform"]
+        dataset = xarray.DataArray(
+            array,
+            dims=("depth", "y", "x"),
+            coords={
+                "depth": depths,
+                "depth_top": ("depth", [top for top, _ in depth_bounds]),
+                "depth_bottom": ("depth", [bottom for _, bottom in depth_bounds]),
+                "y": transform.f
+                + (numpy.arange(profile["height"]) + 0.5) * transform.e,
+                "x": transform.c + (numpy.arange(profile["width"]) + 0.5) * transform.a,
+            },
+            attrs={
+                "_FillValue": profile["nodata"],
+                "scale_factor": scale_factor,
+                "add_offset": add_offset,
+            },
+        )
+        dataset.coords["depth_top"].attrs["units"] = "cm"
+        dataset.coords["depth_bottom"].attrs["units"] = "cm"
+        dataset.rio.write_crs(profile["crs"], inplace=True)
+        dataset.rio.write_transform(transform, inplace=True)
+
+        # store metadata
+        self._tif_file = (
+            output
+            if os.path.dirname(output) != ""
+            else os.path.join(os.getcwd(), output)
+        )
+        self._metadata = {
+            "variable_name": SoilGrids.MAP_SERVICES[service_id]["name"],
+            "variable_units": SoilGrids.MAP_SERVICES[service_id]["units"],
+            "service_url": SoilGrids.MAP_SERVICES[service_id]["link"],
+            "service_id": service_id,
+            "coverage_id": coverage_ids,
+            "crs": layer_requests[0][1]["response_crs"],
+            "bounding_box": layer_requests[0][1]["bbox"],
+            "grid_res": [abs(transform.a), abs(transform.e)],
+            "depths": depths,
+        }
+
+        return dataset
+
+    def get_coverage_zarr(
+        self,
+        service_id,
+        crs,
+        west,
+        south,
+        east,
+        north,
+        store,
+        depths=None,
+        statistics=None,
+        resx=250,
+        resy=250,
+        width=None,
+        height=None,
+        response_crs=None,
+        local_file=False,
+        tiled=False,
+        max_workers=4,
+        resilient=False,
+        chunk_size=ZARR_CHUNK_SIZE,
+    ):
+        """Download the coverages of a map service into a Zarr store.
+
+        The coverages of every statistic and depth interval are written as one
+        ``(statistic, depth, y, x)`` variable, named after the service, of a
+        chunked and compressed Zarr store. Calling this method again with the
+        same store and grid adds another service to it. Coverages are
+        downloaded concurrently and each is written to its own chunks, so
+        writers never touch the same chunk and need no lock.
+
+        Parameters
+        ----------
+        service_id : str
+            Map service identifier.
+        crs, west, south, east, north : str, float
+            Coordinate system and bounding box of the requests.
+        store : str
+            Path of the Zarr store, which is created if needed.
+        depths : list of str, optional
+            Depth intervals to download. Defaults to the depths already in the
+            store, or to all of them.
+        statistics : list of str, optional
+            Statistics to download (e.g. ``mean``, ``Q0.5``). Defaults to the
+            statistics already in the store, or to ``mean``.
+        chunk_size : int, optional
+            Width and height, in pixels, of the chunks of the store.
+
+        Returns
+        -------
+        xarray.Dataset
+            The content of the store, read lazily.
+        """
+        import zarr
+
+        root = zarr.open_group(store, mode="a", zarr_format=2)
+        depths = list(depths or _read_zarr_coord(root, "depth") or self.DEPTH_INTERVALS)
+        statistics = list(statistics or _read_zarr_coord(root, "statistic") or ["mean"])
+        coverage_ids = [
+            [f"{service_id}_{depth}_{statistic}" for depth in depths]
+            for statistic in statistics
+        ]
+        layer_requests = {
+            (row, col): self._check_request(
+                service_id,
+                coverage_id,
+                crs,
+                west,
+                south,
+                east,
+                north,
+                resx,
+                resy,
+                width,
+                height,
+                response_crs,
+            )
+            for row, statistic_ids in enumerate(coverage_ids)
+            for col, coverage_id in enumerate(statistic_ids)
+        }
+
+        with tempfile.TemporaryDirectory(
+            dir=os.path.dirname(os.path.abspath(store)), prefix=".zarr-"
+        ) as layer_dir:
+
+            def fetch(index):
+                wcs, request_context = layer_requests[index]
+                layer_file = os.path.join(
+                    layer_dir, f"{request_context['coverage_id']}.tif"
+                )
+                self._fetch_coverage(
+                    wcs,
+                    request_context,
+                    layer_file,
+                    local_file=local_file,
+                    tiled=tiled,
+                    max_workers=max_workers,
+                    resilient=resilient,
+                )
+                return layer_file
+
+            # the first coverage tells the grid of the store
+            first_file = fetch((0, 0))
+            with rasterio.open(first_file) as src:
+                transform = src.transform
+                request_context = layer_requests[(0, 0)][1]
+                metadata = {
+                    "variable_name": SoilGrids.MAP_SERVICES[service_id]["name"],
+                    "variable_units": SoilGrids.MAP_SERVICES[service_id]["units"],
+                    "service_url": SoilGrids.MAP_SERVICES[service_id]["link"],
+                    "service_id": service_id,
+                    "coverage_id": coverage_ids,
+                    "crs": request_context["response_crs"],
+                    "bounding_box": list(request_context["bbox"]),
+                    "grid_res": (
+                        [request_context["resx"], request_context["resy"]]
+                        if request_context["resx"] and request_context["resy"]
+                        else [abs(transform.a), abs(transform.e)]
+                    ),
+                    "depths": depths,
+                    "statistics": statistics,
+                }
+                array = _create_zarr_variable(root, src, metadata, chunk_size)
+
+            def write(index, layer_file):
+                _write_zarr_layer(array, index, layer_file, chunk_size)
+                os.remove(layer_file)
+
+            write((0, 0), first_file)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for future in [
+                    executor.submit(lambda index: write(index, fetch(index)), index)
+                    for index in list(layer_requests)[1:]
+                ]:
+                    future.result()
+
+        zarr.consolidate_metadata(store)
+
+        self._tif_file = None
+        self._metadata = metadata
+
+        import xarray
+
+        return xarray.open_dataset(store, engine="zarr", chunks=None, consolidated=True)
+
+    def sample_points(
+        self,
+        service_id,
+        coverage_ids,
+        xs,
+        ys,
+        crs,
+        resx=250,
+        resy=250,
+        window_size=256,
+        max_workers=4,
+        local_file=False,
+        resilient=False,
+    ):
+        """Sample coverages at many points.
+
+        The points are grouped by the window_size x window_size pixel cell of
+        the coverage grid they fall into, and each group is fetched as one
+        request for the smallest window that holds all of its points. Windows
+        are downloaded concurrently and the values are read from them with
+        vectorized indexing.
+
+        Parameters
+        ----------
+        service_id : str
+            Map service identifier.
+        coverage_ids : str or list of str
+            Coverages to sample.
+        xs, ys : array_like
+            Coordinates of the points, in ``crs``.
+        crs : str
+            Coordinate system code of the points (and of the requests).
+        resx, resy : float, optional
+            Grid resolution, in units of ``crs`` (degrees for EPSG 4326).
+        window_size : int, optional
+            Maximum width and height, in pixels, of a requested window.
+        max_workers : int, optional
+            Maximum number of windows downloaded at the same time.
+
+        Returns
+        -------
+        xarray.Dataset
+            One variable per coverage, in physical units and with NaN for
+            missing values, along a ``point`` dimension in the order of the
+            input points.
+        """
+        if isinstance(coverage_ids, str):
+            coverage_ids = [coverage_ids]
+        xs = numpy.asarray(xs, dtype=float)
+        ys = numpy.asarray(ys, dtype=float)
+        if xs.shape != ys.shape or xs.ndim != 1:
+            raise ValueError("Please provide xs and ys as 1D arrays of the same size.")
+
+        valid = numpy.flatnonzero(numpy.isfinite(xs) & numpy.isfinite(ys))
+        cols = numpy.floor(xs[valid] / resx).astype(int)
+        rows = numpy.floor(ys[valid] / resy).astype(int)
+        windows = _cluster_points(cols, rows, window_size)
+
+        # windows are requested by size for EPSG 4326, so they keep the pixel
+        # grid of the other windows either way
+        by_size = "4326" in crs
+        if windows:
+            west = min(window[1] for window in windows) * resx
+            south = min(window[2] for window in windows) * resy
+            east = max(window[3] for window in windows) * resx
+            north = max(window[4] for window in windows) * resy
+        else:
+            west = south = east = north = 0
+
+        layer_requests = []
+        for coverage_id in coverage_ids:
+            wcs, request_context = self._check_request(
+                service_id,
+                coverage_id,
+                crs,
+                west,
+                south,
+                east,
+                north,
+                resx,
+                resy,
+                1 if by_size else None,
+                1 if by_size else None,
+                crs,
+            )
+            for members, col0, row0, col1, row1 in windows:
+                window_context = dict(
+                    request_context,
+                    bbox=(col0 * resx, row0 * resy, col1 * resx, row1 * resy),
+                    resx=None if by_size else resx,
+                    resy=None if by_size else resy,
+                    width=col1 - col0 if by_size else None,
+                    height=row1 - row0 if by_size else None,
+                )
+                layer_requests.append((coverage_id, members, wcs, window_context))
+
+        values = {
+            coverage_id: numpy.full(len(xs), numpy.nan) for coverage_id in coverage_ids
+        }
+        with tempfile.TemporaryDirectory(prefix="soilgrids-points-") as window_dir:
+
+            def sample(index, coverage_id, members, wcs, window_context):
+                window_file = os.path.join(window_dir, f"{index}.tif")
+                self._fetch_coverage(
+                    wcs,
+                    window_context,
+                    window_file,
+                    local_file=local_file,
+                    resilient=resilient,
+                )
+                points = valid[members]
+                values[coverage_id][points] = _sample_file(
+                    window_file, xs[points], ys[points]
+                )
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for future in [
+                    executor.submit(sample, index, *layer_request)
+                    for index, layer_request in enumerate(layer_requests)
+                ]:
+                    future.result()
+
+        import xarray
+
+        dataset = xarray.Dataset(
+            {coverage_id: ("point", values[coverage_id]) for coverage_id in values},
+            coords={"x": ("point", xs), "y": ("point", ys)},
+        )
+        dataset.attrs.update(
+            service_id=service_id,
+            crs=crs,
+            units=SoilGrids.MAP_SERVICES[service_id]["units"],
+            requests=len(layer_requests),
+        )
+        return dataset
+
+    def _check_request(
+        self,
+        service_id,
+        coverage_id,
+        crs,
+        west,
+        south,
+        east,
+        north,
+        resx,
+        resy,
+        width,
+        height,
+        response_crs,
     ):
         wcs, coverage_list = self._get_service_and_coverage_list(service_id)
-        coverage_obj = self._get_coverage_obj(wcs, coverage_list, coverage_id)
+        coverage_obj = self._get_coverage_obj(
+            service_id, wcs, coverage_list, coverage_id
+        )
 
         # check crs
         crs_list = [CRS.getcodeurn() for CRS in coverage_obj.supportedCRS]
@@ -189,64 +887,162 @@ class SoilGrids:
         else:
             bbox = (west, south, east, north)
 
-        # check output
-        if output[-4::] != ".tif":
-            raise ValueError(
-                "Please provide a valid output file name with .tif extension."
+        request_context = {
+            "service_id": service_id,
+            "coverage_id": coverage_id,
+            "crs": crs,
+            "bbox": bbox,
+            "resx": resx,
+            "resy": resy,
+            "width": width,
+            "height": height,
+            "response_crs": response_crs,
+            "format": "GEOTIFF_INT16",
+        }
+
+        return wcs, request_context
+
+    def _fetch_coverage(
+        self,
+        wcs,
+        request_context,
+        output,
+        local_file=False,
+        tiled=False,
+        max_workers=4,
+        resilient=False,
+    ):
+        download = functools.partial(
+            _download_to_file,
+            wcs,
+            request_context,
+            output,
+            tiled=tiled,
+            max_workers=max_workers,
+            resilient=resilient,
+        )
+
+        # only requests that may be served from the cache fill it, the others
+        # are recorded so that a later one with local_file reuses the output
+        cache_key = self._cache_key(request_context)
+        if not local_file:
+            download()
+            self._coverages.record(
+                cache_key, output, self._cache_request(request_context)
             )
+            return
 
-        if local_file and os.path.isfile(output):
-            pass
+        # processes sharing the cache wait for each other's download of a
+        # coverage, and then copy it from the cache
+        with self._coverages.lock(cache_key):
+            with instrumentation.span("cache", request_context) as span:
+                # a coverage in the cache, or a larger one to crop it from
+                cached = self._coverages.fetch(
+                    cache_key, output
+                ) or self._coverages.crop(self._cache_request(request_context), output)
+                if cached:
+                    span.add_bytes(os.path.getsize(output))
+            if not cached:
+                download()
+                self._coverages.put(
+                    cache_key, output, self._cache_request(request_context)
+                )
+
+    def _cache_key(self, request_context):
+        return request_key(self._cache_request(request_context))
+
+    def _cache_request(self, request_context):
+        # cached coverages are told apart by the server they come from
+        service_id = request_context["service_id"]
+        return dict(
+            request_context, service_url=SoilGrids.MAP_SERVICES[service_id]["link"]
+        )
+
+    def _get_service_and_coverage_list(self, service_id):
+        if service_id not in SoilGrids.MAP_SERVICES.keys():
+            raise ValueError(
+                "Please provide a service id from the following options: \n{}".format(
+                    "\n".join(
+                        [
+                            "{}: {}".format(key, value["name"])
+                            for key, value in SoilGrids.MAP_SERVICES.items()
+                        ]
+                    )
+                )
+            )
         else:
-            request_context = {
-                "service_id": service_id,
-                "coverage_id": coverage_id,
-                "crs": crs,
-                "bbox": bbox,
-                "resx": resx,
-                "resy": resy,
-                "width": width,
-                "height": height,
-                "response_crs": response_crs,
-                "format": "GEOTIFF_INT16",
-            }
-
-            try:
-                response = wcs.getCoverage(
-                    identifier=coverage_id,
-                    crs=crs,
-                    bbox=bbox,
-                    resx=resx,
-                    resy=resy,
-                    width=width,
-                    height=height,
-                    response_crs=response_crs,
-                    format="GEOTIFF_INT16",
+            service_link = SoilGrids.MAP_SERVICES[service_id]["link"]
+            wcs = clients.get(service_id, service_link, self._capabilities)
+            coverage_list = wcs.coverage_list
+
+        return wcs, coverage_list
+
+    def _get_coverage_obj(self, service_id, wcs, coverage_list, coverage_id):
+        if coverage_id not in coverage_list:
+            raise ValueError(
+                "Please provide a coverage id from the following options: \n{}".format(
+                    "\n".join(coverage_list)
                 )
-            except ServiceException as exc:
-                raise SoilGridsWcsError(
-                    _format_wcs_error_message(str(exc), request_context),
-                    service_exception=str(exc),
-                    raw=str(exc),
-                    request=request_context,
-                ) from exc
-            except Exception as exc:
-                raise SoilGridsWcsError(
-                    _format_wcs_error_message(str(exc), request_context),
-                    raw=str(exc),
-                    request=request_context,
-                ) from exc
+            )
+        else:
+            coverage_obj = self._capabilities.get_coverage(service_id, wcs, coverage_id)
 
-            content_type = _normalize_content_type(
-                response.info().get("Content-Type", "")
+        return coverage_obj
+
+
+def _download_coverage(wcs, request_context: dict[str, object], output: str) -> None:
+    try:
+        with instrumentation.span("render", request_context):
+            response = wcs.getCoverage(
+                identifier=request_context["coverage_id"],
+                crs=request_context["crs"],
+                bbox=request_context["bbox"],
+                resx=request_context["resx"],
+                resy=request_context["resy"],
+                width=request_context["width"],
+                height=request_context["height"],
+                response_crs=request_context["response_crs"],
+                format=request_context["format"],
             )
-            body = response.read()
+    except ServiceException as exc:
+        raise SoilGridsWcsError(
+            _format_wcs_error_message(str(exc), request_context),
+            service_exception=str(exc),
+            raw=str(exc),
+            request=request_context,
+        ) from exc
+    except Exception as exc:
+        raise SoilGridsWcsError(
+            _format_wcs_error_message(str(exc), request_context),
+            raw=str(exc),
+            request=request_context,
+        ) from exc
 
-            if "tiff" in content_type:
+    content_type = _normalize_content_type(response.info().get("Content-Type", ""))
+    chunks = _iter_response(response)
+    try:
+        with instrumentation.span("transfer", request_context) as span:
+            first_chunk = next(chunks, b"")
+            span.add_bytes(len(first_chunk))
+
+            if _is_tiff(content_type, first_chunk):
+                fd, tmp_output = tempfile.mkstemp(
+                    dir=os.path.dirname(os.path.abspath(output)),
+                    prefix=f".{os.path.basename(output)}.",
+                    suffix=".part",
+                )
                 try:
-                    with open(output, "wb") as file:
-                        file.write(body)
+                    with os.fdopen(fd, "wb") as file:
+                        file.write(first_chunk)
+                        for chunk in chunks:
+                            file.write(chunk)
+                            span.add_bytes(len(chunk))
+                    os.replace(tmp_output, output)
+                except requests.RequestException:
+                    os.remove(tmp_output)
+                    raise
                 except Exception as exc:
+                    os.remove(tmp_output)
                     raise SoilGridsWcsError(
                         _format_wcs_error_message(
                             f"Failed to save the data as a GeoTiff file to {output!r}: {exc}",
@@ -256,7 +1052,8 @@ class SoilGrids:
                         request=request_context,
                     ) from exc
             else:
-                raw = body.decode("utf-8", errors="replace")
+                # OGC exception reports are small enough to fit in the first chunk
+                raw = first_chunk.decode("utf-8", errors="replace")
                 service_exception = _extract_ogc_service_exception(raw)
                 details = service_exception or raw
                 raise SoilGridsWcsError(
@@ -265,72 +1062,187 @@ class SoilGrids:
                     raw=raw,
                     request=request_context,
                 )
+    except requests.RequestException as exc:
+        # the connection failed while streaming, which is worth a retry
+        raise SoilGridsWcsError(
+            _format_wcs_error_message(
+                f"The download of the coverage was interrupted: {exc}",
+                request_context,
+            ),
+            raw=str(exc),
+            request=request_context,
+        ) from exc
+    finally:
+        if hasattr(response, "close"):
+            response.close()
 
-        # open data
-        dataset = rioxarray.open_rasterio(output)
-        dataset.close()
 
-        # get resolution
-        if resx and resy:
-            grid_res = [resx, resy]
-        else:
-            geotrans = [
-                float(value)
-                for value in dataset["spatial_ref"].attrs["GeoTransform"].split(" ")
-            ]
-            grid_res = [abs(geotrans[1]), abs(geotrans[5])]
+def _iter_response(response, chunk_size: int = CHUNK_SIZE):
+    """Iterate over the body of a response in chunks of chunk_size bytes."""
+    if hasattr(response, "iter_content"):
+        for chunk in response.iter_content(chunk_size):
+            if chunk:
+                yield chunk
+    else:
+        yield response.read()
 
-        # store metadata
-        self._tif_file = (
-            output
-            if os.path.dirname(output) != ""
-            else os.path.join(os.getcwd(), output)
-        )
-        self._metadata = {
-            "variable_name": SoilGrids.MAP_SERVICES[service_id]["name"],
-            "variable_units": SoilGrids.MAP_SERVICES[service_id]["units"],
-            "service_url": SoilGrids.MAP_SERVICES[service_id]["link"],
-            "service_id": service_id,
-            "coverage_id": coverage_id,
-            "crs": response_crs,
-            "bounding_box": bbox,
-            "grid_res": grid_res,
-        }
 
-        return dataset
+def _is_tiff(content_type: str, first_chunk: bytes) -> bool:
+    if "tiff" in content_type:
+        return True
+    # fall back to the magic number when the server sends a generic content type
+    return content_type in ("", "application/octet-stream") and first_chunk[:4] in (
+        b"II*\x00",
+        b"MM\x00*",
+        b"II+\x00",
+        b"MM\x00+",
+    )
 
-    @staticmethod
-    def _get_service_and_coverage_list(service_id):
-        if service_id not in SoilGrids.MAP_SERVICES.keys():
-            raise ValueError(
-                "Please provide a service id from the following options: \n{}".format(
-                    "\n".join(
-                        [
-                            "{}: {}".format(key, value["name"])
-                            for key, value in SoilGrids.MAP_SERVICES.items()
-                        ]
-                    )
+
+def _depth_bounds(depth: str) -> tuple[float, float]:
+    """Return the top and bottom, in cm, of a depth interval like "0-5cm"."""
+    try:
+        top, bottom = depth.removesuffix("cm").split("-")
+        return float(top), float(bottom)
+    except ValueError:
+        raise ValueError(
+            "Please provide depth intervals in the form of top-bottom in cm (e.g."
+            f" 0-5cm) instead of {depth!r}."
+        ) from None
+
+
+def _stack_layers(layer_files: list[str]):
+    """Read single-band GeoTIFFs into one contiguous (layer, y, x) array."""
+    with rasterio.open(layer_files[0]) as src:
+        profile = src.profile
+        scale_factor = src.scales[0]
+        add_offset = src.offsets[0]
+        array = numpy.empty(
+            (len(layer_files), src.height, src.width), dtype=src.dtypes[0]
+        )
+
+    for index, layer_file in enumerate(layer_files):
+        with rasterio.open(layer_file) as src:
+            if (src.height, src.width) != array.shape[1:]:
+                raise SoilGridsError(
+                    f"{os.path.basename(layer_file)!r} is not on the same grid as"
+                    f" {os.path.basename(layer_files[0])!r}."
                 )
-            )
-        else:
-            service_link = SoilGrids.MAP_SERVICES[service_id]["link"]
-            wcs = WebCoverageService(service_link, version="1.0.0")
-            coverage_list = list(wcs.contents)
+            src.read(1, out=array[index])
 
-        return wcs, coverage_list
+    return array, profile, scale_factor, add_offset
 
-    @staticmethod
-    def _get_coverage_obj(wcs, coverage_list, coverage_id):
-        if coverage_id not in coverage_list:
+
+def _read_zarr_coord(root, name: str) -> list[str] | None:
+    return [str(value) for value in root[name][:]] if name in root else None
+
+
+def _create_zarr_variable(root, src, metadata: dict[str, object], chunk_size: int):
+    """Create the (statistic, depth, y, x) array of a service in a Zarr group.
+
+    The coordinates of the group are written along with its first variable;
+    later variables must be on the same grid. Attributes follow the CF
+    conventions so that xarray and rioxarray decode the values and the CRS.
+    """
+    import numcodecs
+
+    depths = metadata["depths"]
+    statistics = metadata["statistics"]
+    transform = src.transform
+    x = transform.c + (numpy.arange(src.width) + 0.5) * transform.a
+    y = transform.f + (numpy.arange(src.height) + 0.5) * transform.e
+
+    if "x" in root:
+        if (
+            _read_zarr_coord(root, "depth") != depths
+            or _read_zarr_coord(root, "statistic") != statistics
+        ):
             raise ValueError(
-                "Please provide a coverage id from the following options: \n{}".format(
-                    "\n".join(coverage_list)
-                )
+                "Please provide the depths and statistics of the store:"
+                f" {', '.join(_read_zarr_coord(root, 'depth'))} and"
+                f" {', '.join(_read_zarr_coord(root, 'statistic'))}."
             )
-        else:
-            coverage_obj = wcs.contents[coverage_id]
+        if root["x"].shape != x.shape or root["y"].shape != y.shape:
+            raise SoilGridsError(
+                f"{metadata['service_id']!r} coverages are {src.width} x"
+                f" {src.height} pixels but the store holds coverages of"
+                f" {root['x'].shape[0]} x {root['y'].shape[0]} pixels."
+            )
+        if not (numpy.allclose(root["x"][:], x) and numpy.allclose(root["y"][:], y)):
+            raise SoilGridsError(
+                f"{metadata['service_id']!r} coverages are not on the grid of"
+                " the store."
+            )
+    else:
+        depth_bounds = [_depth_bounds(depth) for depth in depths]
+        coords = {
+            "x": (x, ["x"], {"units": src.crs.linear_units, "axis": "X"}),
+            "y": (y, ["y"], {"units": src.crs.linear_units, "axis": "Y"}),
+            "depth": (numpy.array(depths), ["depth"], {}),
+            "depth_top": (
+                numpy.array([top for top, _ in depth_bounds]),
+                ["depth"],
+                {"units": "cm"},
+            ),
+            "depth_bottom": (
+                numpy.array([bottom for _, bottom in depth_bounds]),
+                ["depth"],
+                {"units": "cm"},
+            ),
+            "statistic": (numpy.array(statistics), ["statistic"], {}),
+            "spatial_ref": (
+                numpy.array(0),
+                [],
+                {
+                    "crs_wkt": src.crs.to_wkt(),
+                    "spatial_ref": src.crs.to_wkt(),
+                    "GeoTransform": " ".join(
+                        str(value) for value in transform.to_gdal()
+                    ),
+                },
+            ),
+        }
+        for name, (values, dims, attrs) in coords.items():
+            coord = root.create_array(name, data=values, fill_value=None)
+            coord.attrs.update(attrs, _ARRAY_DIMENSIONS=dims)
 
-        return coverage_obj
+    array = root.create_array(
+        metadata["service_id"],
+        shape=(len(statistics), len(depths), src.height, src.width),
+        chunks=(1, 1, chunk_size, chunk_size),
+        dtype=src.dtypes[0],
+        fill_value=src.nodata,
+        compressors=numcodecs.Blosc(
+            cname="zstd", clevel=5, shuffle=numcodecs.Blosc.SHUFFLE
+        ),
+        overwrite=True,
+    )
+    array.attrs.update(
+        metadata,
+        _ARRAY_DIMENSIONS=["statistic", "depth", "y", "x"],
+        long_name=metadata["variable_name"],
+        units=metadata["variable_units"],
+        scale_factor=src.scales[0],
+        add_offset=src.offsets[0],
+        grid_mapping="spatial_ref",
+        coordinates="depth_top depth_bottom spatial_ref",
+    )
+    return array
+
+
+def _write_zarr_layer(array, index: tuple[int, int], layer_file: str, chunk_size):
+    """Write a coverage to its (statistic, depth) slice, one row of chunks at a time."""
+    with rasterio.open(layer_file) as src:
+        if (src.height, src.width) != array.shape[2:]:
+            raise SoilGridsError(
+                f"{os.path.basename(layer_file)!r} is not on the same grid as the"
+                " other coverages of the store."
+            )
+        for row in range(0, src.height, chunk_size):
+            window = Window(0, row, src.width, min(chunk_size, src.height - row))
+            array[index + (slice(row, row + window.height),)] = src.read(
+                1, window=window
+            )
 
 
 def _normalize_content_type(content_type: str) -> str:
@@ -356,7 +1268,9 @@ def _extract_ogc_service_exception(xml_text: str) -> str | None:
     return None
 
 
-def _format_wcs_error_message(details: str, request_context: dict[str, object]) -> str:
+def _estimate_request_size(
+    request_context: dict[str, object],
+) -> tuple[int | None, int | None]:
     west, south, east, north = request_context.get("bbox", (None, None, None, None))
     resx = request_context.get("resx")
     resy = request_context.get("resy")
@@ -381,6 +1295,332 @@ def _format_wcs_error_message(details: str, request_context: dict[str, object])
         est_width = int(abs(east - west) / resx)
         est_height = int(abs(north - south) / resy)
 
+    return est_width, est_height
+
+
+def _estimate_geotiff_size(width: int, height: int) -> int:
+    """Return the expected size, in bytes, of a GEOTIFF_INT16 coverage.
+
+    The coverages are uncompressed, so the file holds two bytes per pixel
+    plus, at most, a strip offset and byte count per row and a header.
+    """
+    return 2 * width * height + 8 * height + 1024
+
+
+def _split_request(
+    request_context: dict[str, object], max_tile_size: int = MAX_TILE_SIZE
+) -> list[dict[str, object]]:
+    """Split a request into tiles of at most max_tile_size x max_tile_size pixels.
+
+    Tile edges fall on pixel boundaries of the full request so that the tiles
+    can be mosaicked back together without gaps or overlaps.
+    """
+    est_width, est_height = _estimate_request_size(request_context)
+    if not est_width or not est_height:
+        return [request_context]
+
+    return _split_grid(
+        request_context,
+        math.ceil(est_width / max_tile_size),
+        math.ceil(est_height / max_tile_size),
+    )
+
+
+def _split_quadrants(request_context: dict[str, object]) -> list[dict[str, object]]:
+    """Split a request in two along both axes, or along the one that allows it."""
+    est_width, est_height = _estimate_request_size(request_context)
+    if not est_width or not est_height:
+        return [request_context]
+
+    return _split_grid(request_context, min(est_width, 2), min(est_height, 2))
+
+
+def _split_grid(
+    request_context: dict[str, object], ncols: int, nrows: int
+) -> list[dict[str, object]]:
+    if ncols * nrows == 1:
+        return [request_context]
+
+    est_width, est_height = _estimate_request_size(request_context)
+    west, south, east, north = request_context["bbox"]
+    by_size = request_context.get("resx") is None
+    resx = (east - west) / est_width if by_size else request_context["resx"]
+    resy = (north - south) / est_height if by_size else request_context["resy"]
+
+    x_edges = _tile_edges(west, east, resx, est_width, ncols)
+    y_edges = _tile_edges(south, north, resy, est_height, nrows)
+
+    tiles = []
+    for row in range(nrows):
+        for col in range(ncols):
+            tile = dict(
+                request_context,
+                bbox=(
+                    x_edges[col][0],
+                    y_edges[row][0],
+                    x_edges[col + 1][0],
+                    y_edges[row + 1][0],
+                ),
+            )
+            if by_size:
+                tile["width"] = x_edges[col + 1][1] - x_edges[col][1]
+                tile["height"] = y_edges[row + 1][1] - y_edges[row][1]
+            tiles.append(tile)
+
+    return tiles
+
+
+def _tile_edges(
+    low: float, high: float, step: float, size: int, count: int
+) -> list[tuple[float, int]]:
+    """Return count + 1 (coordinate, pixel index) edges splitting size pixels."""
+    edges = []
+    for i in range(count):
+        index = size * i // count
+        edges.append((low + index * step, index))
+    edges.append((high, size))
+    return edges
+
+
+def _download_tiled_coverage(
+    wcs,
+    request_context: dict[str, object],
+    output: str,
+    max_workers: int = 4,
+    download=_download_coverage,
+) -> None:
+    tiles = _split_request(request_context, MAX_TILE_SIZE)
+    if len(tiles) == 1:
+        download(wcs, request_context, output)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        _download_tiles(wcs, request_context, tiles, output, download, executor.submit)
+
+
+def _download_resilient(
+    wcs, request_context: dict[str, object], output: str, depth: int = 0
+) -> None:
+    """Download a coverage, retrying transient errors and splitting large requests.
+
+    Transient errors (connection errors, time-outs, interrupted downloads and
+    429/5xx responses) are retried up to RETRIES times with jittered
+    exponential backoff. When the server answers with an OGC exception that
+    the request is too large, the request is split into
+    quadrants, which are downloaded the same way (at most MAX_SPLIT_DEPTH
+    times over) and mosaicked into output.
+    """
+    try:
+        _download_with_retries(wcs, request_context, output)
+    except SoilGridsWcsError as exc:
+        # transient errors have been retried already, and their messages
+        # ("Max retries exceeded with url ...") are no size errors
+        if _is_transient_error(exc) or not _is_size_error(exc.service_exception or ""):
+            raise
+        quadrants = _split_quadrants(request_context)
+        if len(quadrants) == 1 or depth >= MAX_SPLIT_DEPTH:
+            raise
+
+        _download_tiles(
+            wcs,
+            request_context,
+            quadrants,
+            output,
+            functools.partial(_download_resilient, depth=depth + 1),
+            _call_now,
+        )
+
+
+def _download_with_retries(wcs, request_context: dict[str, object], output: str):
+    for attempt in range(RETRIES + 1):
+        try:
+            return _download_coverage(wcs, request_context, output)
+        except SoilGridsWcsError as exc:
+            if attempt == RETRIES or not _is_transient_error(exc):
+                raise
+        time.sleep(random.uniform(0, RETRY_BACKOFF * 2**attempt))
+
+
+def _download_tiles(wcs, request_context, tiles, output, download, submit) -> None:
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(output)), prefix=".tiles-"
+    ) as tile_dir:
+        tile_files = [
+            os.path.join(tile_dir, f"tile_{index}.tif") for index in range(len(tiles))
+        ]
+        for future in [
+            submit(download, wcs, tile, tile_file)
+            for tile, tile_file in zip(tiles, tile_files)
+        ]:
+            future.result()
+
+        try:
+            with instrumentation.span("mosaic", request_context) as span:
+                mosaic_file = os.path.join(tile_dir, "mosaic.tif")
+                _mosaic(tile_files, mosaic_file)
+                span.add_bytes(os.path.getsize(mosaic_file))
+            os.replace(mosaic_file, output)
+        except Exception as exc:
+            raise SoilGridsWcsError(
+                _format_wcs_error_message(
+                    f"Failed to mosaic the tiles into {output!r}: {exc}",
+                    request_context,
+                ),
+                raw=str(exc),
+                request=request_context,
+            ) from exc
+
+
+def _call_now(func, *args):
+    """Run func right away, returning a completed future of its result."""
+    future = Future()
+    future.set_result(func(*args))
+    return future
+
+
+def _is_transient_error(exc: SoilGridsWcsError) -> bool:
+    cause = exc.__cause__
+    if isinstance(cause, requests.HTTPError) and cause.response is not None:
+        return cause.response.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(
+        cause,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ),
+    )
+
+
+def _is_size_error(details: str) -> bool:
+    details_lower = details.lower()
+    return any(keyword in details_lower for keyword in SIZE_ERROR_KEYWORDS)
+
+
+def _cluster_points(cols, rows, window_size: int):
+    """Group pixels into windows of at most window_size x window_size pixels.
+
+    Pixels are grouped by the window_size x window_size cell of the pixel grid
+    that they fall into, and every group gets the smallest window holding all
+    of its pixels. Returns (members, col0, row0, col1, row1) for each window,
+    where members are indices into cols and rows and the window spans columns
+    col0 to col1 and rows row0 to row1, excluding the upper bounds.
+    """
+    if len(cols) == 0:
+        return []
+
+    cells = numpy.stack([cols // window_size, rows // window_size], axis=1)
+    _, cell_index = numpy.unique(cells, axis=0, return_inverse=True)
+    order = numpy.argsort(cell_index.reshape(-1), kind="stable")
+    starts = numpy.flatnonzero(numpy.diff(cell_index.reshape(-1)[order], prepend=-1))
+
+    return [
+        (
+            members,
+            int(cols[members].min()),
+            int(rows[members].min()),
+            int(cols[members].max()) + 1,
+            int(rows[members].max()) + 1,
+        )
+        for members in numpy.split(order, starts[1:])
+    ]
+
+
+def _sample_file(path: str, xs, ys):
+    """Return the values of a single-band GeoTIFF, in physical units, at points."""
+    with rasterio.open(path) as src:
+        array = src.read(1)
+        transform = src.transform
+        nodata = src.nodata
+        scale_factor = src.scales[0]
+        add_offset = src.offsets[0]
+
+    cols = numpy.floor((xs - transform.c) / transform.a).astype(int)
+    rows = numpy.floor((ys - transform.f) / transform.e).astype(int)
+    numpy.clip(cols, 0, array.shape[1] - 1, out=cols)
+    numpy.clip(rows, 0, array.shape[0] - 1, out=rows)
+
+    raw = array[rows, cols]
+    values = raw * scale_factor + add_offset
+    if nodata is not None:
+        values[raw == nodata] = numpy.nan
+    return values
+
+
+def _write_cog(path: str, compress: str = "DEFLATE") -> None:
+    """Rewrite a GeoTIFF file as a cloud-optimized GeoTIFF, in place."""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=f".{os.path.basename(path)}.",
+        suffix=".part",
+    )
+    os.close(fd)
+    try:
+        rasterio.shutil.copy(
+            path,
+            tmp_path,
+            driver="COG",
+            blocksize=COG_BLOCK_SIZE,
+            compress=compress.upper(),
+            predictor="YES",
+            overviews="AUTO",
+            overview_resampling="NEAREST",
+            bigtiff="IF_SAFER",
+        )
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _download_to_file(
+    wcs, request_context, output, tiled=False, max_workers=4, resilient=False
+) -> None:
+    download = _download_resilient if resilient else _download_coverage
+    if tiled:
+        _download_tiled_coverage(
+            wcs,
+            request_context,
+            output,
+            max_workers=max_workers,
+            download=download,
+        )
+    else:
+        download(wcs, request_context, output)
+
+
+def _mosaic(tile_files: list[str], output: str) -> None:
+    sources = [rasterio.open(tile_file) for tile_file in tile_files]
+    try:
+        array, transform = merge(sources)
+        profile = sources[0].profile
+        # the band metadata that scales the values, as in cache._crop_file
+        scales = sources[0].scales
+        offsets = sources[0].offsets
+        descriptions = sources[0].descriptions
+    finally:
+        for source in sources:
+            source.close()
+
+    profile.update(
+        driver="GTiff",
+        height=array.shape[1],
+        width=array.shape[2],
+        transform=transform,
+        tiled=False,
+    )
+    profile.pop("blockxsize", None)
+    profile.pop("blockysize", None)
+    with rasterio.open(output, "w", **profile) as dst:
+        dst.write(array)
+        dst.scales = scales
+        dst.offsets = offsets
+        dst.descriptions = descriptions
+
+
+def _format_wcs_error_message(details: str, request_context: dict[str, object]) -> str:
+    est_width, est_height = _estimate_request_size(request_context)
+
     pixel_hint = ""
     pixels = None
     if est_width and est_height:
@@ -391,20 +1631,8 @@ def _format_wcs_error_message(details: str, request_context: dict[str, object])
             f" ({pixels_m:.2f}M pixels)."
         )
 
-    details_lower = details.lower() if details else ""
-    size_error_keywords = (
-        "memory",
-        "out of memory",
-        "too large",
-        "too big",
-        "size",
-        "exceed",
-        "exceeded",
-        "limit",
-        "maximum",
-    )
     size_hint_pixel_threshold = 50_000_000
-    include_hint = any(k in details_lower for k in size_error_keywords) or (
+    include_hint = _is_size_error(details or "") or (
         isinstance(pixels, int) and pixels >= size_hint_pixel_threshold
     )
     hint = (
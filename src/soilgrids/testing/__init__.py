@@ -0,0 +1,2 @@
+"""Tools for testing code that uses soilgrids without the SoilGrids system."""
+from __future__ import annotations
@@ -0,0 +1,28 @@
+"""pytest fixtures that point soilgrids at a local WCS stand-in server.
+
+Enable them in a ``conftest.py`` with::
+
+    pytest_plugins = ["soilgrids.testing.fixtures"]
+"""
+from __future__ import annotations
+
+import pytest
+from soilgrids.client import clients
+from soilgrids.soilgrids import SoilGrids
+from soilgrids.testing.server import WcsServer
+
+
+@pytest.fixture
+def wcs_server(monkeypatch, tmp_path):
+    """Run a :class:`~soilgrids.testing.server.WcsServer` for a test.
+
+    While the test runs, ``SoilGrids.MAP_SERVICES`` links to the server and
+    the soilgrids caches are kept in a temporary directory.
+    """
+    with WcsServer() as server:
+        monkeypatch.setattr(SoilGrids, "MAP_SERVICES", server.map_services())
+        monkeypatch.setenv("SOILGRIDS_CACHE_DIR", str(tmp_path / "soilgrids-cache"))
+        try:
+            yield server
+        finally:
+            clients.clear()
@@ -0,0 +1,447 @@
+"""A local stand-in for the SoilGrids WCS 1.0.0 map services.
+
+:class:`WcsServer` runs an HTTP server in a background thread that answers
+GetCapabilities, DescribeCoverage and GetCoverage requests for every map
+service of :attr:`soilgrids.SoilGrids.MAP_SERVICES`. Coverages are synthesized
+on the fly as GEOTIFF_INT16 files whose values only depend on the coverage id
+and the coordinates of each pixel, so the same pixel has the same value in
+every request. The server can also delay responses, throttle concurrent
+requests and answer with OGC exception reports, which makes it suitable for
+offline tests and reproducible benchmarks.
+
+>>> from soilgrids.testing.server import WcsServer
+>>> with WcsServer() as server:
+...     server.links()["phh2o"].startswith(server.url)
+True
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+from xml.sax.saxutils import escape
+
+import numpy
+from rasterio.crs import CRS
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+from rasterio.warp import transform_bounds
+from soilgrids.soilgrids import SoilGrids
+
+STATISTICS = ("mean", "Q0.05", "Q0.5", "Q0.95", "uncertainty")
+
+# coordinate systems the stand-in serves, with the CRS of the files it writes
+SUPPORTED_CRS = {
+    "EPSG:152160": "+proj=igh +lat_0=0 +lon_0=0 +datum=WGS84 +units=m +no_defs",
+    "EPSG:4326": "EPSG:4326",
+    "EPSG:3857": "EPSG:3857",
+}
+
+# extent of the SoilGrids coverages, in the Homolosine projection
+HOMOLOSINE_BOUNDS = (-19949750, -6147500, 19861750, 8361000)
+
+NODATA = -32768
+
+CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<WCS_Capabilities xmlns="http://www.opengis.net/wcs"
+  xmlns:gml="http://www.opengis.net/gml"
+  xmlns:xlink="http://www.w3.org/1999/xlink" version="1.0.0">
+  <Service>
+    <name>MapServer WCS</name>
+    <label>{label}</label>
+    <fees>NONE</fees>
+    <accessConstraints>NONE</accessConstraints>
+  </Service>
+  <Capability>
+    <Request>
+      <GetCapabilities>{online_resource}</GetCapabilities>
+      <DescribeCoverage>{online_resource}</DescribeCoverage>
+      <GetCoverage>{online_resource}</GetCoverage>
+    </Request>
+    <Exception><Format>application/vnd.ogc.se_xml</Format></Exception>
+  </Capability>
+  <ContentMetadata>
+{briefs}
+  </ContentMetadata>
+</WCS_Capabilities>
+"""
+
+ONLINE_RESOURCE = """<DCPType><HTTP><Get>
+        <OnlineResource xlink:href="{href}"/>
+      </Get></HTTP></DCPType>"""
+
+COVERAGE_BRIEF = """    <CoverageOfferingBrief>
+      <name>{name}</name>
+      <label>{name}</label>
+      <lonLatEnvelope srsName="urn:ogc:def:crs:OGC:1.3:CRS84">
+        <gml:pos>-180 -62</gml:pos>
+        <gml:pos>180 87.37</gml:pos>
+      </lonLatEnvelope>
+    </CoverageOfferingBrief>"""
+
+DESCRIBE_COVERAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<CoverageDescription xmlns="http://www.opengis.net/wcs"
+  xmlns:gml="http://www.opengis.net/gml" version="1.0.0">
+  <CoverageOffering>
+    <name>{name}</name>
+    <label>{name}</label>
+    <domainSet><spatialDomain>
+      <gml:Envelope srsName="EPSG:152160">
+        <gml:pos>{bounds[0]} {bounds[1]}</gml:pos>
+        <gml:pos>{bounds[2]} {bounds[3]}</gml:pos>
+      </gml:Envelope>
+    </spatialDomain></domainSet>
+    <supportedCRSs>
+      <requestResponseCRSs>{crs}</requestResponseCRSs>
+    </supportedCRSs>
+    <supportedFormats><formats>GEOTIFF_INT16</formats></supportedFormats>
+  </CoverageOffering>
+</CoverageDescription>
+"""
+
+SERVICE_EXCEPTION = """<?xml version="1.0" encoding="UTF-8"?>
+<ServiceExceptionReport xmlns="http://www.opengis.net/ogc" version="1.2.0">
+  <ServiceException code="{code}">{message}</ServiceException>
+</ServiceExceptionReport>
+"""
+
+
+class WcsServer:
+    """A local WCS 1.0.0 server that stands in for the SoilGrids map services.
+
+    Parameters
+    ----------
+    host : str, optional
+        Address to listen on.
+    port : int, optional
+        Port to listen on. By default, a free port is picked.
+    latency : float, optional
+        Time, in seconds, every GetCoverage response is delayed by.
+    max_concurrent : int, optional
+        Maximum number of GetCoverage requests served at the same time. Extra
+        requests are answered with HTTP 429 (Too Many Requests).
+    max_pixels : int, optional
+        Maximum number of pixels of a GetCoverage request. Larger requests
+        are answered with an OGC exception report.
+    exceptions : dict, optional
+        Messages of the OGC exception reports to answer GetCoverage requests
+        for the given coverage ids with.
+
+    The failure settings are plain attributes that can be changed while the
+    server runs. :meth:`fail_next` makes the next requests fail with an HTTP
+    status code, :meth:`drop_next` drops their connection halfway through the
+    coverage, and :attr:`requests` records the parameters of every request.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        max_concurrent: int | None = None,
+        max_pixels: int | None = None,
+        exceptions: dict[str, str] | None = None,
+    ) -> None:
+        self.latency = latency
+        self.max_concurrent = max_concurrent
+        self.max_pixels = max_pixels
+        self.exceptions = dict(exceptions or {})
+        self.requests = []
+
+        self._failures = []
+        self._drops = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def link(self, service_id: str) -> str:
+        """Return the URL of a map service."""
+        return f"{self.url}/mapserv?map=/map/{service_id}.map"
+
+    def links(self) -> dict[str, str]:
+        """Return the URLs of all map services, keyed by service id."""
+        return {service_id: self.link(service_id) for service_id in _services()}
+
+    def map_services(self) -> dict[str, dict[str, str]]:
+        """Return a copy of ``SoilGrids.MAP_SERVICES`` pointing at the server."""
+        return {
+            service_id: dict(service, link=self.link(service_id))
+            for service_id, service in SoilGrids.MAP_SERVICES.items()
+        }
+
+    def fail_next(self, status: int, count: int = 1) -> None:
+        """Answer the next ``count`` GetCoverage requests with an HTTP error."""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def drop_next(self, count: int = 1) -> None:
+        """Close the connection of the next ``count`` coverages halfway through."""
+        with self._lock:
+            self._drops += count
+
+    def count(self, request: str) -> int:
+        """Return the number of requests of a type (e.g. ``"GetCoverage"``)."""
+        with self._lock:
+            return sum(
+                params.get("request", "").lower() == request.lower()
+                for params in self.requests
+            )
+
+    def start(self) -> WcsServer:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._httpd.serve_forever, name="wcs-server", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self) -> WcsServer:
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _handle(self, path: str, params: dict[str, str]) -> tuple[int, str, bytes]:
+        with self._lock:
+            self.requests.append(params)
+
+        service_id = params.get("map", "").rsplit("/", 1)[-1].removesuffix(".map")
+        request = params.get("request", "").lower()
+        if urlparse(path).path != "/mapserv" or service_id not in _services():
+            return 404, "text/plain", b"Not Found"
+
+        if request == "getcapabilities":
+            return 200, "text/xml", self._capabilities(service_id).encode()
+        if request == "describecoverage":
+            coverage_id = params.get("coverage", "")
+            if coverage_id not in _coverage_ids(service_id):
+                return _service_exception(
+                    f"msWCSDescribeCoverage(): Unable to find coverage {coverage_id!r}",
+                    "CoverageNotDefined",
+                )
+            return 200, "text/xml", _describe_coverage(coverage_id).encode()
+        if request == "getcoverage":
+            return self._get_coverage(service_id, params)
+        return _service_exception(
+            f"Operation {params.get('request')!r} not supported",
+            "OperationNotSupported",
+        )
+
+    def _capabilities(self, service_id: str) -> str:
+        online_resource = ONLINE_RESOURCE.format(
+            href=escape(f"{self.link(service_id)}&", {'"': "&quot;"})
+        )
+        return CAPABILITIES.format(
+            label=service_id,
+            online_resource=online_resource,
+            briefs="\n".join(
+                COVERAGE_BRIEF.format(name=name) for name in _coverage_ids(service_id)
+            ),
+        )
+
+    def _get_coverage(self, service_id: str, params: dict[str, str]):
+        with self._lock:
+            if self._failures:
+                status = self._failures.pop(0)
+                return status, "text/plain", f"HTTP error {status}".encode()
+            if self.max_concurrent is not None and self._active >= self.max_concurrent:
+                return 429, "text/plain", b"Too Many Requests"
+            self._active += 1
+
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            return self._synthesize(service_id, params)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _take_drop(self) -> bool:
+        with self._lock:
+            if not self._drops:
+                return False
+            self._drops -= 1
+            return True
+
+    def _synthesize(self, service_id: str, params: dict[str, str]):
+        coverage_id = params.get("coverage", "")
+        if coverage_id not in _coverage_ids(service_id):
+            return _service_exception(
+                f"msWCSGetCoverage(): Unable to find coverage {coverage_id!r}",
+                "CoverageNotDefined",
+            )
+        if coverage_id in self.exceptions:
+            return _service_exception(self.exceptions[coverage_id])
+
+        crs = _crs_code(params.get("crs", ""))
+        response_crs = _crs_code(params.get("response_crs", "")) or crs
+        if crs not in SUPPORTED_CRS or response_crs not in SUPPORTED_CRS:
+            return _service_exception(
+                "msWCSGetCoverage(): Unsupported CRS", "InvalidParameterValue"
+            )
+        if params.get("format", "GEOTIFF_INT16") != "GEOTIFF_INT16":
+            return _service_exception(
+                "msWCSGetCoverage(): Unsupported format", "InvalidFormat"
+            )
+
+        try:
+            west, south, east, north = (float(v) for v in params["bbox"].split(","))
+            if params.get("width") and params.get("height"):
+                width, height = int(params["width"]), int(params["height"])
+            else:
+                width = round((east - west) / float(params["resx"]))
+                height = round((north - south) / float(params["resy"]))
+        except (KeyError, ValueError):
+            return _service_exception(
+                "msWCSGetCoverage(): BBOX and RESX/RESY or WIDTH/HEIGHT are required",
+                "MissingParameterValue",
+            )
+        if width <= 0 or height <= 0:
+            return _service_exception(
+                "msWCSGetCoverage(): Invalid raster size", "InvalidParameterValue"
+            )
+        if self.max_pixels is not None and width * height > self.max_pixels:
+            return _service_exception(
+                f"msWCSGetCoverage(): Raster size out of range, width and height of"
+                f" resulting coverage must be no more than MAXSIZE ({width}x{height}"
+                " requested)."
+            )
+
+        if response_crs != crs:
+            west, south, east, north = transform_bounds(
+                CRS.from_string(SUPPORTED_CRS[crs]),
+                CRS.from_string(SUPPORTED_CRS[response_crs]),
+                west,
+                south,
+                east,
+                north,
+            )
+
+        return (
+            200,
+            "image/tiff",
+            synthesize_coverage(
+                coverage_id, response_crs, (west, south, east, north), width, height
+            ),
+        )
+
+
+def synthesize_coverage(
+    coverage_id: str,
+    crs: str,
+    bbox: tuple[float, float, float, float],
+    width: int,
+    height: int,
+) -> bytes:
+    """Return the GeoTIFF the stand-in server sends for a GetCoverage request.
+
+    Pixel values are a smooth function of the coordinates of the pixel centers
+    and of the coverage id, so they do not depend on the extent of a request.
+    """
+    west, south, east, north = bbox
+    xs = west + (numpy.arange(width) + 0.5) * (east - west) / width
+    ys = north - (numpy.arange(height) + 0.5) * (north - south) / height
+
+    # a wavelength of about 100 km, whatever the units of the CRS
+    scale = 1.0 if crs == "EPSG:4326" else 1.0 / 111_000
+    seed = sum(coverage_id.encode()) % 97
+    array = (
+        500
+        + 10 * seed
+        + 200
+        * numpy.sin(ys[:, None] * scale * 2 * math.pi + seed)
+        * numpy.cos(xs[None, :] * scale * 2 * math.pi)
+    ).astype("int16")
+
+    with MemoryFile() as memfile:
+        with memfile.open(
+            driver="GTiff",
+            width=width,
+            height=height,
+            count=1,
+            dtype="int16",
+            crs=CRS.from_string(SUPPORTED_CRS[crs]),
+            nodata=NODATA,
+            transform=from_bounds(west, south, east, north, width, height),
+        ) as dst:
+            dst.write(array, 1)
+        return memfile.read()
+
+
+def _services() -> list[str]:
+    return list(SoilGrids.MAP_SERVICES)
+
+
+def _coverage_ids(service_id: str) -> list[str]:
+    if service_id == "wrb":
+        return ["MostProbable"]
+    # organic carbon stocks are only mapped for the topsoil
+    depths = ["0-30cm"] if service_id == "ocs" else SoilGrids.DEPTH_INTERVALS
+    return [
+        f"{service_id}_{depth}_{statistic}"
+        for depth in depths
+        for statistic in STATISTICS
+    ]
+
+
+def _describe_coverage(coverage_id: str) -> str:
+    return DESCRIBE_COVERAGE.format(
+        name=coverage_id, bounds=HOMOLOSINE_BOUNDS, crs=" ".join(SUPPORTED_CRS)
+    )
+
+
+def _crs_code(crs: str) -> str:
+    # accept both "EPSG:4326" and "urn:ogc:def:crs:EPSG::4326"
+    if crs.startswith("urn:ogc:def:crs:EPSG:"):
+        return "EPSG:" + crs.rsplit(":", 1)[-1]
+    return crs
+
+
+def _service_exception(message: str, code: str = "NoApplicableCode"):
+    body = SERVICE_EXCEPTION.format(code=code, message=escape(message))
+    return 200, "application/vnd.ogc.se_xml", body.encode()
+
+
+def _make_handler(server: WcsServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            params = {
+                key.lower(): values[-1]
+                for key, values in parse_qs(urlparse(self.path).query).items()
+            }
+            status, content_type, body = server._handle(self.path, params)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if content_type == "image/tiff" and server._take_drop():
+                # announce the whole coverage, but hang up halfway through it
+                self.wfile.write(body[: len(body) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
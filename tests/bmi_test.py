@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import numpy
+import pytest
+import rasterio
+import yaml
+from rasterio.transform import from_origin
+from soilgrids import BmiSoilGrids
+from soilgrids import SoilGrids
+from soilgrids.bmi import _read_at_indices
+from soilgrids.bmi import _scale
+from soilgrids.bmi import BmiSource
+
+from .soilgrids_test import DummyCoverage
+from .soilgrids_test import SyntheticWCS
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    wcs = SyntheticWCS()
+    monkeypatch.setattr(
+        SoilGrids,
+        "_get_service_and_coverage_list",
+        lambda self, _service_id: (wcs, ["phh2o_0-5cm_mean"]),
+    )
+    monkeypatch.setattr(SoilGrids, "_get_coverage_obj", lambda *_args: DummyCoverage())
+
+    def write_config(**kwargs):
+        conf = {
+            "service_id": "phh2o",
+            "coverage_id": "phh2o_0-5cm_mean",
+            "crs": "urn:ogc:def:crs:EPSG::152160",
+            "west": -1784000,
+            "south": 1356000,
+            "east": -1140000,
+            "north": 1863000,
+            "resx": 1000,
+            "resy": 1000,
+            "output": str(tmp_path / "test.tif"),
+            "cache_dir": str(tmp_path / "cache"),
+        }
+        conf.update(kwargs)
+        with open(tmp_path / "config.yaml", "w") as fp:
+            yaml.safe_dump({"bmi-soilgrids": conf}, fp)
+        return str(tmp_path / "config.yaml")
+
+    return write_config
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_get_value_ptr_is_a_reference(config_file):
+    model = BmiSoilGrids()
+    model.initialize(config_file())
+    name = model.get_output_var_names()[0]
+
+    ptr = model.get_value_ptr(name)
+    assert model.get_value_ptr(name) is ptr
+    assert ptr.shape == (507, 644)
+    assert model.get_var_type(name) == "float64"
+    assert model.get_var_nbytes(name) == ptr.nbytes
+
+    dest = numpy.empty(model.get_grid_size(model.get_var_grid(name)))
+    assert model.get_value(name, dest) is dest
+    numpy.testing.assert_array_equal(dest, ptr.reshape(-1))
+    assert not numpy.shares_memory(dest, ptr)
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_dtype(config_file):
+    model = BmiSoilGrids()
+    model.initialize(config_file(dtype="float32"))
+    name = model.get_output_var_names()[0]
+
+    assert model.get_value_ptr(name).dtype == numpy.float32
+    assert model.get_var_type(name) == "float32"
+    assert model.get_var_itemsize(name) == 4
+
+    with pytest.raises(ValueError, match="floating point"):
+        BmiSoilGrids().initialize(config_file(dtype="int16"))
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+@pytest.mark.parametrize("lazy", [{"lazy": True}, {"chunks": {"x": 128, "y": 128}}])
+def test_lazy_get_value_at_indices(config_file, lazy):
+    if "chunks" in lazy:
+        pytest.importorskip("dask")
+    eager = BmiSoilGrids()
+    eager.initialize(config_file())
+    model = BmiSoilGrids()
+    model.initialize(config_file(**lazy))
+    name = model.get_output_var_names()[0]
+    inds = numpy.array([0, 5, 644 * 300 + 17, 644 * 507 - 1, 5])
+
+    values = model.get_value_at_indices(name, numpy.empty(len(inds)), inds)
+
+    assert model._values == {}
+    numpy.testing.assert_array_equal(
+        values, eager.get_value_at_indices(name, numpy.empty(len(inds)), inds)
+    )
+    numpy.testing.assert_array_equal(
+        model.get_value(name, numpy.empty(644 * 507)),
+        eager.get_value_ptr(name).reshape(-1),
+    )
+
+    empty = numpy.array([], dtype=int)
+    assert model.get_value_at_indices(name, numpy.empty(0), empty).shape == (0,)
+
+
+def test_read_at_indices(tmp_path):
+    array = numpy.arange(60 * 70, dtype="int16").reshape((60, 70))
+    array[10, 20] = -32768
+    with rasterio.open(
+        tmp_path / "test.tif",
+        "w",
+        driver="GTiff",
+        width=70,
+        height=60,
+        count=1,
+        dtype="int16",
+        nodata=-32768,
+        tiled=True,
+        blockxsize=16,
+        blockysize=16,
+        transform=from_origin(0, 60, 1, 1),
+    ) as dst:
+        dst.write(array, 1)
+    inds = numpy.array([69, 0, 10 * 70 + 20, 59 * 70 + 69, 33 * 70 + 47, 69])
+
+    raw = _read_at_indices(str(tmp_path / "test.tif"), 1, [60, 70], inds)
+    numpy.testing.assert_array_equal(raw, array.reshape(-1)[inds])
+
+    values = _scale(raw, BmiSource("test.tif", 1, 0.1, 1.0, -32768), "float32")
+    assert values.dtype == numpy.float32
+    numpy.testing.assert_allclose(
+        values, [7.9, 1.0, numpy.nan, 420.9, 236.7, 7.9], rtol=1e-6
+    )
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_multiple_coverages(config_file, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = BmiSoilGrids()
+    model.initialize(
+        config_file(
+            coverages=[
+                {"service_id": "phh2o", "coverage_id": "phh2o_0-5cm_mean"},
+                {"service_id": "clay", "coverage_id": "clay_0-5cm_mean"},
+                {
+                    "service_id": "clay",
+                    "coverage_id": "clay_5-15cm_mean",
+                    "name": "Clay content 5-15cm",
+                    "resx": 2000,
+                    "resy": 2000,
+                    "output": "clay_5-15cm.tif",
+                },
+            ],
+        )
+    )
+
+    assert model.get_output_var_names() == (
+        "Soil pH in H2O",
+        "Clay content",
+        "Clay content 5-15cm",
+    )
+    assert [model.get_var_grid(name) for name in model.get_output_var_names()] == [
+        0,
+        0,
+        1,
+    ]
+    assert model.get_grid_size(0) == 644 * 507
+    assert model.get_grid_size(1) == 322 * 254
+    assert model.get_value_ptr("Clay content").shape == (507, 644)
+    assert model.get_value_ptr("Clay content 5-15cm").shape == (254, 322)
+
+    x = model.get_grid_x(1, numpy.empty(322))
+    assert x[1] - x[0] == 2000
+    # the output of the block is not shared by the coverages
+    assert sorted(path.name for path in tmp_path.glob("*.tif")) == [
+        "clay_0-5cm_mean.tif",
+        "clay_5-15cm.tif",
+        "phh2o_0-5cm_mean.tif",
+    ]
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_multiple_coverages_have_their_own_files(config_file, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = BmiSoilGrids()
+    model.initialize(
+        config_file(
+            coverages=[
+                {"coverage_id": "phh2o_0-5cm_mean", "name": "pH"},
+                {
+                    "coverage_id": "phh2o_0-5cm_mean",
+                    "name": "coarse pH",
+                    "resx": 2000,
+                    "resy": 2000,
+                },
+                {"depths": ["0-5cm"], "name": "profile"},
+                {"depths": ["5-15cm"], "name": "other profile"},
+            ],
+        )
+    )
+
+    assert model.get_value_ptr("pH").shape == (507, 644)
+    assert model.get_value_ptr("coarse pH").shape == (254, 322)
+    assert model.get_value_ptr("profile").shape == (1, 507, 644)
+    assert sorted(path.name for path in tmp_path.glob("*.tif")) == [
+        "phh2o_0-5cm_mean.tif",
+        "phh2o_0-5cm_mean_2.tif",
+        "phh2o_mean.tif",
+        "phh2o_mean_2.tif",
+    ]
+
+
+def test_multiple_coverages_need_unique_outputs(config_file, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = BmiSoilGrids()
+    with pytest.raises(ValueError, match="output"):
+        model.initialize(
+            config_file(
+                coverages=[
+                    {"coverage_id": "phh2o_0-5cm_mean", "output": "a.tif"},
+                    {"coverage_id": "phh2o_5-15cm_mean", "output": "a.tif"},
+                ],
+            )
+        )
+
+
+def test_multiple_coverages_need_unique_names(config_file, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = BmiSoilGrids()
+    with pytest.raises(ValueError):
+        model.initialize(
+            config_file(
+                coverages=[
+                    {"coverage_id": "phh2o_0-5cm_mean", "output": "a.tif"},
+                    {"coverage_id": "phh2o_5-15cm_mean", "output": "b.tif"},
+                ],
+            )
+        )
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+@pytest.mark.parametrize("lazy", [False, True])
+def test_soil_profile(config_file, tmp_path, monkeypatch, lazy):
+    monkeypatch.chdir(tmp_path)
+    model = BmiSoilGrids()
+    model.initialize(
+        config_file(
+            coverages=[
+                {"depths": ["0-5cm", "5-15cm", "15-30cm"], "lazy": lazy},
+                {"coverage_id": "phh2o_0-5cm_mean", "name": "pH 0-5cm"},
+            ],
+        )
+    )
+    name = "Soil pH in H2O"
+    grid = model.get_var_grid(name)
+
+    assert model.get_grid_type(grid) == "rectilinear"
+    assert model.get_grid_rank(grid) == 3
+    assert list(model.get_grid_shape(grid, numpy.empty(3, int))) == [3, 507, 644]
+    numpy.testing.assert_array_equal(
+        model.get_grid_z(grid, numpy.empty(3)), [2.5, 10.0, 22.5]
+    )
+    assert model.get_var_grid("pH 0-5cm") != grid
+    with pytest.raises(NotImplementedError):
+        model.get_grid_z(model.get_var_grid("pH 0-5cm"), numpy.empty(3))
+
+    # one soil column in a single call
+    column = numpy.arange(3) * 507 * 644 + 300 * 644 + 17
+    values = model.get_value_at_indices(name, numpy.empty(3), column)
+    profile = model.get_value_ptr(name)
+
+    assert profile.shape == (3, 507, 644)
+    assert profile.flags["C_CONTIGUOUS"]
+    numpy.testing.assert_array_equal(values, profile[:, 300, 17])
+    numpy.testing.assert_array_equal(profile[0], model.get_value_ptr("pH 0-5cm"))
+    assert sorted(path.name for path in tmp_path.glob("*.tif")) == [
+        "phh2o_0-5cm_mean.tif",
+        "phh2o_mean.tif",
+    ]
@@ -0,0 +1,479 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy
+import pytest
+import rasterio
+import requests
+import soilgrids.cache as cache_module
+from owslib.etree import etree
+from rasterio.transform import from_origin
+from soilgrids.cache import CapabilitiesCache
+from soilgrids.cache import CoverageCache
+from soilgrids.cache import request_key
+from soilgrids.cache import SpatialIndex
+
+LINK = "http://localhost/mapserv?map=/map/phh2o.map"
+
+CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<WCS_Capabilities xmlns="http://www.opengis.net/wcs"
+  xmlns:gml="http://www.opengis.net/gml"
+  xmlns:xlink="http://www.w3.org/1999/xlink" version="1.0.0">
+  <Service>
+    <name>MapServer WCS</name>
+    <label>phh2o</label>
+    <fees>NONE</fees>
+    <accessConstraints>NONE</accessConstraints>
+  </Service>
+  <Capability>
+    <Request>
+      <GetCoverage>
+        <DCPType><HTTP><Get>
+          <OnlineResource xlink:href="http://localhost/mapserv?"/>
+        </Get></HTTP></DCPType>
+      </GetCoverage>
+    </Request>
+  </Capability>
+  <ContentMetadata>
+    <CoverageOfferingBrief><name>phh2o_0-5cm_mean</name></CoverageOfferingBrief>
+    <CoverageOfferingBrief><name>phh2o_5-15cm_mean</name></CoverageOfferingBrief>
+  </ContentMetadata>
+</WCS_Capabilities>
+"""
+
+DESCRIBE_COVERAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<CoverageDescription xmlns="http://www.opengis.net/wcs"
+  xmlns:gml="http://www.opengis.net/gml" version="1.0.0">
+  <CoverageOffering>
+    <name>phh2o_0-5cm_mean</name>
+    <domainSet><spatialDomain>
+      <gml:Envelope srsName="EPSG:152160">
+        <gml:pos>-19949750 -6147500</gml:pos>
+        <gml:pos>19861750 8361000</gml:pos>
+      </gml:Envelope>
+    </spatialDomain></domainSet>
+    <supportedCRSs>
+      <requestResponseCRSs>EPSG:152160 EPSG:4326</requestResponseCRSs>
+    </supportedCRSs>
+  </CoverageOffering>
+</CoverageDescription>
+"""
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    """Serve canned capabilities and count the requests that hit the network."""
+    calls = {"capabilities": 0, "describe": 0}
+    wcs_class = cache_module.WebCoverageService
+
+    def fake_wcs(url, version=None, xml=None):
+        if xml is None:
+            calls["capabilities"] += 1
+        wcs = wcs_class(url, version=version, xml=xml or CAPABILITIES.encode())
+        described = {}
+
+        def describe(identifier):
+            if identifier not in described:
+                calls["describe"] += 1
+                described[identifier] = etree.fromstring(DESCRIBE_COVERAGE.encode())
+            return described[identifier]
+
+        wcs.getDescribeCoverage = describe
+        return wcs
+
+    monkeypatch.setattr(cache_module, "WebCoverageService", fake_wcs)
+    return calls
+
+
+def test_capabilities_are_fetched_once(tmp_path, fetches):
+    cache = CapabilitiesCache(str(tmp_path))
+
+    _, coverage_list = cache.get_service("phh2o", LINK)
+    assert coverage_list == ["phh2o_0-5cm_mean", "phh2o_5-15cm_mean"]
+
+    wcs, coverage_list = CapabilitiesCache(str(tmp_path)).get_service("phh2o", LINK)
+    assert coverage_list == ["phh2o_0-5cm_mean", "phh2o_5-15cm_mean"]
+    assert fetches["capabilities"] == 1
+    assert os.listdir(os.path.join(tmp_path, "capabilities")) == ["phh2o.json"]
+
+
+def test_coverage_info_is_cached(tmp_path, fetches):
+    cache = CapabilitiesCache(str(tmp_path))
+    wcs, _ = cache.get_service("phh2o", LINK)
+
+    info = cache.get_coverage("phh2o", wcs, "phh2o_0-5cm_mean")
+    cached = cache.get_coverage("phh2o", wcs, "phh2o_0-5cm_mean")
+
+    assert fetches["describe"] == 1
+    assert [crs.getcodeurn() for crs in cached.supportedCRS] == [
+        crs.getcodeurn() for crs in info.supportedCRS
+    ]
+    assert [crs.getcodeurn() for crs in cached.supportedCRS] == [
+        "urn:ogc:def:crs:EPSG::152160",
+        "urn:ogc:def:crs:EPSG::4326",
+    ]
+    assert cached.boundingboxes == [
+        {"nativeSrs": "EPSG:152160", "bbox": (-19949750, -6147500, 19861750, 8361000)}
+    ]
+
+
+def test_expired_entry_is_revalidated(tmp_path, fetches):
+    cache = CapabilitiesCache(str(tmp_path), ttl=-1)
+    wcs, _ = cache.get_service("phh2o", LINK)
+    cache.get_coverage("phh2o", wcs, "phh2o_0-5cm_mean")
+
+    wcs, _ = cache.get_service("phh2o", LINK)
+    cache.get_coverage("phh2o", wcs, "phh2o_0-5cm_mean")
+
+    assert fetches["capabilities"] == 2
+    assert fetches["describe"] == 1
+
+
+def test_entry_for_another_link_is_ignored(tmp_path, fetches):
+    CapabilitiesCache(str(tmp_path)).get_service("phh2o", LINK)
+    CapabilitiesCache(str(tmp_path)).get_service("phh2o", LINK + "&x=1")
+
+    assert fetches["capabilities"] == 2
+    with open(os.path.join(tmp_path, "capabilities", "phh2o.json")) as fp:
+        assert json.load(fp)["link"] == LINK + "&x=1"
+
+
+def test_clear(tmp_path, fetches):
+    cache = CapabilitiesCache(str(tmp_path))
+    cache.get_service("phh2o", LINK)
+    cache.clear()
+    cache.get_service("phh2o", LINK)
+
+    assert fetches["capabilities"] == 2
+
+
+def write_file(path, content):
+    with open(path, "wb") as fp:
+        fp.write(content)
+    return str(path)
+
+
+def test_request_key_is_canonical():
+    request = {"coverage_id": "phh2o_0-5cm_mean", "bbox": (-1784000, 1356000, 0, 1)}
+
+    assert request_key(request) == request_key(
+        {"bbox": [-1784000.0, 1356000.0, 0.0, 1.0], "coverage_id": "phh2o_0-5cm_mean"}
+    )
+    assert request_key(request) != request_key(dict(request, resx=500))
+
+
+def test_coverage_cache_fetch(tmp_path):
+    cache = CoverageCache(str(tmp_path / "cache"))
+    source = write_file(tmp_path / "source.tif", b"coverage")
+    output = str(tmp_path / "output.tif")
+
+    assert not cache.fetch("key", output)
+
+    cache.put("key", source, {"coverage_id": "phh2o_0-5cm_mean"})
+    assert "key" in cache
+    assert cache.fetch("key", output)
+    with open(output, "rb") as fp:
+        assert fp.read() == b"coverage"
+
+    mtime = os.path.getmtime(output)
+    assert cache.fetch("key", output)
+    assert os.path.getmtime(output) == mtime
+
+    write_file(output, b"something else")
+    assert cache.fetch("key", output)
+    with open(output, "rb") as fp:
+        assert fp.read() == b"coverage"
+
+
+def test_coverage_cache_evicts_least_recently_used(tmp_path):
+    cache = CoverageCache(str(tmp_path / "cache"), max_size=20)
+    source = write_file(tmp_path / "source.tif", b"0123456789")
+
+    cache.put("first", source, {})
+    cache.put("second", source, {})
+    cache.fetch("first", str(tmp_path / "output.tif"))
+    cache.put("third", source, {})
+
+    assert "first" in cache
+    assert "second" not in cache
+    assert "third" in cache
+    assert sorted(os.listdir(tmp_path / "cache" / "coverages")) == [
+        "first.tif",
+        "index.json",
+        "locks",
+        "spatial-index.json",
+        "third.tif",
+    ]
+
+
+def test_coverage_cache_records_large_files(tmp_path):
+    cache = CoverageCache(str(tmp_path / "cache"), max_size=0)
+    source = write_file(tmp_path / "source.tif", b"coverage")
+    cache.put("key", source, {})
+
+    assert "key" in cache
+    assert not os.path.exists(tmp_path / "cache" / "coverages" / "key.tif")
+
+    mtime = os.path.getmtime(source)
+    assert cache.fetch("key", source)
+    assert os.path.getmtime(source) == mtime
+
+    output = str(tmp_path / "output.tif")
+    assert cache.fetch("key", output)
+    with open(output, "rb") as fp:
+        assert fp.read() == b"coverage"
+
+    # a changed file is not used, and the record is forgotten
+    write_file(source, b"something else")
+    assert not cache.fetch("key", str(tmp_path / "other.tif"))
+    assert "key" not in cache
+
+
+def test_coverage_cache_keeps_recent_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_module, "MAX_REFERENCES", 2)
+    cache = CoverageCache(str(tmp_path / "cache"))
+    for key in ("first", "second", "third"):
+        cache.record(key, write_file(tmp_path / f"{key}.tif", b"coverage"), {})
+
+    assert "first" not in cache
+    assert "second" in cache
+    assert "third" in cache
+
+    # a copy in the cache is not replaced by a record
+    cache.put("copy", write_file(tmp_path / "copy.tif", b"coverage"), {})
+    cache.record("copy", write_file(tmp_path / "copy.tif", b"changed"), {})
+    output = str(tmp_path / "output.tif")
+    assert cache.fetch("copy", output)
+    with open(output, "rb") as fp:
+        assert fp.read() == b"coverage"
+
+
+def test_coverage_cache_forgets_missing_files(tmp_path):
+    cache = CoverageCache(str(tmp_path / "cache"))
+    cache.put("key", write_file(tmp_path / "source.tif", b"coverage"), {})
+    os.remove(tmp_path / "cache" / "coverages" / "key.tif")
+
+    assert not cache.fetch("key", str(tmp_path / "output.tif"))
+    assert "key" not in cache
+
+
+HOLD_LOCK = """
+import sys, time
+from soilgrids.cache import CoverageCache
+
+with CoverageCache(sys.argv[1]).lock("key"):
+    print("locked", flush=True)
+    time.sleep(1)
+"""
+
+
+def test_coverage_cache_lock_is_held_across_processes(tmp_path):
+    cache = CoverageCache(str(tmp_path / "cache"))
+    holder = subprocess.Popen(
+        [sys.executable, "-c", HOLD_LOCK, str(tmp_path / "cache")],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        start = time.monotonic()
+        with cache.lock("key"):
+            waited = time.monotonic() - start
+        # other keys are not locked
+        with cache.lock("other"):
+            pass
+    finally:
+        holder.wait()
+
+    assert waited > 0.5
+
+
+def test_disabled_coverage_cache_is_not_locked(tmp_path):
+    cache = CoverageCache(str(tmp_path / "cache"), max_size=0)
+    with cache.lock("key"):
+        with cache.lock("key"):
+            pass
+    assert not os.path.exists(tmp_path / "cache")
+
+
+def test_coverage_cache_crop(tmp_path):
+    cache = CoverageCache(str(tmp_path / "cache"))
+    source = str(tmp_path / "source.tif")
+    with rasterio.open(
+        source,
+        "w",
+        driver="GTiff",
+        width=40,
+        height=30,
+        count=1,
+        dtype="int16",
+        crs="EPSG:3857",
+        transform=from_origin(1000, 5000, 100, 100),
+        nodata=-32768,
+    ) as dst:
+        dst.write(numpy.arange(1200, dtype="int16").reshape(1, 30, 40))
+    request = {
+        "service_url": LINK,
+        "service_id": "phh2o",
+        "coverage_id": "phh2o_0-5cm_mean",
+        "crs": "EPSG:3857",
+        "bbox": (1000, 2000, 5000, 5000),
+        "resx": 100,
+        "resy": 100,
+        "width": None,
+        "height": None,
+        "response_crs": "EPSG:3857",
+        "format": "GEOTIFF_INT16",
+    }
+    cache.put("key", source, request)
+    output = str(tmp_path / "output.tif")
+
+    assert cache.crop(dict(request, bbox=(1500, 3000, 2500, 4500)), output)
+    with rasterio.open(output) as src:
+        assert src.transform == from_origin(1500, 4500, 100, 100)
+        assert src.nodata == -32768
+        numpy.testing.assert_array_equal(
+            src.read(1), numpy.arange(1200).reshape(30, 40)[5:20, 5:15]
+        )
+
+    assert not cache.crop(dict(request, bbox=(1550, 3000, 2550, 4500)), output)
+    assert not cache.crop(dict(request, bbox=(500, 3000, 2500, 4500)), output)
+    assert not cache.crop(dict(request, bbox=(1500, 3000, 2500, 4500), resx=50), output)
+    assert not cache.crop(
+        dict(request, bbox=(1500, 3000, 2500, 4500), coverage_id="phh2o_5-15cm_mean"),
+        output,
+    )
+    assert not cache.crop(dict(request, width=10, height=15, resx=None), output)
+
+
+def grid_request(bbox, **kwargs):
+    return dict(
+        {
+            "service_url": LINK,
+            "service_id": "phh2o",
+            "coverage_id": "phh2o_0-5cm_mean",
+            "crs": "EPSG:3857",
+            "bbox": bbox,
+            "resx": 100,
+            "resy": 100,
+            "width": None,
+            "height": None,
+            "response_crs": None,
+            "format": "GEOTIFF_INT16",
+        },
+        **kwargs,
+    )
+
+
+def test_spatial_index_queries(tmp_path):
+    # "large" spans more than 16 buckets of 10 x 10 pixels
+    index = SpatialIndex(
+        str(tmp_path / "spatial-index.json"), bucket_pixels=10, max_buckets=16
+    )
+    index.add("large", grid_request((0, 0, 4000, 4000)))
+    index.add("small", grid_request((1000, 1000, 2000, 2000)))
+    index.add("east", grid_request((4000, 0, 6000, 2000)))
+    index.add("other", grid_request((0, 0, 4000, 4000), resx=250, resy=250))
+    index.add("bbox-only", grid_request((0, 0, 4000, 4000), resx=None, resy=None))
+
+    assert len(index) == 4
+    assert "bbox-only" not in index
+    assert index.contains(grid_request((1200, 1200, 1800, 1800))) == [
+        "small",
+        "large",
+    ]
+    assert index.contains(grid_request((3000, 1000, 5000, 1500))) == []
+    assert index.intersects(grid_request((3000, 1000, 5000, 1500))) == [
+        "east",
+        "large",
+    ]
+    assert index.intersects(grid_request((7000, 0, 8000, 1000))) == []
+    assert index.coverage_fraction(grid_request((3000, 0, 7000, 2000))) == 0.75
+    assert index.coverage_fraction(grid_request((0, 0, 1000, 1000), resx=50)) == 0.0
+    # half a pixel off the grid of the cached coverages, which cannot be cropped
+    assert index.contains(grid_request((1250, 1200, 1850, 1800))) == []
+    assert index.coverage_fraction(grid_request((3050, 0, 7050, 2000))) == 0.0
+    assert index.coverage_fraction(grid_request((3000, 0, 7000, 1950))) == 0.0
+
+    index.remove("large")
+    assert index.contains(grid_request((1200, 1200, 1800, 1800))) == ["small"]
+    assert index.coverage_fraction(grid_request((0, 0, 2000, 2000))) == 0.25
+
+
+def test_spatial_index_is_persistent(tmp_path):
+    path = str(tmp_path / "spatial-index.json")
+    index = SpatialIndex(path)
+    assert not index.load()
+    index.rebuild({"key": grid_request((0, 0, 4000, 4000))})
+
+    other = SpatialIndex(path)
+    assert other.load()
+    assert other.contains(grid_request((1000, 1000, 2000, 2000))) == ["key"]
+
+    index.add("second", grid_request((4000, 0, 8000, 4000)))
+    assert other.load()
+    assert other.coverage_fraction(grid_request((0, 0, 8000, 4000))) == 1.0
+
+
+def test_spatial_index_queries_visit_few_coverages(tmp_path):
+    index = SpatialIndex(str(tmp_path / "spatial-index.json"))
+    # a thousand 100 x 100 pixel coverages, side by side
+    index.rebuild(
+        {
+            f"{col}-{row}": grid_request(
+                (col * 10000, row * 10000, (col + 1) * 10000, (row + 1) * 10000)
+            )
+            for col in range(40)
+            for row in range(25)
+        }
+    )
+    request = grid_request((152000, 121000, 158000, 129000))
+
+    assert index.contains(request) == ["15-12"]
+    assert index.coverage_fraction(request) == 1.0
+    # only the coverages of the buckets the request falls in are checked
+    group, bbox = index._query(request)
+    assert len(index._candidates(group, bbox)) < 100
+
+
+def test_coverage_cache_keeps_spatial_index(tmp_path):
+    cache = CoverageCache(str(tmp_path / "cache"), max_size=20)
+    source = write_file(tmp_path / "source.tif", b"0123456789")
+    cache.put("first", source, grid_request((0, 0, 1000, 1000)))
+    cache.put("second", source, grid_request((1000, 0, 2000, 1000)))
+
+    request = grid_request((0, 0, 2000, 1000))
+    assert cache.coverage_fraction(request) == 1.0
+
+    cache.put("third", source, grid_request((0, 1000, 1000, 2000)))
+    assert "first" not in cache
+    assert cache.coverage_fraction(request) == 0.5
+
+    os.remove(tmp_path / "cache" / "coverages" / "spatial-index.json")
+    assert CoverageCache(str(tmp_path / "cache")).coverage_fraction(request) == 0.5
+
+    cache.clear()
+    assert cache.coverage_fraction(request) == 0.0
+
+
+def test_expired_entry_is_used_offline(tmp_path, fetches, monkeypatch):
+    cache = CapabilitiesCache(str(tmp_path), ttl=-1)
+    cache.get_service("phh2o", LINK)
+    wcs_class = cache_module.WebCoverageService
+
+    def offline(url, version=None, xml=None):
+        if xml is None:
+            raise requests.ConnectionError("network is unreachable")
+        return wcs_class(url, version=version, xml=xml)
+
+    monkeypatch.setattr(cache_module, "WebCoverageService", offline)
+    _, coverage_list = cache.get_service("phh2o", LINK)
+
+    assert coverage_list == ["phh2o_0-5cm_mean", "phh2o_5-15cm_mean"]
+    with pytest.raises(requests.ConnectionError):
+        CapabilitiesCache(str(tmp_path / "empty")).get_service("phh2o", LINK)
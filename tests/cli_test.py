@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 from __future__ import annotations
 
+import csv
 import os
 
 import pytest
 import soilgrids.cli as cli_module
+import yaml
 from click.testing import CliRunner
+from soilgrids import SoilGrids
 from soilgrids import SoilGridsWcsError
 
+from .soilgrids_test import DummyCoverage
+from .soilgrids_test import SyntheticWCS
+
 
 def test_command_line_interface():
     runner = CliRunner()
@@ -150,7 +156,7 @@ def test_cli_converts_soilgrids_error_to_click_exception(monkeypatch, tmp_path):
     def raise_wcs_error(*_args, **_kwargs):
         raise SoilGridsWcsError("WCS server error. out of memory", request={})
 
-    monkeypatch.setattr(cli_module.SoilGrids, "get_coverage_data", raise_wcs_error)
+    monkeypatch.setattr(SoilGrids, "get_coverage_data", raise_wcs_error)
 
     runner = CliRunner()
     result = runner.invoke(
@@ -265,3 +271,94 @@ def test_load_localfile(tmpdir):
         file2_info = os.path.getmtime("test.tif")
 
     assert file1_info == file2_info
+
+
+@pytest.fixture
+def synthetic_wcs(monkeypatch):
+    wcs = SyntheticWCS()
+    monkeypatch.setattr(
+        SoilGrids,
+        "_get_service_and_coverage_list",
+        lambda self, _service_id: (wcs, ["phh2o_0-5cm_mean"]),
+    )
+    monkeypatch.setattr(SoilGrids, "_get_coverage_obj", lambda *_args: DummyCoverage())
+    return wcs
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_batch_yaml_manifest(tmp_path, monkeypatch, synthetic_wcs):
+    monkeypatch.setenv("SOILGRIDS_CACHE_DIR", str(tmp_path / "cache"))
+    manifest = {
+        "defaults": {
+            "service_id": "phh2o",
+            "coverage_id": "phh2o_0-5cm_mean",
+            "crs": "urn:ogc:def:crs:EPSG::152160",
+            "resx": 1000,
+            "resy": 1000,
+        },
+        "requests": [
+            {"bbox": [0, 0, 50000, 20000], "output": str(tmp_path / "a.tif")},
+            {"bbox": "0,0,20000,20000", "output": str(tmp_path / "b.tif")},
+            {
+                "bbox": [0, 0, 20000, 20000],
+                "crs": "error",
+                "output": str(tmp_path / "c.tif"),
+            },
+        ],
+    }
+    with open(tmp_path / "manifest.yaml", "w") as fp:
+        yaml.safe_dump(manifest, fp)
+
+    result = CliRunner().invoke(
+        cli_module.main,
+        [
+            "batch",
+            "--workers=2",
+            f"--summary={tmp_path / 'summary.csv'}",
+            str(tmp_path / "manifest.yaml"),
+        ],
+    )
+
+    assert result.exit_code != 0
+    assert "1 of 3 requests failed" in result.output
+    with open(tmp_path / "summary.csv") as fp:
+        summary = list(csv.DictReader(fp))
+    assert [row["status"] for row in summary] == ["ok", "ok", "failed"]
+    assert int(summary[0]["bytes"]) == os.path.getsize(tmp_path / "a.tif")
+    assert float(summary[1]["duration"]) >= 0
+    assert "coordinate system" in summary[2]["error"]
+    assert len(synthetic_wcs.requests) == 2
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_batch_csv_manifest(tmp_path, monkeypatch, synthetic_wcs):
+    monkeypatch.setenv("SOILGRIDS_CACHE_DIR", str(tmp_path / "cache"))
+    with open(tmp_path / "manifest.csv", "w") as fp:
+        fp.write(
+            "service_id,coverage_id,crs,west,south,east,north,resx,resy,tiled,output\n"
+            "phh2o,phh2o_0-5cm_mean,urn:ogc:def:crs:EPSG::152160,"
+            f"0,0,50000,20000,1000,1000,true,{tmp_path / 'a.tif'}\n"
+            "phh2o,phh2o_0-5cm_mean,urn:ogc:def:crs:EPSG::152160,"
+            f"0,0,20000,20000,,,,{tmp_path / 'b.tif'}\n"
+        )
+
+    result = CliRunner().invoke(
+        cli_module.main, ["batch", str(tmp_path / "manifest.csv")]
+    )
+
+    assert result.exit_code == 0
+    assert os.path.isfile(tmp_path / "a.tif")
+    assert os.path.isfile(tmp_path / "b.tif")
+    assert synthetic_wcs.requests[-1]["resx"] == 250
+
+
+def test_batch_invalid_manifest(tmp_path):
+    with open(tmp_path / "manifest.csv", "w") as fp:
+        fp.write("service_id,tiled\nphh2o,maybe\n")
+
+    result = CliRunner().invoke(
+        cli_module.main, ["batch", str(tmp_path / "manifest.csv")]
+    )
+
+    assert result.exit_code != 0
+    assert "Unable to read" in result.output
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+import requests
+from owslib.util import ServiceException
+from soilgrids.client import ClientRegistry
+from soilgrids.client import WcsClient
+
+
+class DummyOperation:
+    methods = [{"type": "Get", "url": "http://localhost/mapserv?map=/map/phh2o.map&"}]
+
+
+class DummyWCS:
+    url = "http://localhost/mapserv?map=/map/phh2o.map"
+    contents = {"phh2o_0-5cm_mean": None}
+
+    def getOperationByName(self, name):
+        return DummyOperation()
+
+
+class DummyCapabilities:
+    def __init__(self, ttl=86400, delay=0.0):
+        self.ttl = ttl
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_service(self, service_id, link, session=None):
+        assert isinstance(session, requests.Session)
+        time.sleep(self.delay)
+        with self._lock:
+            self.calls += 1
+        return DummyWCS(), list(DummyWCS.contents)
+
+
+def make_response(status_code, content=b"", content_type="image/tiff"):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response._content_consumed = True
+    response.headers["Content-Type"] = content_type
+    return response
+
+
+def test_registry_shares_clients():
+    registry = ClientRegistry()
+    capabilities = DummyCapabilities()
+
+    client = registry.get("phh2o", DummyWCS.url, capabilities)
+
+    assert registry.get("phh2o", DummyWCS.url, capabilities) is client
+    assert client.coverage_list == ["phh2o_0-5cm_mean"]
+    assert capabilities.calls == 1
+    assert len(registry) == 1
+
+
+def test_registry_evicts_least_recently_used():
+    registry = ClientRegistry(maxsize=2)
+    capabilities = DummyCapabilities()
+
+    first = registry.get("bdod", "bdod", capabilities)
+    registry.get("cec", "cec", capabilities)
+    registry.get("bdod", "bdod", capabilities)
+    registry.get("clay", "clay", capabilities)
+
+    assert ("bdod", "bdod") in registry
+    assert ("cec", "cec") not in registry
+    assert ("clay", "clay") in registry
+    assert registry.get("bdod", "bdod", capabilities) is first
+
+
+def test_registry_rebuilds_expired_clients():
+    registry = ClientRegistry()
+    capabilities = DummyCapabilities(ttl=-1)
+
+    first = registry.get("phh2o", DummyWCS.url, capabilities)
+    second = registry.get("phh2o", DummyWCS.url, capabilities)
+
+    assert first is not second
+    assert capabilities.calls == 2
+
+
+def test_registry_builds_each_client_once_across_threads():
+    registry = ClientRegistry()
+    capabilities = DummyCapabilities(delay=0.05)
+    results = []
+
+    def worker():
+        results.append(registry.get("phh2o", DummyWCS.url, capabilities))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert capabilities.calls == 1
+    assert all(client is results[0] for client in results)
+
+
+def test_get_coverage_uses_session(monkeypatch):
+    client = WcsClient("phh2o", DummyWCS.url, DummyCapabilities())
+    sent = {}
+
+    def fake_get(url, params=None, timeout=None, stream=False):
+        sent.update(url=url, params=params, stream=stream)
+        return make_response(200, b"II*\x00")
+
+    monkeypatch.setattr(client.session, "get", fake_get)
+    response = client.getCoverage(
+        identifier="phh2o_0-5cm_mean",
+        bbox=(-1784000, 1356000, -1140000, 1863000),
+        crs="urn:ogc:def:crs:EPSG::152160",
+        resx=250,
+        resy=250,
+        response_crs="urn:ogc:def:crs:EPSG::152160",
+        format="GEOTIFF_INT16",
+    )
+
+    assert b"".join(response.iter_content(2)) == b"II*\x00"
+    assert sent["stream"]
+    assert response.info()["Content-Type"] == "image/tiff"
+    assert sent["url"] == DummyOperation.methods[0]["url"]
+    assert sent["params"] == {
+        "version": "1.0.0",
+        "request": "GetCoverage",
+        "service": "WCS",
+        "Coverage": "phh2o_0-5cm_mean",
+        "BBox": "-1784000,1356000,-1140000,1863000",
+        "crs": "urn:ogc:def:crs:EPSG::152160",
+        "format": "GEOTIFF_INT16",
+        "resx": 250,
+        "resy": 250,
+        "response_crs": "urn:ogc:def:crs:EPSG::152160",
+    }
+
+
+@pytest.mark.parametrize(
+    ("status_code", "error"),
+    [(400, ServiceException), (500, requests.HTTPError)],
+)
+def test_get_coverage_raises_on_http_errors(monkeypatch, status_code, error):
+    client = WcsClient("phh2o", DummyWCS.url, DummyCapabilities())
+    response = make_response(status_code)
+    closed = []
+    monkeypatch.setattr(response, "close", lambda: closed.append(True))
+    monkeypatch.setattr(client.session, "get", lambda *args, **kwargs: response)
+
+    with pytest.raises(error):
+        client.getCoverage(identifier="phh2o_0-5cm_mean", bbox=(0, 0, 1, 1))
+    # the connection goes back to the pool
+    assert closed
@@ -4,6 +4,7 @@ import pytest
 from soilgrids.soilgrids import _extract_ogc_service_exception
 from soilgrids.soilgrids import _format_wcs_error_message
 from soilgrids.soilgrids import _normalize_content_type
+from soilgrids.soilgrids import _split_request
 
 
 @pytest.mark.parametrize(
@@ -142,3 +143,55 @@ def test_format_wcs_error_message_ignores_partial_width_height_and_uses_bbox():
     }
     msg = _format_wcs_error_message("Failure", request_context)
     assert "Estimated request size: 2576x2028 pixels" in msg
+
+
+def test_split_request_keeps_small_requests_whole():
+    request_context = {
+        "bbox": (-1784000, 1356000, -1140000, 1863000),
+        "resx": 500,
+        "resy": 500,
+        "width": None,
+        "height": None,
+    }
+    assert _split_request(request_context) == [request_context]
+
+
+def test_split_request_by_resolution():
+    request_context = {
+        "bbox": (0, 0, 1000, 500),
+        "resx": 10,
+        "resy": 10,
+        "width": None,
+        "height": None,
+    }
+    tiles = _split_request(request_context, max_tile_size=40)
+
+    assert [tile["bbox"] for tile in tiles] == [
+        (0, 0, 330, 250),
+        (330, 0, 660, 250),
+        (660, 0, 1000, 250),
+        (0, 250, 330, 500),
+        (330, 250, 660, 500),
+        (660, 250, 1000, 500),
+    ]
+    assert all(tile["width"] is None and tile["resx"] == 10 for tile in tiles)
+
+
+def test_split_request_by_size():
+    request_context = {
+        "bbox": (-105.0, 39.0, -104.0, 40.0),
+        "resx": None,
+        "resy": None,
+        "width": 300,
+        "height": 100,
+    }
+    tiles = _split_request(request_context, max_tile_size=128)
+
+    assert [(tile["width"], tile["height"]) for tile in tiles] == [
+        (100, 100),
+        (100, 100),
+        (100, 100),
+    ]
+    assert tiles[0]["bbox"][0] == -105.0
+    assert tiles[-1]["bbox"][2] == -104.0
+    assert tiles[1]["bbox"][0] == pytest.approx(-105.0 + 1 / 3)
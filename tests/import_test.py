@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+
+import pytest
+import soilgrids
+
+HEAVY_MODULES = ("bmipy", "numpy", "owslib", "rasterio", "rioxarray", "xarray")
+
+
+def imported_modules(statement):
+    """Return the heavy modules imported by a statement in a fresh interpreter."""
+    code = (
+        f"import sys; {statement}; "
+        f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, check=True, text=True
+    ).stdout
+    return output.split()
+
+
+@pytest.mark.parametrize("statement", ["import soilgrids", "import soilgrids.cli"])
+def test_import_is_lazy(statement):
+    assert imported_modules(statement) == []
+
+
+def test_cli_version_is_lazy():
+    statement = (
+        "from click.testing import CliRunner; from soilgrids.cli import main; "
+        "assert CliRunner().invoke(main, ['--version']).exit_code == 0"
+    )
+    assert imported_modules(statement) == []
+
+
+def test_soilgrids_does_not_import_xarray():
+    assert "rioxarray" not in imported_modules("import soilgrids.soilgrids")
+    assert "xarray" not in imported_modules("import soilgrids.soilgrids")
+
+
+DEPTHS_FIRST = """
+import sys
+from soilgrids import SoilGrids
+from soilgrids.testing.server import WcsServer
+
+with WcsServer() as server:
+    SoilGrids.MAP_SERVICES = server.map_services()
+    profile = SoilGrids(cache_dir=sys.argv[1]).get_coverage_depths(
+        "phh2o",
+        crs="urn:ogc:def:crs:EPSG::152160",
+        west=-1784000,
+        south=1356000,
+        east=-1140000,
+        north=1863000,
+        output=sys.argv[2],
+        depths=["0-5cm"],
+        resx=1000,
+        resy=1000,
+    )
+    assert profile.rio.crs is not None
+"""
+
+
+def test_get_coverage_depths_in_a_fresh_process(tmp_path):
+    # nothing imports rioxarray before get_coverage_depths needs its accessor
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            DEPTHS_FIRST,
+            str(tmp_path / "cache"),
+            str(tmp_path / "profile.tif"),
+        ],
+        check=True,
+    )
+
+
+def test_lazy_attributes():
+    from soilgrids.bmi import BmiSoilGrids
+    from soilgrids.soilgrids import SoilGrids
+
+    assert soilgrids.SoilGrids is SoilGrids
+    assert soilgrids.BmiSoilGrids is BmiSoilGrids
+    assert set(soilgrids.__all__) <= set(dir(soilgrids))
+    with pytest.raises(AttributeError):
+        soilgrids.NotAnAttribute
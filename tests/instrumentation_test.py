@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+from soilgrids import instrumentation
+from soilgrids import SoilGrids
+from soilgrids import SoilGridsWcsError
+
+REQUEST = {
+    "service_id": "phh2o",
+    "coverage_id": "phh2o_0-5cm_mean",
+    "crs": "urn:ogc:def:crs:EPSG::152160",
+    "west": -1784000,
+    "south": 1356000,
+    "east": -1140000,
+    "north": 1863000,
+    "resx": 1000,
+    "resy": 1000,
+}
+
+
+def test_span_without_hooks():
+    with instrumentation.span("open", {}) as span:
+        span.request = {"coverage_id": "phh2o_0-5cm_mean"}
+        span.add_bytes(10)
+
+    assert span is instrumentation.span("transfer")
+    assert span.request is None
+
+
+def test_hook_is_removed():
+    spans = []
+    with instrumentation.hook(spans.append):
+        with instrumentation.span("open"):
+            pass
+    with instrumentation.span("open"):
+        pass
+
+    assert [span.name for span in spans] == ["open"]
+    assert spans[0].duration >= 0.0
+    assert spans[0].request == {}
+    assert spans[0].error is None
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_get_coverage_data_spans(wcs_server, tmp_path):
+    output = str(tmp_path / "test.tif")
+    soilgrids = SoilGrids()
+    spans = []
+
+    with instrumentation.hook(spans.append):
+        soilgrids.get_coverage_data(output=output, **REQUEST)
+        soilgrids.get_coverage_data(output=output, local_file=True, **REQUEST)
+
+    assert [span.name for span in spans] == [
+        "capabilities",
+        "render",
+        "transfer",
+        "open",
+        "capabilities",
+        "cache",
+        "open",
+    ]
+    assert all(span.request["coverage_id"] == "phh2o_0-5cm_mean" for span in spans)
+    assert spans[0].request["bbox"] == (-1784000, 1356000, -1140000, 1863000)
+    assert spans[2].nbytes == os.path.getsize(output)
+    assert spans[5].nbytes == os.path.getsize(output)
+
+
+def test_failed_spans(wcs_server, tmp_path):
+    wcs_server.exceptions["phh2o_0-5cm_mean"] = "msWCSGetCoverage(): General error"
+    spans = []
+
+    with instrumentation.hook(spans.append):
+        with pytest.raises(SoilGridsWcsError):
+            SoilGrids().get_coverage_data(output=str(tmp_path / "test.tif"), **REQUEST)
+
+    assert spans[-1].name == "transfer"
+    assert isinstance(spans[-1].error, SoilGridsWcsError)
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import netCDF4
+import numpy
+import pytest
+import xarray
+from soilgrids import SoilGrids
+from soilgrids import SoilGridsError
+from soilgrids.netcdf import write_netcdf
+
+REQUEST = {
+    "crs": "urn:ogc:def:crs:EPSG::152160",
+    "west": -1784000,
+    "south": 1356000,
+    "east": -1140000,
+    "north": 1863000,
+    "resx": 1000,
+    "resy": 1000,
+}
+
+
+@pytest.fixture
+def coverages(wcs_server, tmp_path):
+    soilgrids = SoilGrids()
+    ph = soilgrids.get_coverage_data(
+        service_id="phh2o",
+        coverage_id="phh2o_0-5cm_mean",
+        output=str(tmp_path / "phh2o.tif"),
+        **REQUEST,
+    )
+    ph_metadata = soilgrids.metadata
+    clay = soilgrids.get_coverage_depths(
+        service_id="clay", output=str(tmp_path / "clay.tif"), **REQUEST
+    )
+    return {"phh2o": ph, "clay": clay}, {
+        "phh2o": ph_metadata,
+        "clay": soilgrids.metadata,
+    }
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_write_netcdf(coverages, tmp_path):
+    data, metadata = coverages
+    write_netcdf(
+        str(tmp_path / "soilgrids.nc"), data, metadata=metadata, chunk_size=128
+    )
+
+    with netCDF4.Dataset(tmp_path / "soilgrids.nc") as nc:
+        assert nc.Conventions == "CF-1.8"
+        assert nc["clay"].dimensions == ("depth", "y", "x")
+        assert nc["clay"].chunking() == [6, 128, 128]
+        assert nc["phh2o"].chunking() == [128, 128]
+        assert nc["clay"].filters()["zlib"]
+        assert nc["clay"].dtype == numpy.int16
+        assert nc["clay"].grid_mapping == "spatial_ref"
+        assert nc["clay"].units == "g/kg"
+        assert "crs_wkt" in nc["spatial_ref"].ncattrs()
+        assert list(nc["depth_bnds"][1]) == [5.0, 15.0]
+
+    with xarray.open_dataset(tmp_path / "soilgrids.nc") as dataset:
+        assert dataset["phh2o"].attrs["coverage_id"] == "phh2o_0-5cm_mean"
+        numpy.testing.assert_array_equal(
+            dataset["phh2o"].values, data["phh2o"].values[0]
+        )
+        numpy.testing.assert_array_equal(dataset["clay"].values, data["clay"].values)
+        numpy.testing.assert_array_equal(
+            dataset["depth"].values, [2.5, 10, 22.5, 45, 80, 150]
+        )
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_write_netcdf_checks_grids(coverages, tmp_path):
+    data, _ = coverages
+
+    with pytest.raises(ValueError):
+        write_netcdf(str(tmp_path / "soilgrids.nc"), {})
+    with pytest.raises(SoilGridsError):
+        write_netcdf(
+            str(tmp_path / "soilgrids.nc"),
+            dict(data, small=data["phh2o"].isel(x=slice(0, 10))),
+        )
+    with pytest.raises(SoilGridsError):
+        write_netcdf(
+            str(tmp_path / "soilgrids.nc"),
+            dict(data, sand=data["clay"].isel(depth=slice(0, 2))),
+        )
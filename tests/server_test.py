@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import time
+
+import numpy
+import pytest
+import requests
+import soilgrids.soilgrids as soilgrids_module
+from soilgrids import SoilGrids
+from soilgrids import SoilGridsWcsError
+from soilgrids.testing.server import WcsServer
+
+BBOX = {"west": -1784000, "south": 1356000, "east": -1140000, "north": 1863000}
+
+
+def get_data(output, **kwargs):
+    return SoilGrids().get_coverage_data(
+        service_id=kwargs.pop("service_id", "phh2o"),
+        coverage_id=kwargs.pop("coverage_id", "phh2o_0-5cm_mean"),
+        crs=kwargs.pop("crs", "urn:ogc:def:crs:EPSG::152160"),
+        output=str(output),
+        **dict(BBOX, resx=1000, resy=1000, **kwargs),
+    )
+
+
+def test_capabilities(wcs_server):
+    response = requests.get(
+        wcs_server.link("phh2o"),
+        params={"service": "WCS", "request": "GetCapabilities", "version": "1.0.0"},
+    )
+
+    assert response.status_code == 200
+    assert "<name>phh2o_0-5cm_mean</name>" in response.text
+    assert SoilGrids.MAP_SERVICES["phh2o"]["link"] == wcs_server.link("phh2o")
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_get_coverage_data(wcs_server, tmp_path):
+    data = get_data(tmp_path / "test.tif")
+
+    assert data.shape == (1, 507, 644)
+    assert wcs_server.count("GetCapabilities") == 1
+    assert wcs_server.count("DescribeCoverage") == 1
+    assert wcs_server.count("GetCoverage") == 1
+
+    with pytest.raises(ValueError):
+        get_data(tmp_path / "test.tif", crs="urn:ogc:def:crs:EPSG::32632")
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_coverages_are_deterministic(wcs_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(soilgrids_module, "MAX_TILE_SIZE", 200)
+
+    single = get_data(tmp_path / "single.tif")
+    tiled = get_data(tmp_path / "tiled.tif", tiled=True)
+    other = get_data(tmp_path / "other.tif", coverage_id="phh2o_5-15cm_mean")
+
+    assert wcs_server.count("GetCoverage") == 1 + 12 + 1
+    numpy.testing.assert_array_equal(tiled.values, single.values)
+    assert not numpy.array_equal(other.values, single.values)
+
+
+def test_exception_reports(wcs_server, tmp_path):
+    wcs_server.exceptions["phh2o_0-5cm_mean"] = "msWCSGetCoverage(): General error"
+
+    with pytest.raises(SoilGridsWcsError) as exc_info:
+        get_data(tmp_path / "test.tif")
+    assert exc_info.value.service_exception == "msWCSGetCoverage(): General error"
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_resilient_download(wcs_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(soilgrids_module, "RETRY_BACKOFF", 0.0)
+    expected = get_data(tmp_path / "expected.tif")
+
+    wcs_server.fail_next(503, count=2)
+    data = get_data(tmp_path / "retried.tif", resilient=True)
+    numpy.testing.assert_array_equal(data.values, expected.values)
+
+    wcs_server.max_pixels = 100_000
+    data = get_data(tmp_path / "split.tif", resilient=True)
+    numpy.testing.assert_array_equal(data.values, expected.values)
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_interrupted_downloads_are_retried(wcs_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(soilgrids_module, "RETRY_BACKOFF", 0.0)
+    expected = get_data(tmp_path / "expected.tif")
+
+    wcs_server.drop_next()
+    with pytest.raises(SoilGridsWcsError) as excinfo:
+        get_data(tmp_path / "dropped.tif")
+    assert isinstance(excinfo.value.__cause__, requests.RequestException)
+    assert not (tmp_path / "dropped.tif").exists()
+
+    wcs_server.drop_next(count=2)
+    data = get_data(tmp_path / "retried.tif", resilient=True)
+    numpy.testing.assert_array_equal(data.values, expected.values)
+    assert wcs_server.count("GetCoverage") == 1 + 1 + 3
+
+
+def test_latency_and_throttling(tmp_path):
+    with WcsServer(latency=0.2, max_concurrent=1) as server:
+        params = {
+            "service": "WCS",
+            "version": "1.0.0",
+            "request": "GetCoverage",
+            "coverage": "phh2o_0-5cm_mean",
+            "crs": "urn:ogc:def:crs:EPSG::152160",
+            "bbox": "0,0,1000,1000",
+            "resx": 250,
+            "resy": 250,
+            "format": "GEOTIFF_INT16",
+        }
+
+        with requests.Session() as session:
+            start = time.perf_counter()
+            response = session.get(server.link("phh2o"), params=params)
+            assert time.perf_counter() - start >= 0.2
+            assert response.headers["Content-Type"] == "image/tiff"
+
+            server.max_concurrent = 0
+            assert session.get(server.link("phh2o"), params=params).status_code == 429
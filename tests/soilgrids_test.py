@@ -1,10 +1,22 @@
 from __future__ import annotations
 
+import multiprocessing
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy
 import pytest
+import rasterio
+import requests
+import soilgrids.soilgrids as soilgrids_module
 import xarray
+from owslib.util import ServiceException
+from rasterio.crs import CRS
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
 from soilgrids import SoilGrids
+from soilgrids import SoilGridsError
 from soilgrids import SoilGridsWcsError
 
 
@@ -273,3 +285,805 @@ def test_load_localfile(tmpdir):
     file2_info = os.path.getmtime(os.path.join(tmpdir, "test.tif"))
 
     assert file1_info == file2_info
+
+
+def make_geotiff(bbox, width, height, scale=1.0, offset=0.0):
+    """Return a GeoTIFF whose pixel values encode the pixel coordinates."""
+    west, south, east, north = bbox
+    resx = (east - west) / width
+    resy = (north - south) / height
+    cols = numpy.floor((west + (numpy.arange(width) + 0.5) * resx) / resx)
+    rows = numpy.floor((north - (numpy.arange(height) + 0.5) * resy) / resy)
+    array = (rows[:, None] * 100 + cols[None, :]).astype("int16")
+
+    with MemoryFile() as memfile:
+        with memfile.open(
+            driver="GTiff",
+            width=width,
+            height=height,
+            count=1,
+            dtype="int16",
+            crs="EPSG:3857",
+            nodata=-32768,
+            transform=from_bounds(west, south, east, north, width, height),
+        ) as dst:
+            dst.write(array[None, :, :])
+            dst.scales = (scale,)
+            dst.offsets = (offset,)
+            dst.descriptions = ("mean",)
+        return memfile.read()
+
+
+class DummyCRS:
+    def __init__(self, code):
+        self._code = code
+
+    def getcodeurn(self):
+        return self._code
+
+
+class DummyCoverage:
+    supportedCRS = [
+        DummyCRS("urn:ogc:def:crs:EPSG::152160"),
+        DummyCRS("urn:ogc:def:crs:EPSG::4326"),
+    ]
+
+
+class DummyResponse:
+    def __init__(self, body, content_type="image/tiff"):
+        self._body = body
+        self._content_type = content_type
+
+    def info(self):
+        return {"Content-Type": self._content_type}
+
+    def read(self):
+        return self._body
+
+
+class SyntheticWCS:
+    """Stand-in for a WCS client that synthesizes the requested coverages."""
+
+    def __init__(self, scale=1.0, offset=0.0):
+        self.requests = []
+        self._lock = threading.Lock()
+        self._scale = scale
+        self._offset = offset
+
+    def getCoverage(self, **kwargs):
+        with self._lock:
+            self.requests.append(kwargs)
+        west, south, east, north = kwargs["bbox"]
+        width = kwargs["width"] or round((east - west) / kwargs["resx"])
+        height = kwargs["height"] or round((north - south) / kwargs["resy"])
+        return DummyResponse(
+            make_geotiff(kwargs["bbox"], width, height, self._scale, self._offset)
+        )
+
+
+def patch_wcs(monkeypatch, soilgrids, wcs):
+    monkeypatch.setattr(
+        soilgrids,
+        "_get_service_and_coverage_list",
+        lambda _service_id: (wcs, ["phh2o_0-5cm_mean"]),
+    )
+    monkeypatch.setattr(soilgrids, "_get_coverage_obj", lambda *_args: DummyCoverage())
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_local_file_is_served_from_coverage_cache(tmp_path, monkeypatch):
+    wcs = SyntheticWCS()
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, wcs)
+
+    def get_data(output, west=-1784000, local_file=True):
+        return soilgrids.get_coverage_data(
+            "phh2o",
+            "phh2o_0-5cm_mean",
+            crs="urn:ogc:def:crs:EPSG::152160",
+            west=west,
+            south=1356000,
+            east=-1140000,
+            north=1863000,
+            resx=1000,
+            resy=1000,
+            output=str(tmp_path / output),
+            local_file=local_file,
+        )
+
+    # other downloads are only recorded, and their output is reused
+    get_data("test.tif", local_file=False)
+    assert len(wcs.requests) == 1
+    mtime = os.path.getmtime(tmp_path / "test.tif")
+
+    data = get_data("test.tif")
+    assert len(wcs.requests) == 1
+    assert os.path.getmtime(tmp_path / "test.tif") == mtime
+    assert data.shape == (1, 507, 644)
+
+    get_data("copy.tif", west=-1784000.0)
+    assert len(wcs.requests) == 1
+    with open(tmp_path / "copy.tif", "rb") as fp1:
+        with open(tmp_path / "test.tif", "rb") as fp2:
+            assert fp1.read() == fp2.read()
+
+    # a changed output is downloaded again, this time into the cache
+    with open(tmp_path / "test.tif", "wb") as fp:
+        fp.write(b"changed")
+    os.remove(tmp_path / "copy.tif")
+    get_data("test.tif")
+    assert len(wcs.requests) == 2
+
+    get_data("copy.tif", west=-1784000.0)
+    assert len(wcs.requests) == 2
+
+    # a window of a cached coverage is cropped from it
+    data = get_data("window.tif", west=-1700000)
+    assert len(wcs.requests) == 2
+    assert data.shape == (1, 507, 560)
+
+    get_data("test.tif", west=-1800000)
+    assert len(wcs.requests) == 3
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+@pytest.mark.parametrize(
+    "size",
+    [
+        {"resx": 1000, "resy": 1000},
+        {"crs": "urn:ogc:def:crs:EPSG::4326", "width": 644, "height": 507},
+    ],
+)
+def test_tiled_download_matches_single_request(tmp_path, monkeypatch, size):
+    wcs = SyntheticWCS(scale=0.1, offset=0.5)
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, wcs)
+    monkeypatch.setattr(soilgrids_module, "MAX_TILE_SIZE", 200)
+
+    kwargs = {
+        "service_id": "phh2o",
+        "coverage_id": "phh2o_0-5cm_mean",
+        "crs": "urn:ogc:def:crs:EPSG::152160",
+        "west": -1784000,
+        "south": 1356000,
+        "east": -1140000,
+        "north": 1863000,
+    }
+    kwargs.update(size)
+
+    single = soilgrids.get_coverage_data(output=str(tmp_path / "single.tif"), **kwargs)
+    tiled = soilgrids.get_coverage_data(
+        output=str(tmp_path / "tiled.tif"), tiled=True, max_workers=3, **kwargs
+    )
+
+    assert len(wcs.requests) == 1 + 12
+    assert sorted(os.listdir(tmp_path)) == ["cache", "single.tif", "tiled.tif"]
+    numpy.testing.assert_array_equal(tiled.values, single.values)
+    numpy.testing.assert_allclose(tiled.x.values, single.x.values)
+    numpy.testing.assert_allclose(tiled.y.values, single.y.values)
+    assert tiled.attrs["scale_factor"] == single.attrs["scale_factor"] == 0.1
+    assert tiled.attrs["add_offset"] == single.attrs["add_offset"] == 0.5
+    with rasterio.open(tmp_path / "tiled.tif") as src:
+        assert src.descriptions == ("mean",)
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_get_coverage_depths(tmp_path, monkeypatch):
+    wcs = SyntheticWCS()
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, wcs)
+    output = tmp_path / "profile.tif"
+
+    data = soilgrids.get_coverage_depths(
+        "phh2o",
+        crs="urn:ogc:def:crs:EPSG::152160",
+        west=-1784000,
+        south=1356000,
+        east=-1140000,
+        north=1863000,
+        resx=1000,
+        resy=1000,
+        output=str(output),
+    )
+
+    assert sorted(request["identifier"] for request in wcs.requests) == sorted(
+        f"phh2o_{depth}_mean" for depth in SoilGrids.DEPTH_INTERVALS
+    )
+    assert data.dims == ("depth", "y", "x")
+    assert data.shape == (6, 507, 644)
+    assert data.values.flags.c_contiguous
+    assert list(data.depth.values) == list(SoilGrids.DEPTH_INTERVALS)
+    assert list(data.depth_top.values) == [0, 5, 15, 30, 60, 100]
+    assert list(data.depth_bottom.values) == [5, 15, 30, 60, 100, 200]
+    assert data.rio.crs == "EPSG:3857"
+    assert soilgrids.metadata["coverage_id"][0] == "phh2o_0-5cm_mean"
+    assert soilgrids.metadata["grid_res"] == [1000, 1000]
+    assert sorted(os.listdir(tmp_path)) == ["cache", "profile.tif"]
+
+    single = soilgrids.get_coverage_data(
+        "phh2o",
+        "phh2o_30-60cm_mean",
+        crs="urn:ogc:def:crs:EPSG::152160",
+        west=-1784000,
+        south=1356000,
+        east=-1140000,
+        north=1863000,
+        resx=1000,
+        resy=1000,
+        output=str(tmp_path / "single.tif"),
+    )
+    numpy.testing.assert_array_equal(data.sel(depth="30-60cm").values, single[0].values)
+    numpy.testing.assert_allclose(data.x.values, single.x.values)
+    numpy.testing.assert_allclose(data.y.values, single.y.values)
+
+    with rasterio.open(output) as src:
+        assert src.count == 6
+        assert src.descriptions[0] == "phh2o_0-5cm_mean"
+
+
+def test_get_coverage_depths_checks_depths(tmp_path, monkeypatch):
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, SyntheticWCS())
+
+    with pytest.raises(ValueError):
+        soilgrids.get_coverage_depths(
+            "phh2o",
+            crs="urn:ogc:def:crs:EPSG::152160",
+            west=-1784000,
+            south=1356000,
+            east=-1140000,
+            north=1863000,
+            depths=["topsoil"],
+            output=str(tmp_path / "profile.tif"),
+        )
+
+
+REQUEST_CONTEXT = {
+    "service_id": "phh2o",
+    "coverage_id": "phh2o_0-5cm_mean",
+    "crs": "urn:ogc:def:crs:EPSG::152160",
+    "bbox": (0, 0, 10, 10),
+    "resx": 1,
+    "resy": 1,
+    "width": None,
+    "height": None,
+    "response_crs": "urn:ogc:def:crs:EPSG::152160",
+    "format": "GEOTIFF_INT16",
+}
+
+
+class ChunkedResponse(DummyResponse):
+    def __init__(self, chunks, content_type="image/tiff", error=None):
+        super().__init__(b"".join(chunks), content_type=content_type)
+        self._chunks = chunks
+        self._error = error
+        self.chunk_sizes = []
+        self.closed = False
+
+    def read(self):
+        raise AssertionError("the response body should be streamed")
+
+    def iter_content(self, chunk_size):
+        self.chunk_sizes.append(chunk_size)
+        yield from self._chunks
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize("content_type", ["image/tiff", "application/octet-stream"])
+def test_download_is_streamed_to_disk(tmp_path, content_type):
+    body = make_geotiff((0, 0, 10, 10), 10, 10)
+    chunks = [body[i : i + 100] for i in range(0, len(body), 100)]
+    response = ChunkedResponse(chunks, content_type=content_type)
+
+    class WCS:
+        def getCoverage(self, **_kwargs):
+            return response
+
+    output = tmp_path / "test.tif"
+    soilgrids_module._download_coverage(WCS(), REQUEST_CONTEXT, str(output))
+
+    assert output.read_bytes() == body
+    assert response.chunk_sizes == [soilgrids_module.CHUNK_SIZE]
+    assert response.closed
+    assert os.listdir(tmp_path) == ["test.tif"]
+
+
+def test_interrupted_download_leaves_output_untouched(tmp_path):
+    output = tmp_path / "test.tif"
+    output.write_bytes(b"previous download")
+    response = ChunkedResponse(
+        [b"II*\x00", b"partial"], error=ConnectionError("connection reset")
+    )
+
+    class WCS:
+        def getCoverage(self, **_kwargs):
+            return response
+
+    with pytest.raises(SoilGridsWcsError) as excinfo:
+        soilgrids_module._download_coverage(WCS(), REQUEST_CONTEXT, str(output))
+
+    assert "connection reset" in str(excinfo.value)
+    assert output.read_bytes() == b"previous download"
+    assert os.listdir(tmp_path) == ["test.tif"]
+    assert response.closed
+
+
+def test_exception_report_is_read_from_first_chunk(tmp_path):
+    xml_error = (
+        "<ServiceExceptionReport><ServiceException>too large</ServiceException>"
+        "</ServiceExceptionReport>"
+    )
+    response = ChunkedResponse(
+        [xml_error.encode("utf-8"), b"<!-- trailing -->"],
+        content_type="application/vnd.ogc.se_xml",
+    )
+
+    class WCS:
+        def getCoverage(self, **_kwargs):
+            return response
+
+    with pytest.raises(SoilGridsWcsError) as excinfo:
+        soilgrids_module._download_coverage(
+            WCS(), REQUEST_CONTEXT, str(tmp_path / "test.tif")
+        )
+
+    assert excinfo.value.service_exception == "too large"
+    assert excinfo.value.raw == xml_error
+    assert os.listdir(tmp_path) == []
+
+
+class FlakyWCS(SyntheticWCS):
+    """Synthetic WCS that fails on the first requests and on large requests."""
+
+    def __init__(self, failures=(), max_pixels=None):
+        super().__init__()
+        self._failures = list(failures)
+        self._max_pixels = max_pixels
+
+    def getCoverage(self, **kwargs):
+        if self._failures:
+            with self._lock:
+                self.requests.append(kwargs)
+            raise self._failures.pop(0)
+
+        west, south, east, north = kwargs["bbox"]
+        width = kwargs["width"] or round((east - west) / kwargs["resx"])
+        height = kwargs["height"] or round((north - south) / kwargs["resy"])
+        if self._max_pixels and width * height > self._max_pixels:
+            with self._lock:
+                self.requests.append(kwargs)
+            return DummyResponse(
+                b"<ServiceExceptionReport><ServiceException>msImageCreate(): out of"
+                b" memory</ServiceException></ServiceExceptionReport>",
+                content_type="application/vnd.ogc.se_xml",
+            )
+        return super().getCoverage(**kwargs)
+
+
+def get_resilient_data(soilgrids, output, **kwargs):
+    return soilgrids.get_coverage_data(
+        "phh2o",
+        "phh2o_0-5cm_mean",
+        crs="urn:ogc:def:crs:EPSG::152160",
+        west=-1784000,
+        south=1356000,
+        east=-1140000,
+        north=1863000,
+        resx=1000,
+        resy=1000,
+        output=output,
+        resilient=True,
+        **kwargs,
+    )
+
+
+def test_resilient_download_retries_transient_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(soilgrids_module, "RETRY_BACKOFF", 0.0)
+    wcs = FlakyWCS(
+        failures=[
+            requests.ConnectionError("connection reset"),
+            requests.Timeout("read timed out"),
+        ]
+    )
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, wcs)
+
+    data = get_resilient_data(soilgrids, str(tmp_path / "test.tif"))
+
+    assert len(wcs.requests) == 3
+    assert data.shape == (1, 507, 644)
+
+
+def test_resilient_download_gives_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(soilgrids_module, "RETRY_BACKOFF", 0.0)
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+
+    wcs = FlakyWCS(failures=[requests.ConnectionError("connection reset")] * 10)
+    patch_wcs(monkeypatch, soilgrids, wcs)
+    with pytest.raises(SoilGridsWcsError):
+        get_resilient_data(soilgrids, str(tmp_path / "test.tif"))
+    assert len(wcs.requests) == soilgrids_module.RETRIES + 1
+
+    # the message of connection errors is no size error
+    wcs = FlakyWCS(
+        failures=[
+            requests.ConnectionError(
+                "HTTPSConnectionPool(host='maps.isric.org', port=443): Max retries"
+                " exceeded with url: /mapserv?map=/map/phh2o.map (Caused by"
+                " NewConnectionError('Failed to establish a new connection'))"
+            )
+        ]
+        * 100
+    )
+    patch_wcs(monkeypatch, soilgrids, wcs)
+    with pytest.raises(SoilGridsWcsError):
+        get_resilient_data(soilgrids, str(tmp_path / "test.tif"))
+    assert len(wcs.requests) == soilgrids_module.RETRIES + 1
+
+    wcs = FlakyWCS(failures=[ServiceException("Invalid coverage", None)] * 10)
+    patch_wcs(monkeypatch, soilgrids, wcs)
+    with pytest.raises(SoilGridsWcsError):
+        get_resilient_data(soilgrids, str(tmp_path / "test.tif"))
+    assert len(wcs.requests) == 1
+
+
+@pytest.mark.parametrize("tiled", [False, True])
+def test_resilient_download_splits_large_requests(tmp_path, monkeypatch, tiled):
+    monkeypatch.setattr(soilgrids_module, "MAX_TILE_SIZE", 400)
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, SyntheticWCS())
+    expected = get_resilient_data(soilgrids, str(tmp_path / "expected.tif"))
+
+    wcs = FlakyWCS(max_pixels=50_000)
+    patch_wcs(monkeypatch, soilgrids, wcs)
+    data = get_resilient_data(soilgrids, str(tmp_path / "test.tif"), tiled=tiled)
+
+    assert len(wcs.requests) > 4
+    assert (
+        max(
+            (request["bbox"][2] - request["bbox"][0])
+            * (request["bbox"][3] - request["bbox"][1])
+            for request in wcs.requests[-4:]
+        )
+        <= 50_000 * 1000 * 1000
+    )
+    numpy.testing.assert_array_equal(data.values, expected.values)
+    numpy.testing.assert_allclose(data.x.values, expected.x.values)
+    numpy.testing.assert_allclose(data.y.values, expected.y.values)
+    assert sorted(os.listdir(tmp_path)) == ["cache", "expected.tif", "test.tif"]
+
+
+def test_plan_coverage_request(tmp_path, monkeypatch):
+    monkeypatch.setattr(soilgrids_module, "MAX_TILE_SIZE", 200)
+    wcs = SyntheticWCS()
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, wcs)
+    kwargs = {
+        "service_id": "phh2o",
+        "coverage_id": "phh2o_0-5cm_mean",
+        "crs": "urn:ogc:def:crs:EPSG::152160",
+        "west": -1784000,
+        "south": 1356000,
+        "east": -1140000,
+        "north": 1863000,
+        "resx": 1000,
+        "resy": 1000,
+        "local_file": True,
+        "tiled": True,
+        "max_workers": 4,
+    }
+
+    plan = soilgrids.plan_coverage_request(**kwargs)
+
+    assert wcs.requests == []
+    assert (plan.width, plan.height, plan.pixels) == (644, 507, 644 * 507)
+    assert plan.tile_grid == (4, 3)
+    assert len(plan.tiles) == 12
+    assert plan.max_workers == 4
+    assert plan.requests == 12
+    assert not plan.cached
+    assert plan.cached_fraction == 0.0
+
+    soilgrids.get_coverage_data(output=str(tmp_path / "test.tif"), **kwargs)
+    plan = soilgrids.plan_coverage_request(**kwargs)
+
+    assert plan.cached
+    assert plan.cached_fraction == 1.0
+    assert os.path.getsize(tmp_path / "test.tif") <= plan.nbytes
+    assert plan.nbytes < 1.1 * os.path.getsize(tmp_path / "test.tif")
+
+    # a single request, which does not use the cache, still gets the tile
+    # grid it is best downloaded as
+    plan = soilgrids.plan_coverage_request(
+        **dict(kwargs, local_file=False, tiled=False)
+    )
+    assert plan.tile_grid == (4, 3)
+    assert len(plan.tiles) == 12
+    assert plan.max_workers == 4
+    assert plan.requests == 1
+    assert not plan.cached
+    assert plan.cached_fraction == 0.0
+
+
+def test_plan_coverage_request_checks_arguments(tmp_path, monkeypatch):
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, SyntheticWCS())
+
+    with pytest.raises(ValueError):
+        soilgrids.plan_coverage_request(
+            "phh2o",
+            "phh2o_0-5cm_mean",
+            crs="urn:ogc:def:crs:EPSG::4326",
+            west=-1,
+            south=-1,
+            east=1,
+            north=1,
+        )
+
+    # narrower than a pixel
+    for east, tiled in [(-1783900, False), (-1783900, True), (-1784000, False)]:
+        with pytest.raises(ValueError):
+            soilgrids.plan_coverage_request(
+                "phh2o",
+                "phh2o_0-5cm_mean",
+                crs="urn:ogc:def:crs:EPSG::152160",
+                west=-1784000,
+                south=1356000,
+                east=east,
+                north=1863000,
+                tiled=tiled,
+            )
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_lazy_coverage_data(tmp_path, monkeypatch):
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, SyntheticWCS())
+
+    expected = get_resilient_data(soilgrids, str(tmp_path / "eager.tif"))
+    data = get_resilient_data(soilgrids, str(tmp_path / "lazy.tif"), lazy=True)
+
+    assert not data.variable._in_memory
+    numpy.testing.assert_array_equal(data.values, expected.values)
+    assert not data.variable._in_memory
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_chunked_coverage_data(tmp_path, monkeypatch):
+    dask = pytest.importorskip("dask")
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, SyntheticWCS())
+
+    expected = get_resilient_data(soilgrids, str(tmp_path / "eager.tif"))
+    data = get_resilient_data(
+        soilgrids, str(tmp_path / "chunked.tif"), chunks={"x": 256, "y": 256}
+    )
+
+    assert dask.is_dask_collection(data)
+    assert data.chunks == ((1,), (256, 251), (256, 256, 132))
+    numpy.testing.assert_array_equal(
+        data.compute(scheduler="threads").values, expected.values
+    )
+
+
+def test_sample_points(tmp_path, monkeypatch):
+    wcs = SyntheticWCS()
+    soilgrids = SoilGrids(cache_dir=str(tmp_path / "cache"))
+    patch_wcs(monkeypatch, soilgrids, wcs)
+
+    rng = numpy.random.default_rng(0)
+    xs = numpy.concatenate(
+        [rng.uniform(0, 20000, 500), rng.uniform(40000, 45000, 500), [numpy.nan]]
+    )
+    ys = numpy.concatenate(
+        [rng.uniform(0, 20000, 500), rng.uniform(10000, 12000, 500), [0]]
+    )
+
+    samples = soilgrids.sample_points(
+        "phh2o",
+        ["phh2o_0-5cm_mean", "phh2o_5-15cm_mean"],
+        xs,
+        ys,
+        crs="urn:ogc:def:crs:EPSG::152160",
+        window_size=64,
+    )
+
+    expected = numpy.floor(ys / 250) * 100 + numpy.floor(xs / 250)
+    numpy.testing.assert_array_equal(samples["phh2o_0-5cm_mean"].values, expected)
+    numpy.testing.assert_array_equal(samples["phh2o_5-15cm_mean"].values, expected)
+    numpy.testing.assert_array_equal(samples.x.values, xs)
+    assert samples.attrs["requests"] == len(wcs.requests) == 2 * (4 + 1)
+    for request in wcs.requests:
+        west, south, east, north = request["bbox"]
+        assert (east - west) / 250 <= 64 and (north - south) / 250 <= 64
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+@pytest.mark.parametrize("compress", ["deflate", "ZSTD"])
+def test_cog_output(wcs_server, tmp_path, compress):
+    request = {
+        "service_id": "phh2o",
+        "coverage_id": "phh2o_0-5cm_mean",
+        "crs": "urn:ogc:def:crs:EPSG::152160",
+        "west": -1784000,
+        "south": 1356000,
+        "east": -1140000,
+        "north": 1863000,
+    }
+    plain = SoilGrids().get_coverage_data(output=str(tmp_path / "plain.tif"), **request)
+    cog = SoilGrids().get_coverage_data(
+        output=str(tmp_path / "cog.tif"), cog=True, compress=compress, **request
+    )
+
+    numpy.testing.assert_array_equal(cog.values, plain.values)
+    assert os.path.getsize(tmp_path / "cog.tif") < os.path.getsize(
+        tmp_path / "plain.tif"
+    )
+    with rasterio.open(tmp_path / "cog.tif") as src:
+        assert src.profile["tiled"]
+        assert src.block_shapes == [(512, 512)]
+        assert src.compression.name.upper() == compress.upper()
+        assert src.overviews(1) == [2, 4, 8]
+        assert src.nodata == plain.rio.nodata
+        assert src.crs == plain.rio.crs
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+    with pytest.raises(ValueError):
+        SoilGrids().get_coverage_data(
+            output=str(tmp_path / "cog.tif"), cog=True, compress="JPEG", **request
+        )
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_get_coverage_zarr(wcs_server, tmp_path):
+    pytest.importorskip("zarr")
+    request = {
+        "crs": "urn:ogc:def:crs:EPSG::152160",
+        "west": -1784000,
+        "south": 1356000,
+        "east": -1140000,
+        "north": 1863000,
+        "resx": 1000,
+        "resy": 1000,
+        "chunk_size": 128,
+    }
+    store = str(tmp_path / "soilgrids.zarr")
+    soilgrids = SoilGrids()
+
+    soilgrids.get_coverage_zarr(
+        "phh2o",
+        store=store,
+        depths=["0-5cm", "5-15cm", "15-30cm"],
+        statistics=["mean", "Q0.5"],
+        max_workers=3,
+        **request,
+    )
+    dataset = soilgrids.get_coverage_zarr("clay", store=store, **request)
+
+    assert dataset["phh2o"].dims == ("statistic", "depth", "y", "x")
+    assert dataset["phh2o"].shape == (2, 3, 507, 644)
+    assert dataset["clay"].shape == (2, 3, 507, 644)
+    assert list(dataset["depth_top"].values) == [0.0, 5.0, 15.0]
+    assert dataset["phh2o"].attrs["coverage_id"][1][2] == "phh2o_15-30cm_Q0.5"
+    assert dataset["clay"].attrs["variable_name"] == "Clay content"
+    assert soilgrids.metadata["service_id"] == "clay"
+    assert soilgrids.metadata["grid_res"] == [1000, 1000]
+
+    single = soilgrids.get_coverage_data(
+        service_id="phh2o",
+        coverage_id="phh2o_5-15cm_Q0.5",
+        output=str(tmp_path / "single.tif"),
+        **{key: value for key, value in request.items() if key != "chunk_size"},
+    )
+    numpy.testing.assert_array_equal(
+        dataset["phh2o"].sel(statistic="Q0.5", depth="5-15cm").values,
+        single.values[0],
+    )
+    assert CRS.from_wkt(dataset["spatial_ref"].attrs["crs_wkt"]) == single.rio.crs
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".")]
+
+    with pytest.raises(ValueError):
+        soilgrids.get_coverage_zarr("sand", store=store, depths=["0-5cm"], **request)
+    with pytest.raises(SoilGridsError):
+        soilgrids.get_coverage_zarr("sand", store=store, **dict(request, resx=500))
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+@pytest.mark.parametrize("coverage_cache_size", [2**30, 0])
+def test_local_file_reuses_downloads(wcs_server, tmp_path, coverage_cache_size):
+    request = {
+        "service_id": "phh2o",
+        "coverage_id": "phh2o_0-5cm_mean",
+        "crs": "urn:ogc:def:crs:EPSG::152160",
+        "west": -1784000,
+        "south": 1356000,
+        "east": -1140000,
+        "north": 1863000,
+        "output": str(tmp_path / "test.tif"),
+    }
+    # downloads too large for the coverage cache are reused all the same
+    soilgrids = SoilGrids(coverage_cache_size=coverage_cache_size)
+
+    soilgrids.get_coverage_data(**request)
+    mtime = os.path.getmtime(tmp_path / "test.tif")
+    soilgrids.get_coverage_data(local_file=True, **request)
+
+    assert wcs_server.count("GetCoverage") == 1
+    assert os.path.getmtime(tmp_path / "test.tif") == mtime
+
+
+def test_windows_are_cropped_from_cached_coverages(wcs_server, tmp_path):
+    soilgrids = SoilGrids()
+
+    def get_data(output, west, south, east, north, local_file=True, **kwargs):
+        return soilgrids.get_coverage_data(
+            service_id="phh2o",
+            coverage_id="phh2o_0-5cm_mean",
+            crs=kwargs.pop("crs", "urn:ogc:def:crs:EPSG::152160"),
+            west=west,
+            south=south,
+            east=east,
+            north=north,
+            output=str(tmp_path / output),
+            local_file=local_file,
+            **{"resx": 1000, "resy": 1000, **kwargs},
+        )
+
+    get_data("large.tif", -1784000, 1356000, -1140000, 1863000)
+    window = (-1500000, 1500000, -1300000, 1700000)
+
+    cropped = get_data("cropped.tif", *window)
+    assert wcs_server.count("GetCoverage") == 1
+
+    expected = get_data("expected.tif", *window, local_file=False)
+    assert wcs_server.count("GetCoverage") == 2
+    numpy.testing.assert_array_equal(cropped.values, expected.values)
+    assert cropped.rio.transform() == expected.rio.transform()
+    assert cropped.rio.crs == expected.rio.crs
+    assert cropped.rio.nodata == expected.rio.nodata
+
+    # off the grid, at another resolution or outside of the cached coverage
+    get_data("shifted.tif", -1500500, 1500000, -1300500, 1700000)
+    get_data("coarse.tif", *window, resx=2000, resy=2000)
+    get_data("outside.tif", -1900000, 1500000, -1300000, 1700000)
+    assert wcs_server.count("GetCoverage") == 5
+
+
+def download_from_process(map_services, output):
+    SoilGrids.MAP_SERVICES = map_services
+    SoilGrids().get_coverage_data(
+        service_id="phh2o",
+        coverage_id="phh2o_0-5cm_mean",
+        crs="urn:ogc:def:crs:EPSG::152160",
+        west=-1784000,
+        south=1356000,
+        east=-1140000,
+        north=1863000,
+        output=output,
+        local_file=True,
+    ).close()
+
+
+@pytest.mark.filterwarnings("ignore:numpy.ufunc size")
+def test_processes_share_downloads_through_the_cache(wcs_server, tmp_path):
+    outputs = [str(tmp_path / f"process-{index}.tif") for index in range(2)]
+    with ProcessPoolExecutor(
+        max_workers=len(outputs), mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        for future in [
+            executor.submit(download_from_process, wcs_server.map_services(), output)
+            for output in outputs
+        ]:
+            future.result()
+
+    assert wcs_server.count("GetCoverage") == 1
+    with rasterio.open(outputs[0]) as first:
+        for output in outputs[1:]:
+            with rasterio.open(output) as other:
+                numpy.testing.assert_array_equal(other.read(), first.read())
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".")]